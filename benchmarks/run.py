@@ -0,0 +1,227 @@
+"""
+Benchmark of the transformations pipeline at portfolio scale.
+
+Every stage runs on synthetic property tables built from the REAL_ESTATE_INPUTS defaults, is timed (best of --repeat runs)
+and its peak memory measured with tracemalloc in a separate run. Results are compared with a stored baseline: a stage
+slower or heavier than --tolerance times its baseline, or whose checksum changed, is reported as a regression.
+Timings depend on the machine, so the baseline also records the machine, the library versions and the time of a fixed
+NumPy/Python calibration workload: baseline timings are scaled by the ratio of the calibration times before comparing.
+Storage round-trips go through gcp_connector with a utils.storage.LocalBackend, so no GCS credentials are needed.
+
+Usage:
+    python -m benchmarks.run                              # compare with benchmarks/baseline.json
+    python -m benchmarks.run --sizes 1 100 --horizons 30  # quick run
+    python -m benchmarks.run --update-baseline            # record the current machine and code as the baseline
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from utils.display import style_yearly_cashflow_df
+from utils.financial import compute_cashflow_kpis
+from utils.inputs import REAL_ESTATE_INPUTS
+from utils.gcp_connector import download_dataframe, upload_dataframe, use_backend
+from utils.storage import LocalBackend
+from utils.transformations import build_cashflow_arrays, build_yearly_cashflow_df, create_additional_features
+
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+DEFAULT_SIZES = [1, 100, 10_000, 100_000]
+DEFAULT_HORIZONS = [10, 30, 50]
+DEFAULT_HISTORY = 5  # saved versions per property in the storage round-trips
+# The single-row pipeline runs once per property: larger sizes only time this many properties
+MAX_SINGLE_ROW_PROPERTIES = 1000
+
+
+def synthetic_real_estate_df(n_properties: int, n_versions: int = 1, seed: int = 0) -> pd.DataFrame:
+    """
+    Build a database-like table of n_properties * n_versions rows from the REAL_ESTATE_INPUTS defaults,
+    rates divided by 100 as in the Inputs form, with the prices, rates and durations jittered around them.
+    """
+    rng = np.random.default_rng(seed)
+    n_rows = n_properties * n_versions
+    columns = {}
+    for fields in REAL_ESTATE_INPUTS.values():
+        for field, (input_type, default) in fields.items():
+            value = default / 100 if input_type in ['percentage', 'rate'] else default
+            columns[field] = np.full(n_rows, value, dtype=object if input_type == 'text' else float)
+    columns['prix_d_achat'] = columns['prix_d_achat'] * rng.uniform(0.5, 2, n_rows)
+    columns['valeur_vénale'] = columns['prix_d_achat'] * rng.uniform(0.9, 1.3, n_rows)
+    columns['loyer_mensuel'] = columns['loyer_mensuel'] * rng.uniform(0.5, 2, n_rows)
+    columns['taux_d_emprunt'] = rng.uniform(0.005, 0.05, n_rows)
+    columns['durée_de_crédit_(année)'] = rng.integers(5, 26, n_rows)
+    columns['durée_de_détention_(année)'] = rng.integers(1, 31, n_rows)
+    ids = np.repeat([f"property_{i}" for i in range(n_properties)], n_versions)
+    timestamps = pd.Timestamp("2024-01-01") + pd.to_timedelta(np.tile(np.arange(n_versions), n_properties), unit="D")
+    return pd.DataFrame({'real_estate_id': ids, 'timestamp': timestamps, **columns})
+
+
+def _measure(function, repeat):
+    """Best wall time over repeat runs, then the peak traced memory of one more run"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(timings), peak, result
+
+
+def _calibration_workload():
+    """Fixed workload independent of the repo code (NumPy sort, matmul and ufuncs, a Python loop), timed on every run"""
+    values = np.random.default_rng(0).random((1000, 1000))
+    np.sort(values, axis=1)
+    values @ values[:, :100]
+    np.exp(values).sum()
+    return sum(i * i for i in range(200_000))
+
+
+def machine_info():
+    """Describe the machine and the library versions the timings were measured with"""
+    import pyarrow
+
+    return {
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'pyarrow': pyarrow.__version__,
+    }
+
+
+def _round_trip(df, filename):
+    """Upload a dataframe and download it back (the upload invalidates the cached copies, so the file is read again)"""
+    upload_dataframe(df, filename)
+    return download_dataframe(filename)
+
+
+def _checksum(values):
+    return float(np.nansum(np.asarray(values, dtype=float)))
+
+
+def run_benchmarks(sizes, horizons, history=DEFAULT_HISTORY, repeat=3):
+    """Return {stage name: {'seconds', 'peak_bytes', 'checksum'}} for every stage, size and horizon"""
+    results = {}
+
+    def record(name, function, checksum=_checksum, repeat=repeat):
+        if name in results:
+            return
+        seconds, peak_bytes, result = _measure(function, repeat)
+        results[name] = {'seconds': seconds, 'peak_bytes': peak_bytes, 'checksum': checksum(result)}
+        print(f"{name:<55} {seconds * 1000:>10.2f} ms {peak_bytes / 2 ** 20:>10.2f} MiB", flush=True)
+
+    with tempfile.TemporaryDirectory() as directory:
+        use_backend(LocalBackend(directory))
+        for size in sizes:
+            raw_df = synthetic_real_estate_df(size)
+            real_estate_df = create_additional_features(raw_df)
+            record(f"create_additional_features/n={size}", lambda: create_additional_features(raw_df),
+                   checksum=lambda df: _checksum(df['mensualité']))
+            for horizon in horizons:
+                record(f"build_cashflow_arrays/n={size}/T={horizon}", lambda: build_cashflow_arrays(real_estate_df, horizon),
+                       checksum=lambda lines: _checksum(lines['net_cash_flow']))
+            lines = build_cashflow_arrays(real_estate_df)
+            record(f"compute_cashflow_kpis/n={size}", lambda: compute_cashflow_kpis(lines, real_estate_df),
+                   checksum=lambda kpis: _checksum(kpis['van']))
+            single_rows = [real_estate_df.iloc[[i]].reset_index(drop=True) for i in range(min(size, MAX_SINGLE_ROW_PROPERTIES))]
+            record(f"build_yearly_cashflow_df/n={len(single_rows)}", lambda: [build_yearly_cashflow_df(row) for row in single_rows],
+                   checksum=lambda dfs: sum(_checksum(df['net_cash_flow']) for df in dfs))
+            history_df = synthetic_real_estate_df(size, history)
+            for extension in ['csv', 'parquet']:
+                record(f"round_trip_{extension}/n={size}/history={history}",
+                       lambda: _round_trip(history_df, f"database.{extension}"),
+                       checksum=lambda df: _checksum(df['prix_d_achat']))
+        one_property = create_additional_features(synthetic_real_estate_df(1))
+        for horizon in horizons:
+            yearly_cashflow_df = build_yearly_cashflow_df(one_property, horizon)
+            record(f"style_yearly_cashflow_df/T={horizon}", lambda: style_yearly_cashflow_df(yearly_cashflow_df).to_html(),
+                   checksum=len)
+    return results
+
+
+def compare_with_baseline(results, baseline, tolerance, speed_ratio=1.):
+    """
+    Return the regressions of results against a baseline, as human readable lines.
+    speed_ratio: calibration time of this run over the baseline's, the baseline timings being scaled by it
+    """
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        expected = reference['seconds'] * speed_ratio
+        if result['seconds'] > tolerance * expected and result['seconds'] - expected > 5e-3:
+            regressions.append(f"{name}: {result['seconds'] * 1000:.2f} ms instead of {expected * 1000:.2f} ms "
+                               f"({reference['seconds'] * 1000:.2f} ms on the baseline machine)")
+        if result['peak_bytes'] > tolerance * reference['peak_bytes'] and result['peak_bytes'] - reference['peak_bytes'] > 2 ** 20:
+            regressions.append(f"{name}: peak {result['peak_bytes'] / 2 ** 20:.2f} MiB instead of {reference['peak_bytes'] / 2 ** 20:.2f} MiB")
+        if not np.isclose(result['checksum'], reference['checksum'], rtol=1e-9):
+            regressions.append(f"{name}: checksum {result['checksum']!r} instead of {reference['checksum']!r}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the transformations pipeline on synthetic portfolios")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="numbers of properties")
+    parser.add_argument("--horizons", type=int, nargs="+", default=DEFAULT_HORIZONS, help="projection horizons in years")
+    parser.add_argument("--history", type=int, default=DEFAULT_HISTORY, help="saved versions per property in the round-trips")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per stage, the best one is kept")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline JSON file")
+    parser.add_argument("--tolerance", type=float, default=2., help="allowed ratio to the baseline time and memory")
+    parser.add_argument("--update-baseline", action="store_true", help="write the results as the new baseline")
+    args = parser.parse_args(argv)
+
+    machine = machine_info()
+    calibration_seconds = _measure(_calibration_workload, args.repeat)[0]
+    print(f"{'calibration':<55} {calibration_seconds * 1000:>10.2f} ms", flush=True)
+    results = run_benchmarks(args.sizes, args.horizons, args.history, args.repeat)
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    if args.update_baseline:
+        # Results of another machine (or library versions) are not comparable: they are replaced, not merged
+        previous = baseline['results'] if baseline is not None and baseline.get('machine') == machine else {}
+        if previous:
+            calibration_seconds = baseline['calibration_seconds']  # the merged timings share the first calibration
+        with open(args.baseline, "w") as f:
+            json.dump({
+                'updated': datetime.datetime.now().isoformat(timespec='seconds'),
+                'machine': machine,
+                'calibration_seconds': calibration_seconds,
+                'results': {**previous, **results},
+            }, f, indent=2, sort_keys=True)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+    if baseline is None:
+        print(f"No baseline at {args.baseline}, run with --update-baseline to record one")
+        return 0
+    for key, value in machine.items():
+        if baseline['machine'].get(key) != value:
+            print(f"Baseline {key}: {baseline['machine'].get(key)}, this run: {value}")
+    speed_ratio = calibration_seconds / baseline['calibration_seconds']
+    print(f"Baseline timings scaled by {speed_ratio:.2f}, the ratio of the calibration times")
+    regressions = compare_with_baseline(results, baseline['results'], args.tolerance, speed_ratio)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    print(f"{len(regressions)} regression(s) against {args.baseline}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,7 +2,8 @@ import streamlit as st
 import pandas as pd
 import datetime
 from utils.inputs import REAL_ESTATE_INPUTS
-from utils.gcp_connector import download_dataframe, upload_dataframe
+from utils.database import append_real_estate
+from utils.bulk_import import LISTING_EXTENSIONS, import_listings
 from typing import Dict, Any
 
 
@@ -100,25 +101,57 @@ def save_real_estate():
     with footer_cols[1]:
         upload_btn = st.button("Upload real estate data", type='primary', key='upload_btn', disabled=not agreed)
     if upload_btn:
-        df0 = download_dataframe("02data.csv")
-        
         real_estate_df = st.session_state['real_estate_df'].copy()
         real_estate_df['timestamp'] = today
         real_estate_df['real_estate_id'] = real_estate_id if real_estate_id != "Default" else real_estate_df.iloc[0]['adresse']
-        df_updated = pd.concat([df0, real_estate_df], ignore_index=True)
 
-        upload_dataframe(df_updated, "02data.csv")
+        append_real_estate(real_estate_df)
         st.markdown("Sauvegarde réussie !")
 
 
+def bulk_import_real_estates():
+    st.markdown(
+        """
+            Importer un fichier CSV (séparateur "," ou ";") ou JSON d'annonces, une ligne par bien et une colonne par input.
+            Les colonnes absentes ou vides prennent les valeurs par défaut du formulaire, les pourcentages sont saisis comme dans le formulaire (2.72 pour 2.72%).
+            L'id du bien est la colonne real_estate_id (Default: Adresse).
+        """
+    )
+    uploaded_file = st.file_uploader("Fichier d'annonces", type=LISTING_EXTENSIONS)
+    footer_cols = st.columns([5,1])
+    dry_run = footer_cols[0].checkbox("Vérifier le fichier sans l'importer", value=True)
+    with footer_cols[1]:
+        import_btn = st.button("Import", type='primary', key='import_btn', disabled=uploaded_file is None)
+    if not import_btn:
+        return
+    try:
+        with st.spinner("Import en cours..."):
+            report = import_listings(uploaded_file, uploaded_file.name, dry_run=dry_run)
+    except ValueError as e:
+        st.error(str(e))
+        return
+    if dry_run:
+        st.info(f"{report['imported']} biens valides, rien n'a été importé")
+    else:
+        st.success(f"{report['imported']} biens importés !")
+    if report['ignored_columns']:
+        st.warning(f"Colonnes ignorées : {', '.join(report['ignored_columns'])}")
+    if not report['errors'].empty:
+        st.error(f"{report['errors']['row'].nunique()} lignes rejetées")
+        st.dataframe(report['errors'], use_container_width=True)
+        st.download_button("Télécharger le rapport d'erreurs", report['errors'].to_csv(index=False), file_name="import_errors.csv", mime="text/csv")
+
+
 def input_tabs():
-    tab_informations, tab_save_real_estate = st.tabs(['Informations relatif au bien', "Sauvegarder le bien"])
+    tab_informations, tab_save_real_estate, tab_bulk_import = st.tabs(['Informations relatif au bien', "Sauvegarder le bien", "Import en masse"])
     with tab_informations:
         df = create_real_estate_input_forms(REAL_ESTATE_INPUTS)
         st.session_state['real_estate_df'] = df
         display_inputs()
     with tab_save_real_estate:
         save_real_estate()
+    with tab_bulk_import:
+        bulk_import_real_estates()
 
 
 initialize_inputs()
@@ -1,39 +1,55 @@
 import streamlit as st
 import pandas as pd
 
-from utils.gcp_connector import download_dataframe
-from utils.transformations import build_yearly_cashflow_df, create_additional_features
+from utils.widgets import performance_panel, query_real_estate_df
+from utils.tracing import span
+from utils.display import render_yearly_cashflow
+from utils.transformations import create_additional_features
+from utils.monthly_cashflow import FRENCH_EARLY_REPAYMENT_PENALTY, build_monthly_cashflow_df
+from utils.history import diff_versions, list_versions
 
 st.set_page_config(page_title="🔢 Checks", page_icon="🔢", layout="wide")
 
 
 def display_checks(real_estate_df: pd.DataFrame):
-    yearly_cashflow_df = build_yearly_cashflow_df(real_estate_df)
+    # Memoized on the property inputs: unchanged reruns reuse the rendered table
+    with span("render.styler"):
+        yearly_cashflow_df, styled_html = render_yearly_cashflow(real_estate_df)
     st.session_state['yearly_cashflow_df'] = yearly_cashflow_df
-    def color_negative_red(val):
-        color = 'red' if val < 0 else 'black'
-        return f'color: {color}'
-
-    def highlight_rows(s):
-        is_highlight = s.name in ["gross_effective_revenues", "total_charges_récurrantes", "net_operating_income", "total_non_recurring_charges", "cash_flow_after_debt", "valeur_nette_de_sortie", "net_cash_flow"]
-        return ['font-weight: bold; background-color: #e6f2ff' if is_highlight else '' for _ in s]
-
-    styled_df = yearly_cashflow_df.T.round().astype(int).style.map(color_negative_red).apply(highlight_rows, axis=1)
     
     # Create a scrollable container for the dataframe
     st.markdown(
         f"""
         <div style="max-height: 500px; overflow-y: scroll;">
-            {styled_df.to_html()}
+            {styled_html}
         """,
         unsafe_allow_html=True
     )
 
 
-def query_real_estate_df():
-    real_estate_df = download_dataframe("02data.csv")
-    real_estate_id = st.selectbox("Select a real estate", real_estate_df['real_estate_id'].unique())
-    return real_estate_df[real_estate_df['real_estate_id'] == real_estate_id].sort_values('timestamp', ascending=False).iloc[:1].reset_index(drop=True)
+def display_monthly_checks(real_estate_df: pd.DataFrame):
+    detention_months = int(real_estate_df.loc[0, 'durée_de_détention_(année)']) * 12
+    col1, col2 = st.columns(2)
+    # Detentions over the 30-year projection are allowed: the property is then held until its end
+    exit_month = col1.number_input("Mois de vente", min_value=1, max_value=max(360, detention_months), value=detention_months)
+    with_penalty = col2.checkbox("Indemnités de remboursement anticipé (6 mois d'intérêts, 3% max)")
+    monthly_cashflow_df = build_monthly_cashflow_df(
+        real_estate_df,
+        exit_month=exit_month,
+        early_repayment_penalty=FRENCH_EARLY_REPAYMENT_PENALTY if with_penalty else None
+    )
+    st.dataframe(monthly_cashflow_df.T.round().astype(int), height=500)
+
+
+def display_history(real_estate_id):
+    versions = list_versions(real_estate_id)
+    st.dataframe(versions.set_index('version')[['timestamp']], use_container_width=True)
+    if len(versions) < 2:
+        return
+    col1, col2 = st.columns(2)
+    before = col1.selectbox("Version", versions['version'], index=len(versions) - 2)
+    after = col2.selectbox("Compared with", versions['version'], index=len(versions) - 1)
+    st.dataframe(diff_versions(versions, before, after), use_container_width=True)
 
 
 st.title("📈 Checks")
@@ -44,6 +60,11 @@ It is a yearly cashflow, with a row for each year of the time horizon and the fo
 
 # Add a refresh button
 st.button("Refresh")
-real_estate_df = query_real_estate_df()
-real_estate_df = create_additional_features(real_estate_df.copy())
-display_checks(real_estate_df)
+with performance_panel("checks"):
+    real_estate_df = query_real_estate_df()
+    real_estate_df = create_additional_features(real_estate_df.copy())
+    display_checks(real_estate_df)
+    if st.checkbox("Vue mensuelle"):
+        display_monthly_checks(real_estate_df)
+    if st.checkbox("Historique des versions"):
+        display_history(real_estate_df.loc[0, 'real_estate_id'])
@@ -1,13 +1,36 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
-from utils.gcp_connector import download_dataframe
-import numpy_financial as npf
+from utils.widgets import performance_panel, query_real_estate_df
+from utils.database import load_latest_index
+from utils.tracing import span
 st.set_page_config(page_title="📊 Comparaison", page_icon="📊", layout="wide")
 
 # Import necessary functions from Checks.py
-from utils.transformations import create_additional_features, build_yearly_cashflow_df
+from utils.transformations import CASHFLOW_LINES, cashflow_state, lines_to_yearly_cashflow_df
+from utils.sensitivity import compute_sensitivity_surface
+from utils.schema import content_hashes, records_from_df
+from utils.monte_carlo import simulate, summarize_simulation
+from utils.goal_seek import GOAL_SEEK_VARIABLES, goal_seek
+from utils.comparison import COMPARISON_PARAMETERS, compare_properties
+
+SENSITIVITY_KPIS = {
+    'irr': "IRR (Internal Rate of Return)",
+    'van': "VAN (Valeur Actuelle Nette)",
+    'eqx': "EqX",
+    'min_cash_flow': "Min of Net Cash Flow (excluding contribution)",
+}
+
+COMPARISON_FORMATS = {
+    'durée_de_détention_(année)': "{:.0f}",
+    'irr': "{:.2%}",
+    'van': "€{:,.0f}",
+    'eqx': "{:,.2f}x",
+    'min_cash_flow': "€{:,.0f}",
+    'cash_on_cash': "{:.2%}",
+}
 
 def load_css():
     st.markdown("""
@@ -24,31 +47,54 @@ def load_css():
         </style>
     """, unsafe_allow_html=True)
 
-def query_real_estate_df():
-    real_estate_df = download_dataframe("02data.csv")
-    real_estate_id = st.selectbox("Select a real estate", real_estate_df['real_estate_id'].unique())
-    return real_estate_df[real_estate_df['real_estate_id'] == real_estate_id].sort_values('timestamp', ascending=False).iloc[:1].reset_index(drop=True)
+@st.cache_resource(max_entries=32, show_spinner="Computing the sensitivity surface...")
+def get_sensitivity_surface(real_estate_df):
+    # Cached per property version: the dataframe content is part of the cache key
+    return compute_sensitivity_surface(real_estate_df)
+
+# Inputs changed by the sliders, pushed into the property's cashflow graph on every rerun
+SLIDER_INPUTS = ['durée_de_détention_(année)', 'durée_de_crédit_(année)', 'taux_d_emprunt', 'taux_d_actualisation']
+
+def get_cashflow_state(real_estate_df):
+    # One memoized cashflow graph per session for the selected property version: a slider move only recomputes
+    # the lines and KPIs depending on it (e.g. the discount rate only changes the VAN)
+    # Keyed on the saved inputs (the timestamp only holds the day of the save), the slider inputs being pushed below
+    version = (real_estate_df.loc[0, 'real_estate_id'], int(content_hashes(real_estate_df, exclude=SLIDER_INPUTS)[0]))
+    if st.session_state.get('cashflow_state_version') != version:
+        st.session_state['cashflow_state'] = cashflow_state(records_from_df(real_estate_df))
+        st.session_state['cashflow_state_version'] = version
+    state = st.session_state['cashflow_state']
+    state.update(**{name: np.array([[float(real_estate_df.loc[0, name])]]) for name in SLIDER_INPUTS})
+    return state
 
-def create_kpi_metrics(df, real_estate_df):
+@st.cache_data(max_entries=32, show_spinner=False)
+def get_goal_seek(real_estate_df, variable, kpi, target):
+    # Cached on the property inputs (sliders included) and the target, so unrelated widgets do not rerun the search
+    return goal_seek(real_estate_df, variable, kpi, target).iloc[0]
+
+@st.cache_data(max_entries=16, show_spinner="Simulating...")
+def get_simulation(real_estate_df, n_paths, seed):
+    # Large runs are spread over every core, chunks keep the memory bounded
+    return simulate(real_estate_df, n_paths=n_paths, seed=seed, n_workers=None if n_paths > 100_000 else 1)
+
+def create_kpi_metrics(df, real_estate_df, kpis):
     detention_period  = real_estate_df.loc[0, 'durée_de_détention_(année)']
-    actualisation_rate = real_estate_df.loc[0, 'taux_d_actualisation']
     apport = real_estate_df.loc[0, 'apport']
     st.markdown("## Key metrics after detention period")
     col1, col2, col3, col4 = st.columns(4)
     with col1:
         st.metric("Net Cash Flow", f"€{df['cumulative_net_cash_flow'][f'year_{detention_period}']:,.0f}")
     with col2:
-        st.metric("IRR (Internal Rate of Return)", f"{100 * npf.irr(df['net_cash_flow'].to_list()):,.2f}%")
+        st.metric("IRR (Internal Rate of Return)", f"{100 * kpis['irr']:,.2f}%")
     with col3:
-        st.metric("VAN (Valeur Actuelle Nette)", f"{npf.npv(actualisation_rate, df['net_cash_flow'].to_list()):,.2f}€")
+        st.metric("VAN (Valeur Actuelle Nette)", f"{kpis['van']:,.2f}€")
     with col4:
-        st.metric("EqX", f"{df['cumulative_net_cash_flow'][f'year_{detention_period}']/apport:,.2f}x")
+        st.metric("EqX", f"{kpis['eqx']:,.2f}x")
     
     st.markdown("## Key metrics over the investment period")
     buffer, col1, col2, col3, buffer = st.columns(5)
     with col1:
-        min_net_cash_flow = df.loc[df.index > 'year_0', 'net_cash_flow'].min()
-        st.metric("Min of Net Cash Flow (excluding contribution)", f"€{min_net_cash_flow:,.0f}")
+        st.metric("Min of Net Cash Flow (excluding contribution)", f"€{kpis['min_cash_flow']:,.0f}")
     with col2:
         min_cumulative_net_cash_flow = df.loc[df.index > 'year_0', 'cumulative_net_cash_flow'].min() + apport
         st.metric("Min of Cumulative Net Cash Flow", f"€{min_cumulative_net_cash_flow:,.0f}")
@@ -56,6 +102,10 @@ def create_kpi_metrics(df, real_estate_df):
         mean_net_cash_flow = df.loc[(df.index > 'year_0')&(df.index < f'year_{detention_period}'), 'net_cash_flow'].mean()
         st.metric("Mean of Net Cash Flow", f"€{mean_net_cash_flow:,.0f}")
 
+def plot_chart(fig):
+    with span("render.plotly"):
+        st.plotly_chart(fig, use_container_width=True)
+
 def create_cash_flow_chart(df, max_year):
     fig = make_subplots(specs=[[{"secondary_y": True}]])
     
@@ -95,13 +145,144 @@ def create_property_value_chart(df, max_year):
     
     return fig
 
-def main():
-    load_css()
-    st.title("📊 Real Estate Investment Comparison")
-    
+def create_sensitivity_heatmap(surface, kpi, credit_rate, actualisation_rate):
+    # The sliders are continuous: the heatmap shows the grid rates of the surface closest to them
+    axes = surface['axes']
+    rate_index = int(abs(axes['taux_d_emprunt'] - credit_rate).argmin())
+    values = surface[kpi][:, :, rate_index]
+    if kpi == 'van':
+        values = values[:, :, int(abs(axes['taux_d_actualisation'] - actualisation_rate).argmin())]
+    fig = go.Figure(go.Heatmap(
+        x=axes['durée_de_crédit_(année)'],
+        y=axes['durée_de_détention_(année)'],
+        z=100 * values if kpi == 'irr' else values,
+        colorscale="RdYlGn",
+        colorbar=dict(title="%" if kpi == 'irr' else "")
+    ))
+    fig.update_layout(
+        title_text=f"{SENSITIVITY_KPIS[kpi]} by credit duration and detention period",
+        xaxis_title="Durée de crédit (années)",
+        yaxis_title="Durée de détention (années)"
+    )
+    return fig
+
+def create_van_contour(surface, detention_period, credit_duration):
+    axes = surface['axes']
+    detention_index = int(abs(axes['durée_de_détention_(année)'] - detention_period).argmin())
+    duration_index = int(abs(axes['durée_de_crédit_(année)'] - credit_duration).argmin())
+    fig = go.Figure(go.Contour(
+        x=100 * axes['taux_d_emprunt'],
+        y=100 * axes['taux_d_actualisation'],
+        z=surface['van'][detention_index, duration_index].T,
+        colorscale="RdYlGn",
+        contours=dict(showlabels=True)
+    ))
+    fig.update_layout(
+        title_text="VAN by credit rate and discount rate",
+        xaxis_title="Taux d'emprunt (en %)",
+        yaxis_title="Taux d'actualisation (en %)"
+    )
+    return fig
+
+def create_risk_simulation(real_estate_df):
+    st.subheader("Risk simulation (Monte Carlo)")
+    st.markdown("Market value growth, rent growth, property tax growth, vacancy and unpaid rents are drawn every year around the property's hypotheses.")
+    col1, col2, col3 = st.columns([2, 2, 1])
+    n_paths = col1.select_slider("Number of paths", options=[1_000, 10_000, 50_000, 200_000], value=10_000)
+    seed = col2.number_input("Seed", value=0, step=1)
+    if not col3.checkbox("Run simulation"):
+        return
+    results = get_simulation(real_estate_df, n_paths, int(seed))
+    summary = summarize_simulation(results)
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Median IRR", f"{100 * summary['percentiles'].loc['irr', 'p50']:,.2f}%")
+    with col2:
+        st.metric("VAN 5th percentile", f"{summary['percentiles'].loc['van', 'p5']:,.0f}€")
+    with col3:
+        st.metric("Probability of negative cumulative cash flow", f"{100 * summary['probability_negative_cash_flow']:,.1f}%")
+    st.dataframe(summary['percentiles'].style.format("{:,.4f}", subset=pd.IndexSlice['irr', :]).format("{:,.0f}", subset=pd.IndexSlice[['van', 'cumulative_net_cash_flow', 'max_drawdown'], :]))
+    fig = go.Figure(go.Histogram(x=100 * results['irr'], nbinsx=100))
+    fig.update_layout(title_text="IRR distribution", xaxis_title="IRR (%)", yaxis_title="Paths")
+    plot_chart(fig)
+
+def create_goal_seek(real_estate_df):
+    st.subheader("Negotiation (goal seek)")
+    col1, col2, col3 = st.columns(3)
+    variable = col1.selectbox("Input", list(GOAL_SEEK_VARIABLES), format_func=lambda name: f"{GOAL_SEEK_VARIABLES[name]} {name}")
+    kpi = col2.selectbox("Target KPI", list(SENSITIVITY_KPIS), format_func=SENSITIVITY_KPIS.get, key="goal_seek_kpi")
+    target = col3.number_input("Target (IRR in %)" if kpi == 'irr' else "Target", value=5.0 if kpi == 'irr' else 0.0)
+    result = get_goal_seek(real_estate_df, variable, kpi, target / 100 if kpi == 'irr' else target)
+    if result['status'] == 'infeasible':
+        st.warning(f"No {variable} within the search bounds reaches this target")
+    else:
+        st.metric(f"{GOAL_SEEK_VARIABLES[variable].capitalize()} {variable}", f"€{result['value']:,.0f}",
+                  delta=f"{result['value'] - real_estate_df.loc[0, variable]:,.0f}€")
+        if result['status'] == 'bound':
+            st.caption("The target is reached over the whole search interval, the value is its bound")
+
+def create_comparison_cash_flow_chart(lines):
+    fig = make_subplots(specs=[[{"secondary_y": True}]])
+    for real_estate_id in lines['net_cash_flow'].index:
+        fig.add_trace(
+            go.Bar(x=lines['net_cash_flow'].columns, y=lines['net_cash_flow'].loc[real_estate_id], name=f"{real_estate_id} - Net Cash Flow", legendgroup=real_estate_id),
+            secondary_y=False,
+        )
+        fig.add_trace(
+            go.Scatter(x=lines['cumulative_net_cash_flow'].columns, y=lines['cumulative_net_cash_flow'].loc[real_estate_id], name=f"{real_estate_id} - Cumulative", legendgroup=real_estate_id),
+            secondary_y=True,
+        )
+    fig.update_layout(
+        title_text="Cash Flow Over Time",
+        xaxis_title="Year",
+        barmode="group",
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
+    )
+    fig.update_yaxes(title_text="Net Cash Flow", secondary_y=False)
+    fig.update_yaxes(title_text="Cumulative Net Cash Flow", secondary_y=True)
+    return fig
+
+def create_comparison_property_value_chart(lines):
+    fig = go.Figure()
+    for real_estate_id in lines['valeur_vénale'].index:
+        fig.add_trace(go.Scatter(x=lines['valeur_vénale'].columns, y=lines['valeur_vénale'].loc[real_estate_id], name=f"{real_estate_id} - Property Value", legendgroup=real_estate_id))
+        fig.add_trace(go.Scatter(x=lines['capital_restant_dû'].columns, y=-lines['capital_restant_dû'].loc[real_estate_id], name=f"{real_estate_id} - Remaining Debt", legendgroup=real_estate_id, line=dict(dash="dash")))
+    fig.update_layout(
+        title_text="Property Value vs Remaining Debt",
+        xaxis_title="Year",
+        yaxis_title="Amount (€)",
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
+    )
+    return fig
+
+def create_comparison():
+    latest_df = load_latest_index()
+    real_estate_ids = latest_df.index.tolist()
+    selected_ids = st.multiselect("Select real estates to compare", real_estate_ids, default=real_estate_ids[:2])
+    if not selected_ids:
+        st.info("Select at least one real estate")
+        return
+    parameters = None
+    if st.checkbox("Same hypotheses for every real estate"):
+        col1, col2 = st.columns(2)
+        values = [
+            col1.slider("Durée de détention (années)", 1, 30, 15, key="comparison_detention"),
+            col1.slider("Durée de crédit (années)", 1, 30, 25, key="comparison_credit_duration"),
+            col2.slider("Taux d'emprunt (en %)", 0.0, 5.0, 3.0, step=0.05, key="comparison_credit_rate") / 100,
+            col2.slider("Taux d'actualisation (en %)", 0.0, 10.0, 5.0, step=0.25, key="comparison_actualisation_rate") / 100,
+        ]
+        parameters = dict(zip(COMPARISON_PARAMETERS, values))
+    # Only the properties missing from the shared projections cache are computed, in one batch
+    comparison = compare_properties(latest_df.loc[selected_ids], parameters)
+
+    st.dataframe(comparison['kpis'].style.format(COMPARISON_FORMATS, na_rep="-"), use_container_width=True)
+    plot_chart(create_comparison_cash_flow_chart(comparison['lines']))
+    plot_chart(create_comparison_property_value_chart(comparison['lines']))
+
+def create_property_analysis():
     # Select real estate
     real_estate_df = query_real_estate_df()
-    
+    surface = get_sensitivity_surface(real_estate_df)
     
     col1, col2 = st.columns(2)
     
@@ -119,21 +300,44 @@ def main():
     real_estate_df.loc[0, 'taux_d_emprunt'] = credit_rate
     real_estate_df.loc[0, 'durée_de_crédit_(année)'] = credit_duration
     real_estate_df.loc[0, 'taux_d_actualisation'] = actualisation_rate
-    # Rebuild yearly_cashflow_df
-    rebuilt_real_estate_df = create_additional_features(real_estate_df.copy())
-    yearly_cashflow_df = build_yearly_cashflow_df(rebuilt_real_estate_df)
+    # Only the lines and KPIs depending on the moved sliders are recomputed
+    state = get_cashflow_state(real_estate_df)
+    kpis = {kpi: float(state[f'kpi:{kpi}'][0]) for kpi in SENSITIVITY_KPIS}
+    yearly_cashflow_df = lines_to_yearly_cashflow_df({line: state[f'cashflow:{line}'] for line in CASHFLOW_LINES}, detention_period)
     df = yearly_cashflow_df.T
     
-    create_kpi_metrics(yearly_cashflow_df, rebuilt_real_estate_df)
+    create_kpi_metrics(yearly_cashflow_df, real_estate_df, kpis)
     
     cash_flow_chart = create_cash_flow_chart(df.loc[['net_cash_flow', 'cumulative_net_cash_flow']].T, 30)
-    st.plotly_chart(cash_flow_chart, use_container_width=True)
+    plot_chart(cash_flow_chart)
     
     property_value_chart = create_property_value_chart(df.loc[['valeur_vénale', 'capital_restant_dû']].T, 30)
-    st.plotly_chart(property_value_chart, use_container_width=True)
+    plot_chart(property_value_chart)
+    
+    st.subheader("Sensitivity")
+    col1, col2 = st.columns(2)
+    with col1:
+        kpi = st.selectbox("KPI", list(SENSITIVITY_KPIS), format_func=SENSITIVITY_KPIS.get)
+        plot_chart(create_sensitivity_heatmap(surface, kpi, credit_rate, actualisation_rate))
+    with col2:
+        plot_chart(create_van_contour(surface, detention_period, credit_duration))
+    
+    create_goal_seek(real_estate_df)
+    
+    create_risk_simulation(real_estate_df)
     
     st.subheader("Detailed Cash Flow Table")
     st.dataframe(df.style.highlight_max(axis=0))
 
+def main():
+    load_css()
+    st.title("📊 Real Estate Investment Comparison")
+    tab_comparison, tab_details = st.tabs(["Comparison", "Property analysis"])
+    with tab_comparison:
+        create_comparison()
+    with tab_details:
+        create_property_analysis()
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with performance_panel("comparaison"):
+        main()
\ No newline at end of file
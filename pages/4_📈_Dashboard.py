@@ -1,15 +1,131 @@
 import streamlit as st
+import plotly.graph_objects as go
+
+from utils.database import get_latest_index_version, load_latest_index
+from utils.history import portfolio_as_of
+from utils.portfolio import compute_portfolio
+from utils.rate_paths import DEFAULT_LOAN, LOAN_TYPES, RATE_PATHS, stress_rate_paths
+from utils.widgets import performance_panel
 
 st.set_page_config(page_title="📈 Dashboard", page_icon="📈", layout="wide")
 
+KPI_FORMATS = {
+    'prix_d_achat': "€{:,.0f}",
+    'apport': "€{:,.0f}",
+    'irr': "{:.2%}",
+    'van': "€{:,.0f}",
+    'eqx': "{:,.2f}x",
+    'cash_on_cash': "{:.2%}",
+    'ltv': "{:.0%}",
+    'min_cash_flow': "€{:,.0f}",
+}
+
+@st.cache_data(max_entries=8, show_spinner="Computing the portfolio KPIs...")
+def get_portfolio(latest_index_version):
+    # Keyed on the generation of the latest index: recomputed only after a save
+    return compute_portfolio(load_latest_index())
+
+@st.cache_data(max_entries=8, show_spinner="Computing the portfolio KPIs as of this date...")
+def get_portfolio_as_of(date, latest_index_version):
+    # Reads the history: only used when a past date is selected
+    return portfolio_as_of(date)
+
+@st.cache_data(max_entries=8, show_spinner="Projecting the portfolio under the rate paths...")
+def get_rate_stress(latest_index_version, rate_paths, loan):
+    return stress_rate_paths(load_latest_index(), list(rate_paths), dict(loan))
+
+def filter_portfolio(kpis):
+    col1, col2, col3 = st.columns(3)
+    villes = sorted(kpis['ville'].dropna().unique()) if 'ville' in kpis else []
+    selected_villes = col1.multiselect("Ville", villes, default=villes)
+    min_irr = col2.number_input("Minimum IRR (en %)", value=-100.0, step=0.5)
+    sort_by = col3.selectbox("Sort by", list(KPI_FORMATS), index=list(KPI_FORMATS).index('irr'))
+    mask = kpis['irr'].fillna(-1) * 100 >= min_irr
+    if villes:
+        mask &= kpis['ville'].isin(selected_villes)
+    return kpis[mask].sort_values(sort_by, ascending=False)
+
+def create_portfolio_metrics(kpis):
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Properties", f"{len(kpis)}")
+    with col2:
+        st.metric("Total apport", f"€{kpis['apport'].sum():,.0f}")
+    with col3:
+        st.metric("Total VAN", f"€{kpis['van'].sum():,.0f}")
+    with col4:
+        st.metric("Median IRR", f"{100 * kpis['irr'].median():,.2f}%")
+
+def create_portfolio_cash_flow_chart(net_cash_flow):
+    yearly = net_cash_flow.sum(axis=0).to_frame('net_cash_flow').assign(cumulative_net_cash_flow=lambda x: x['net_cash_flow'].cumsum())
+    fig = go.Figure()
+    fig.add_trace(go.Bar(x=yearly.index, y=yearly['net_cash_flow'], name="Net Cash Flow"))
+    fig.add_trace(go.Scatter(x=yearly.index, y=yearly['cumulative_net_cash_flow'], name="Cumulative Net Cash Flow", yaxis="y2"))
+    fig.update_layout(
+        title_text="Portfolio cash flow by year since acquisition",
+        xaxis_title="Year",
+        yaxis=dict(title="Net Cash Flow"),
+        yaxis2=dict(title="Cumulative Net Cash Flow", overlaying="y", side="right"),
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
+    )
+    return fig
+
+def create_irr_van_chart(kpis):
+    fig = go.Figure(go.Scatter(
+        x=100 * kpis['irr'],
+        y=kpis['van'],
+        mode="markers",
+        text=kpis.index,
+        marker=dict(size=8 + 30 * kpis['apport'] / max(kpis['apport'].max(), 1))
+    ))
+    fig.update_layout(title_text="IRR vs VAN (size: apport)", xaxis_title="IRR (%)", yaxis_title="VAN (€)")
+    return fig
+
+def create_rate_stress():
+    col1, col2, col3, col4 = st.columns(4)
+    rate_paths = col1.multiselect("Rate paths", list(RATE_PATHS), default=list(RATE_PATHS))
+    loan_type = col2.selectbox("Loan type", LOAN_TYPES, index=LOAN_TYPES.index(DEFAULT_LOAN['type']))
+    reset_years = col3.number_input("Reset every (years)", min_value=1, value=DEFAULT_LOAN['reset_years'])
+    cap = col4.number_input("Cap (en %)", min_value=0.0, value=100 * DEFAULT_LOAN['cap'], step=0.25)
+    renegotiation_year = col1.number_input("Renegotiation year (0 for none)", min_value=0, value=0)
+    if not rate_paths:
+        return
+    loan = {'type': loan_type, 'reset_years': reset_years, 'cap': cap / 100, 'renegotiation_year': renegotiation_year or None}
+    stress = get_rate_stress(get_latest_index_version(), tuple(rate_paths), tuple(loan.items()))
+    st.dataframe(stress['portfolio'].style.format(KPI_FORMATS | {'total_remboursements': "€{:,.0f}"}, na_rep="-"), use_container_width=True)
+
 def main():
-    st.title("🔢 Dashboard")
-    st.markdown("""
-    ## Dashboard Overview
-    This dashboard is designed to provide various visualizations and insights into the real estate data.
-    Several display options may be tried here, but please note that it is still a work in progress.
-    We appreciate your patience as we continue to improve and add more features.
-    """)
+    st.title("📈 Dashboard")
+    st.button("Refresh")
+    as_of_date = st.sidebar.date_input("As of", value=None, help="Show the portfolio as it was saved on this date")
+    if as_of_date is None:
+        portfolio = get_portfolio(get_latest_index_version())
+    else:
+        portfolio = get_portfolio_as_of(as_of_date, get_latest_index_version())
+    kpis = portfolio['kpis']
+    if kpis.empty:
+        st.info("No real estate saved yet" if as_of_date is None else f"No real estate saved on {as_of_date}")
+        return
+
+    kpis = filter_portfolio(kpis)
+    create_portfolio_metrics(kpis)
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.plotly_chart(create_portfolio_cash_flow_chart(portfolio['net_cash_flow'].loc[kpis.index]), use_container_width=True)
+    with col2:
+        st.plotly_chart(create_irr_van_chart(kpis), use_container_width=True)
+
+    st.subheader("KPIs by property")
+    st.dataframe(kpis.style.format(KPI_FORMATS, na_rep="-"), use_container_width=True)
+
+    with st.expander("Whole portfolio yearly cash flow"):
+        st.dataframe(portfolio['yearly'].T.round().astype('Int64'))  # NaN when the properties' horizons differ
+
+    if as_of_date is None:
+        with st.expander("Interest rate stress"):
+            create_rate_stress()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with performance_panel("dashboard"):
+        main()
@@ -0,0 +1,76 @@
+import numpy as np
+import numpy_financial as npf
+import pandas as pd
+import pytest
+
+from utils.financial import IRR_BRACKET_GRID, irr, npv, solve_irr
+from utils.inputs import REAL_ESTATE_INPUTS
+from utils.transformations import build_yearly_cashflow_df, create_additional_features
+
+
+def synthetic_properties(n_properties, seed=1):
+    """Properties built from the REAL_ESTATE_INPUTS defaults (rates divided by 100 as in the Inputs form), prices, rent and durations jittered"""
+    rng = np.random.default_rng(seed)
+    columns = {
+        field: [default / 100 if input_type in ['percentage', 'rate'] else default] * n_properties
+        for fields in REAL_ESTATE_INPUTS.values()
+        for field, (input_type, default) in fields.items()
+    }
+    columns['prix_d_achat'] = np.array(columns['prix_d_achat']) * rng.uniform(0.5, 2, n_properties)
+    columns['loyer_mensuel'] = np.array(columns['loyer_mensuel']) * rng.uniform(0.5, 2, n_properties)
+    columns['taux_d_emprunt'] = rng.uniform(0.005, 0.05, n_properties)
+    columns['durée_de_détention_(année)'] = rng.integers(1, 31, n_properties)
+    return pd.DataFrame(columns)
+
+
+@pytest.fixture(scope="module")
+def net_cash_flows():
+    # Net cash flow series of build_yearly_cashflow_df, as the Analyse and Comparaison pages compute them, padded with
+    # zeros after the detention period (which changes neither the IRR nor the NPV)
+    real_estate_df = create_additional_features(synthetic_properties(40))
+    net_cash_flows = np.zeros((len(real_estate_df), 31))
+    for i in range(len(real_estate_df)):
+        net_cash_flow = build_yearly_cashflow_df(real_estate_df.iloc[[i]].reset_index(drop=True), time_horizon=30)['net_cash_flow']
+        net_cash_flows[i, :len(net_cash_flow)] = net_cash_flow.to_numpy(dtype=float)
+    return net_cash_flows
+
+
+def test_irr_matches_numpy_financial(net_cash_flows):
+    expected = np.array([npf.irr(cash_flow) for cash_flow in net_cash_flows])
+    rates, converged = solve_irr(net_cash_flows)
+    assert np.isfinite(expected).any()
+    np.testing.assert_allclose(rates, expected, rtol=0, atol=1e-8, equal_nan=True)
+    np.testing.assert_array_equal(converged, np.isfinite(expected))
+
+
+def test_npv_matches_numpy_financial(net_cash_flows):
+    rates = np.linspace(0, 0.1, len(net_cash_flows))
+    expected = [npf.npv(rate, cash_flow) for rate, cash_flow in zip(rates, net_cash_flows)]
+    np.testing.assert_allclose(npv(rates, net_cash_flows), expected, rtol=1e-12)
+
+
+def test_irr_of_one_series_is_a_scalar(net_cash_flows):
+    rate, converged = solve_irr(net_cash_flows[0])
+    assert np.ndim(rate) == 0 and np.ndim(converged) == 0
+    np.testing.assert_allclose(rate, npf.irr(net_cash_flows[0]), atol=1e-8, equal_nan=True)
+
+
+@pytest.mark.parametrize("cash_flows", [[100., 20., 30.], [-100., -20., -30.], [0., 0., 0.]], ids=["all_positive", "all_negative", "all_zero"])
+def test_irr_is_nan_without_sign_change(cash_flows):
+    rate, converged = solve_irr(np.array([cash_flows]))
+    assert np.isnan(rate).all() and not converged.any()
+    assert np.isnan(npf.irr(cash_flows))
+
+
+def test_irr_picks_the_root_closest_to_zero_like_numpy_financial():
+    # Roots at 10% and at 2,000%: the bracket closest to 0% on each side is refined and the smaller root kept
+    cash_flows = np.polynomial.polynomial.polyfromroots([1 / 1.1, 1 / 21.]) * -1
+    np.testing.assert_allclose(irr(cash_flows[None]), [npf.irr(cash_flows)], atol=1e-8)
+    np.testing.assert_allclose(irr(cash_flows[None]), [0.1], atol=1e-8)
+
+
+def test_irr_roots_beyond_the_bracket_grid_are_not_found():
+    # A single root at 2 * IRR_BRACKET_GRID[-1]: its NPV changes sign outside of the grid
+    rate = 2 * IRR_BRACKET_GRID[-1]
+    rates, converged = solve_irr(np.array([[-1., 1 + rate]]))
+    assert np.isnan(rates).all() and not converged.any()
@@ -0,0 +1,31 @@
+import math
+
+import numpy as np
+
+from benchmarks.run import synthetic_real_estate_df
+from utils.monte_carlo import _normal_cdf, simulate
+from utils.transformations import build_cashflow_arrays, create_additional_features
+
+
+def test_normal_cdf_matches_erf():
+    z = np.linspace(-8, 8, 1001)
+    expected = [0.5 * (1 + math.erf(value / math.sqrt(2))) for value in z]
+    assert _normal_cdf(z).dtype == float
+    np.testing.assert_allclose(_normal_cdf(z), expected, rtol=0, atol=1.5e-7)
+
+
+def test_uniform_draws_stay_within_bounds():
+    distributions = {'vacancy': {'distribution': 'uniform', 'low': 0.02, 'high': 0.1}}
+    results = simulate(synthetic_real_estate_df(1), n_paths=200, distributions=distributions)
+    assert len(results) == 200 and np.isfinite(results['van']).all()
+
+
+def test_max_drawdown_without_randomness_is_the_deterministic_one():
+    real_estate_df = synthetic_real_estate_df(1)
+    fixed = {name: {'distribution': 'fixed'} for name in ['market_value_growth', 'market_rent_growth', 'property_tax_growth', 'vacancy', 'loyers_impayés']}
+    results = simulate(real_estate_df, n_paths=3, distributions=fixed)
+    enriched = create_additional_features(real_estate_df)
+    cumulative = build_cashflow_arrays(enriched, 30)['cumulative_net_cash_flow'][0, :int(enriched['durée_de_détention_(année)'].iloc[0]) + 1]
+    expected = max(np.max(cumulative[:i + 1]) - cumulative[i] for i in range(len(cumulative)))
+    np.testing.assert_allclose(results['max_drawdown'], expected)
+    assert (results['max_drawdown'] >= 0).all()
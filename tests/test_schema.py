@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from benchmarks.run import synthetic_real_estate_df
+from utils.schema import PROPERTY_DTYPE, TEXT_FIELD_WIDTH, coerce_real_estate_df, records_from_df, records_to_df
+
+
+def test_records_keep_long_texts():
+    real_estate_df = synthetic_real_estate_df(2)
+    real_estate_df.loc[0, 'adresse'] = "12 " + "rue de la République " * 10
+    records = records_from_df(real_estate_df)
+    assert records.dtype['adresse'].itemsize > PROPERTY_DTYPE['adresse'].itemsize
+    assert records_to_df(records).loc[0, 'adresse'] == real_estate_df.loc[0, 'adresse']
+    np.testing.assert_array_equal(records['prix_d_achat'], real_estate_df['prix_d_achat'])
+
+
+def test_records_raise_rather_than_truncate_texts():
+    real_estate_df = synthetic_real_estate_df(1)
+    real_estate_df.loc[0, 'adresse'] = "x" * (TEXT_FIELD_WIDTH + 1)
+    with pytest.raises(ValueError, match="adresse"):
+        records_from_df(real_estate_df, PROPERTY_DTYPE)
+
+
+def test_missing_years_stay_missing():
+    real_estate_df = synthetic_real_estate_df(2)
+    real_estate_df['durée_de_crédit_(année)'] = [20, None]
+    coerced = coerce_real_estate_df(real_estate_df)
+    assert coerced['durée_de_crédit_(année)'].dtype == 'Int64'
+    assert coerced['durée_de_crédit_(année)'].isna().tolist() == [False, True]
+    np.testing.assert_array_equal(records_from_df(coerced)['durée_de_crédit_(année)'], [20., np.nan])
+
+
+def test_fractional_years_are_rejected():
+    real_estate_df = synthetic_real_estate_df(1).assign(**{'durée_de_crédit_(année)': 20.5})
+    with pytest.raises(ValueError, match="durée_de_crédit"):
+        coerce_real_estate_df(real_estate_df)
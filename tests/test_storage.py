@@ -0,0 +1,57 @@
+import pytest
+
+from utils import storage
+from utils.storage import GenerationMismatchError, LocalBackend, StorageBackend
+
+
+class TimingOutBackend(LocalBackend):
+    """
+    Local backend whose first put times out: after being written, as a lost response would be,
+    or before, another session writing the file meanwhile when concurrent_content is given
+    """
+
+    def __init__(self, root, concurrent_content=None):
+        super().__init__(root)
+        self.timeouts = 1
+        self.concurrent_content = concurrent_content
+
+    def put(self, name, content, content_type=None, if_generation_match=None):
+        if self.timeouts and self.concurrent_content is not None:
+            super().put(name, self.concurrent_content)
+        else:
+            generation = super().put(name, content, content_type, if_generation_match)
+        if self.timeouts:
+            self.timeouts -= 1
+            raise TimeoutError(name)
+        return generation
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(storage, "BACKOFF_SECONDS", 0)
+
+
+def test_storage_backend_is_abstract():
+    with pytest.raises(TypeError):
+        StorageBackend()
+
+
+def test_retried_put_confirms_its_own_timed_out_write(tmp_path):
+    backend = TimingOutBackend(tmp_path)
+    generation = backend.with_retry(backend.put, "file.csv", b"content", None, 0)
+    assert generation == backend.get_generation("file.csv")
+    assert backend.get("file.csv")[0] == b"content"
+
+
+def test_retried_put_still_fails_on_another_write(tmp_path):
+    backend = TimingOutBackend(tmp_path, concurrent_content=b"other content")
+    with pytest.raises(GenerationMismatchError):
+        backend.with_retry(backend.put, "file.csv", b"content", None, 0)
+    assert backend.get("file.csv")[0] == b"other content"
+
+
+def test_first_put_mismatch_is_raised(tmp_path):
+    backend = LocalBackend(tmp_path)
+    backend.put("file.csv", b"content")
+    with pytest.raises(GenerationMismatchError):
+        backend.with_retry(backend.put, "file.csv", b"content", if_generation_match=0)
@@ -0,0 +1,122 @@
+import numpy as np
+
+
+def _as_output(values):
+    """Return a NumPy scalar for scalar inputs and an array otherwise"""
+    return values[()] if np.ndim(values) == 0 else values
+
+
+def compound_growth(i, k):
+    """
+    Compute ((1 + i)**k - 1) / i, the future value of k unit payments, element-wise
+    i: Periodic interest rate
+    k: Number of periods
+    Uses expm1/log1p so that small rates stay accurate, and the limit k when i is 0.
+    """
+    i, k = np.broadcast_arrays(np.asarray(i, dtype=float), np.asarray(k, dtype=float))
+    safe_i = np.where(i == 0, 1., i)
+    return np.where(i == 0, k, np.expm1(k * np.log1p(safe_i)) / safe_i)
+
+
+def discount_growth(i, k):
+    """
+    Compute (1 - (1 + i)**-k) / i, the present value of k unit payments, element-wise
+    i: Periodic interest rate
+    k: Number of periods
+    Equal to k when i is 0.
+    """
+    i, k = np.broadcast_arrays(np.asarray(i, dtype=float), np.asarray(k, dtype=float))
+    safe_i = np.where(i == 0, 1., i)
+    return np.where(i == 0, k, -np.expm1(-k * np.log1p(safe_i)) / safe_i)
+
+
+def payment(capital, yearly_rate, n_months):
+    """
+    Compute the monthly payment of fixed-rate loans, element-wise
+    capital: Borrowed capital
+    yearly_rate: Yearly interest rate
+    n_months: Number of monthly payments
+    """
+    return _as_output(np.asarray(capital, dtype=float) / discount_growth(np.asarray(yearly_rate, dtype=float) / 12, n_months))
+
+
+def remaining_balance(capital, yearly_rate, n_months, months):
+    """
+    Compute the capital remaining after a number of monthly payments, element-wise
+    capital: Borrowed capital
+    yearly_rate: Yearly interest rate
+    n_months: Number of monthly payments of the loan
+    months: Number of payments already made, clipped to [0, n_months] so the balance is 0 once the loan is repaid
+    """
+    i = np.asarray(yearly_rate, dtype=float) / 12
+    n_months = np.asarray(n_months, dtype=float)
+    months = np.clip(months, 0, n_months)
+    capital = np.asarray(capital, dtype=float)
+    # (1+i)^n - (1+i)^k over (1+i)^n - 1, written with growth factors to keep the zero-rate limit (n-k)/n
+    balance = capital * (1 - compound_growth(i, months) / compound_growth(i, n_months))
+    return _as_output(np.where(months >= n_months, 0., balance))
+
+
+def amortization_schedule(capital, yearly_rate, n_months, periods, period_months=1):
+    """
+    Split the payments of fixed-rate loans into interest and principal, element-wise
+    capital: Borrowed capital
+    yearly_rate: Yearly interest rate
+    n_months: Number of monthly payments of the loan
+    periods: Period numbers (0 is the loan start), broadcast against the loan parameters
+    period_months: Number of months per period, e.g. 12 for a yearly schedule
+
+    Returns a dict of arrays:
+    - payments: total paid over each period
+    - interest: interest part of the payments
+    - principal: capital repaid over each period
+    - balance: capital remaining at the end of each period
+    """
+    periods = np.asarray(periods)
+    end = np.asarray(periods * period_months, dtype=float)
+    start = np.maximum(end - period_months, 0)
+    balance = remaining_balance(capital, yearly_rate, n_months, end)
+    principal = remaining_balance(capital, yearly_rate, n_months, start) - balance
+    monthly_payment = payment(capital, yearly_rate, n_months)
+    paid_months = np.clip(end, 0, n_months) - np.clip(start, 0, n_months)
+    payments = monthly_payment * paid_months
+    return {
+        'payments': payments,
+        'interest': payments - principal,
+        'principal': principal,
+        'balance': balance
+    }
+
+
+def variable_rate_schedule(capital, yearly_rates, n_months):
+    """
+    Compute the yearly payments and balances of loans whose rate can change every year, element-wise
+    capital: Borrowed capital, broadcastable to yearly_rates.shape[:-1] + (1,)
+    yearly_rates: Yearly interest rates of shape (..., n_years + 1), column j holding the rate of year j (column 0, the
+    acquisition year, is not used)
+    n_months: Number of monthly payments of the loan, broadcastable like capital
+
+    At the start of every year the monthly payment is recomputed to repay the remaining balance over the remaining months
+    at the rate of the year, so a constant rate gives the fixed-rate payment and balance, and a rate only changing every
+    few years (reset periods, caps) is amortized piecewise. Each year scales the balance by a factor that does not depend
+    on it, so every year of every loan is computed at once from the cumulative product of these factors.
+
+    Returns a dict of arrays of the shape of yearly_rates:
+    - payments: total paid over each year (0 in year 0 and once the loan is repaid)
+    - balance: capital remaining at the end of each year (the capital in year 0)
+    """
+    yearly_rates = np.asarray(yearly_rates, dtype=float)
+    years = np.arange(yearly_rates.shape[-1])
+    remaining_months = np.asarray(n_months, dtype=float) - 12 * (years - 1)  # at the start of each year
+    i = yearly_rates / 12
+    months = np.clip(remaining_months, 0, 12)
+    safe_remaining = np.where(remaining_months > 0, remaining_months, 1.)
+    factors = np.where(remaining_months > 12, 1 - compound_growth(i, months) / compound_growth(i, safe_remaining), 0.)
+    factors = np.where(years == 0, 1., factors)
+    balance = np.asarray(capital, dtype=float) * factors.cumprod(axis=-1)
+    opening_balance = np.concatenate([balance[..., :1], balance[..., :-1]], axis=-1)
+    monthly_payment = opening_balance / discount_growth(i, safe_remaining)
+    return {
+        'payments': np.where((years == 0) | (remaining_months <= 0), 0., monthly_payment * months),
+        'balance': balance,
+    }
@@ -0,0 +1,153 @@
+"""
+Headless evaluation of a whole property table: derived features, cashflow projection and KPIs of every property.
+
+The table is read from a CSV or Parquet file in the database format (rates as fractions, as saved by the Inputs form),
+or from the configured store (BP_INVEST_STORAGE, see utils.storage) without any Streamlit runtime or secrets.
+Properties are split into shards evaluated in parallel by a process pool, each shard as one batch projection on records,
+and the results are written to a CSV or Parquet file with the timing of every stage.
+
+Usage:
+    python -m utils.batch_eval --output kpis.parquet                          # latest version of every stored property
+    python -m utils.batch_eval --input properties.csv --output kpis.csv --workers 4
+    python -m utils.batch_eval --all-versions --output history_kpis.parquet --stats stats.json
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from utils.financial import compute_cashflow_kpis
+from utils.portfolio import PORTFOLIO_KPIS
+from utils.schema import coerce_real_estate_df, records_from_df
+from utils.serialization import parse_dataframe, serialize_dataframe
+from utils.transformations import FEATURES, build_cashflow_arrays, create_additional_features
+
+
+# Largest number of properties evaluated at once by a worker: bounds the memory of a (properties x years) projection
+SHARD_SIZE = 10_000
+STAGES = ['features', 'projection', 'kpis']
+ID_COLUMNS = ['real_estate_id', 'timestamp']
+
+
+def load_properties(path: str = None, all_versions: bool = False) -> pd.DataFrame:
+    """
+    Return the properties to evaluate: the rows of a CSV or Parquet file, or the latest version of every property
+    of the configured store (every saved version with all_versions).
+    """
+    if path is not None:
+        with open(path, "rb") as f:
+            return coerce_real_estate_df(parse_dataframe(f.read(), path)).reset_index(drop=True)
+    from utils.database import load_latest_index, load_real_estate_database
+    if all_versions:
+        return load_real_estate_database()
+    return load_latest_index().reset_index(drop=True)
+
+
+def evaluate_shard(records: np.ndarray, time_horizon: int = 30):
+    """
+    Evaluate a shard of records (see records_from_df) in one batch projection.
+    Returns ({column: values} of FEATURES, irr_converged and PORTFOLIO_KPIS, {stage: seconds}).
+    """
+    timings = {}
+    start = time.perf_counter()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        enriched = create_additional_features(records)
+        timings['features'] = time.perf_counter() - start
+        lines = build_cashflow_arrays(enriched, time_horizon)
+        timings['projection'] = time.perf_counter() - start - timings['features']
+        kpis = compute_cashflow_kpis(lines, enriched)
+        kpis['cash_on_cash'] = lines['cash_flow_after_debt'][:, 1] / enriched['apport']
+        kpis['ltv'] = enriched['ltv']
+    timings['kpis'] = time.perf_counter() - start - timings['features'] - timings['projection']
+    columns = {feature: enriched[feature] for feature in FEATURES}
+    columns.update({name: kpis[name].to_numpy() for name in ['irr_converged', *PORTFOLIO_KPIS]})
+    return columns, timings
+
+
+def evaluate_properties(real_estate_df: pd.DataFrame, time_horizon: int = 30, n_workers: int = None, shard_size: int = SHARD_SIZE):
+    """
+    This function evaluates every property of a table, sharded across a process pool.
+
+    Parameters:
+    - real_estate_df (pd.DataFrame): The properties, before create_additional_features.
+    - time_horizon (int): The number of years to project the cashflow.
+    - n_workers (int): The number of processes evaluating shards in parallel (None for every core, 1 to stay in this process).
+    - shard_size (int): The largest number of properties per shard. Shards are made smaller so that every worker gets one.
+
+    Returns:
+    - (results, stats): a dataframe with the real_estate_id and timestamp of every property, FEATURES, irr_converged and
+      PORTFOLIO_KPIS (see compute_portfolio), in the order of real_estate_df; and a dict of timing stats: the wall time
+      of the evaluation, the CPU seconds spent in every stage summed over shards, the number of shards and workers
+    """
+    n_workers = os.cpu_count() if n_workers is None else n_workers
+    n_properties = len(real_estate_df)
+    shard_size = max(1, min(shard_size, math.ceil(n_properties / max(n_workers, 1))))
+    start = time.perf_counter()
+    records = records_from_df(real_estate_df)
+    shards = [records[first:first + shard_size] for first in range(0, n_properties, shard_size)]
+    if n_workers > 1 and len(shards) > 1:
+        n_workers = min(n_workers, len(shards))
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            evaluated = list(executor.map(evaluate_shard, shards, [time_horizon] * len(shards)))
+    else:
+        n_workers = 1
+        evaluated = [evaluate_shard(shard, time_horizon) for shard in shards]
+    ids = {column: real_estate_df[column].to_numpy() for column in ID_COLUMNS if column in real_estate_df}
+    if evaluated:
+        values = {name: np.concatenate([columns[name] for columns, _ in evaluated]) for name in evaluated[0][0]}
+    else:
+        values = {name: np.array([], dtype=float) for name in [*FEATURES, 'irr_converged', *PORTFOLIO_KPIS]}
+    results = pd.DataFrame({**ids, **values})
+    stats = {
+        'properties': n_properties,
+        'shards': len(shards),
+        'workers': n_workers,
+        'evaluation_seconds': time.perf_counter() - start,
+        **{f"{stage}_cpu_seconds": sum(timings[stage] for _, timings in evaluated) for stage in STAGES},
+        'non_finite_kpis': int((~np.isfinite(results[PORTFOLIO_KPIS].to_numpy(dtype=float))).any(axis=1).sum()),
+    }
+    return results, stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate the features, cashflow projection and KPIs of every property")
+    parser.add_argument("--input", help="CSV or Parquet property table, the configured store when omitted")
+    parser.add_argument("--all-versions", action="store_true", help="evaluate every saved version instead of the latest ones (store only)")
+    parser.add_argument("--output", required=True, help="CSV or Parquet results file")
+    parser.add_argument("--horizon", type=int, default=30, help="projection horizon in years")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, every core by default")
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE, help="largest number of properties per shard")
+    parser.add_argument("--stats", help="JSON file to write the timing stats to")
+    args = parser.parse_args(argv)
+    if not args.output.endswith((".csv", ".parquet")):
+        parser.error("--output must be a .csv or .parquet file")
+
+    start = time.perf_counter()
+    real_estate_df = load_properties(args.input, args.all_versions)
+    load_seconds = time.perf_counter() - start
+    results, stats = evaluate_properties(real_estate_df, args.horizon, args.workers, args.shard_size)
+    start = time.perf_counter()
+    content, _ = serialize_dataframe(results, args.output)
+    with open(args.output, "wb") as f:
+        f.write(content)
+    stats = {'load_seconds': load_seconds, **stats, 'write_seconds': time.perf_counter() - start}
+
+    for name, value in stats.items():
+        print(f"{name:<25} {value:>12.3f}" if isinstance(value, float) else f"{name:<25} {value:>12}")
+    if stats['evaluation_seconds'] > 0:
+        print(f"{'properties_per_second':<25} {stats['properties'] / stats['evaluation_seconds']:>12.0f}")
+    print(f"Results written to {args.output}")
+    if args.stats:
+        with open(args.stats, "w") as f:
+            json.dump(stats, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
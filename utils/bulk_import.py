@@ -0,0 +1,190 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from utils.database import append_real_estate
+from utils.inputs import REAL_ESTATE_INPUTS
+from utils.schema import coerce_real_estate_df, records_from_df
+from utils.tracing import count, traced
+from utils.transformations import FEATURES, create_additional_features
+
+
+# Rows parsed, validated and enriched at a time: memory is bounded by one chunk of raw text plus the valid typed rows
+CHUNK_SIZE = 10_000
+LISTING_EXTENSIONS = ['csv', 'json', 'jsonl', 'ndjson']
+
+INPUT_TYPES = {field: input_type for fields in REAL_ESTATE_INPUTS.values() for field, (input_type, _) in fields.items()}
+# Values of the fields missing from the file or left empty, as the Inputs form would submit them untouched
+INPUT_DEFAULTS = {field: default for fields in REAL_ESTATE_INPUTS.values() for field, (_, default) in fields.items()}
+
+ERROR_COLUMNS = ['row', 'real_estate_id', 'column', 'value', 'error']
+
+
+def _csv_separator(file):
+    # ";" for French spreadsheets (decimal commas), "," otherwise, decided on the header line
+    position = file.tell()
+    header = file.readline()
+    file.seek(position)
+    if isinstance(header, bytes):
+        header = header.decode("utf-8", errors="ignore")
+    return ";" if header.count(";") > header.count(",") else ","
+
+
+def read_listings(file, filename: str, chunk_size: int = CHUNK_SIZE):
+    """
+    Yield the listings of a CSV or JSON file (a seekable file object, e.g. a Streamlit upload) as dataframes of
+    at most chunk_size rows of raw values (text for CSV files).
+    CSV and JSON lines (.jsonl, .ndjson) files are streamed; a .json file holds an array of objects and is read at once.
+    """
+    extension = filename.rsplit(".", 1)[-1].lower()
+    if extension == "csv":
+        # Every value is read as text and coerced afterwards
+        yield from pd.read_csv(file, sep=_csv_separator(file), dtype=str, chunksize=chunk_size, skipinitialspace=True)
+    elif extension in ["jsonl", "ndjson"]:
+        yield from pd.read_json(file, lines=True, dtype=False, chunksize=chunk_size)
+    elif extension == "json":
+        listings = pd.read_json(file, dtype=False)
+        for start in range(0, len(listings), chunk_size):
+            yield listings.iloc[start:start + chunk_size]
+    else:
+        raise ValueError(f"Unsupported listings file {filename!r}, expected one of {', '.join(LISTING_EXTENSIONS)}")
+
+
+def _errors(mask, first_row, ids, column, values, message):
+    positions = np.flatnonzero(mask)
+    return pd.DataFrame({
+        'row': first_row + positions,
+        'real_estate_id': ids[positions],
+        'column': column,
+        'value': values[positions],
+        'error': message,
+    })
+
+
+def coerce_listings(chunk: pd.DataFrame, first_row: int = 1, today: datetime.date = None):
+    """
+    Validate and coerce a chunk of raw listings against REAL_ESTATE_INPUTS, the way the Inputs form builds a property:
+    missing or empty fields take the form defaults, percentages and rates are divided by 100, real_estate_id defaults
+    to the adresse and timestamp to today.
+
+    Returns (real_estate_df, errors): the typed valid rows (inputs and metadata only, as saved by the Inputs form) and a
+    dataframe of ERROR_COLUMNS with one line per invalid value, row being the position of the listing in the file.
+    Rows with any error are left out.
+    """
+    chunk = chunk.reset_index(drop=True)
+    n_rows = len(chunk)
+    invalid = np.zeros(n_rows, dtype=bool)
+    errors = []
+    columns = {}
+
+    def text(column, default):
+        if column not in chunk:
+            return pd.Series(default, index=chunk.index, dtype="string")
+        values = chunk[column].astype("string").str.strip()
+        return values.mask(values.isna() | (values == ""), default)
+
+    adresse = text('adresse', INPUT_DEFAULTS['adresse'])
+    real_estate_id = text('real_estate_id', pd.NA).fillna(adresse)
+    ids = real_estate_id.to_numpy(dtype=object)
+
+    for field, input_type in INPUT_TYPES.items():
+        if input_type == 'text':
+            columns[field] = adresse if field == 'adresse' else text(field, INPUT_DEFAULTS[field])
+            continue
+        if field not in chunk:
+            values = np.full(n_rows, float(INPUT_DEFAULTS[field]))
+        else:
+            raw = chunk[field]
+            values = pd.to_numeric(raw, errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+            blank = raw.isna().to_numpy()
+            retry = np.flatnonzero(np.isnan(values) & ~blank)
+            if len(retry):
+                # Only the values that are not plain numbers go through the slower text cleaning:
+                # decimal commas, spaces as thousands separators and units ("1 234,5 €", "3,5 %")
+                cleaned = raw.iloc[retry].astype(str).str.replace(r"[\s€%]", "", regex=True).str.replace(",", ".", regex=False)
+                values[retry] = pd.to_numeric(cleaned, errors='coerce')
+                blank[retry] = (cleaned == "").to_numpy()
+            unparsed = np.isnan(values) & ~blank
+            if unparsed.any():
+                errors.append(_errors(unparsed, first_row, ids, field, raw.to_numpy(dtype=object), f"not a number ({input_type})"))
+                invalid |= unparsed
+            values = np.where(blank, float(INPUT_DEFAULTS[field]), values)
+        if input_type in ['percentage', 'rate']:
+            values = values / 100
+        elif input_type == 'year':
+            not_years = ~np.isnan(values) & ((values < 0) | (values % 1 != 0))
+            if not_years.any():
+                errors.append(_errors(not_years, first_row, ids, field, values.astype(object), "not a whole number of years"))
+                invalid |= not_years
+            values = np.where(not_years, 0, values)
+        columns[field] = values
+
+    timestamp = pd.Series(pd.Timestamp(today or datetime.date.today()), index=chunk.index)
+    if 'timestamp' in chunk:
+        raw = text('timestamp', pd.NA)
+        parsed = pd.to_datetime(raw, errors='coerce', format='mixed', dayfirst=True)
+        unparsed = (parsed.isna() & raw.notna()).to_numpy()
+        if unparsed.any():
+            errors.append(_errors(unparsed, first_row, ids, 'timestamp', raw.to_numpy(dtype=object), "not a date"))
+            invalid |= unparsed
+        timestamp = parsed.fillna(timestamp)
+
+    real_estate_df = coerce_real_estate_df(pd.DataFrame({'real_estate_id': real_estate_id, 'timestamp': timestamp, **columns})[~invalid])
+    errors = [error for error in errors if not error.empty]
+    errors = pd.concat(errors, ignore_index=True) if errors else pd.DataFrame(columns=ERROR_COLUMNS)
+    return real_estate_df, errors
+
+
+def _check_features(real_estate_df, first_row):
+    """Drop the rows whose derived features are not finite (e.g. a zero prix_d_achat), computed in batch on records"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        enriched = create_additional_features(records_from_df(real_estate_df))
+    finite = np.ones(len(real_estate_df), dtype=bool)
+    for feature in FEATURES:
+        finite &= np.isfinite(enriched[feature])
+    positions = np.flatnonzero(~finite)
+    errors = pd.DataFrame({
+        'row': real_estate_df.index.to_numpy()[positions] + first_row,
+        'real_estate_id': real_estate_df['real_estate_id'].to_numpy(dtype=object)[positions],
+        'column': [", ".join(feature for feature in FEATURES if not np.isfinite(enriched[feature][position])) for position in positions],
+        'value': None,
+        'error': "derived feature is not finite",
+    })
+    return real_estate_df[finite], errors
+
+
+@traced("bulk_import")
+def import_listings(file, filename: str, chunk_size: int = CHUNK_SIZE, dry_run: bool = False, today: datetime.date = None) -> dict:
+    """
+    Import a CSV or JSON file of listings into the database in a single write.
+    Each chunk is coerced (coerce_listings) and its derived features computed in batch to reject the rows that cannot
+    be projected; the valid rows of the whole file are then saved as one segment with one latest index update
+    (append_real_estate), so the import is all or nothing for the valid rows.
+
+    Returns a dict with:
+    - imported: the number of saved rows (or of rows that would be saved with dry_run)
+    - errors: dataframe of ERROR_COLUMNS, one line per rejected value, sorted by row
+    - ignored_columns: the columns of the file that are neither inputs nor real_estate_id / timestamp
+    - segment: the filename of the written segment, None when nothing was written
+
+    A file without any REAL_ESTATE_INPUTS column (e.g. a wrong separator) raises a ValueError instead of importing defaults.
+    """
+    valid, errors, first_row, ignored_columns = [], [], 1, []
+    for chunk in read_listings(file, filename, chunk_size):
+        if first_row == 1:
+            if not set(chunk.columns) & set(INPUT_TYPES):
+                raise ValueError(f"No column of {filename!r} is a real estate input, found {list(chunk.columns)[:5]}")
+            ignored_columns = [column for column in chunk.columns if column not in INPUT_TYPES and column not in ['real_estate_id', 'timestamp']]
+        real_estate_df, chunk_errors = coerce_listings(chunk, first_row, today)
+        real_estate_df, feature_errors = _check_features(real_estate_df, first_row)
+        valid.append(real_estate_df)
+        errors += [error for error in [chunk_errors, feature_errors] if not error.empty]
+        first_row += len(chunk)
+    real_estate_df = pd.concat(valid, ignore_index=True) if valid else pd.DataFrame()
+    errors = pd.concat(errors, ignore_index=True).sort_values('row', kind='stable').reset_index(drop=True) if errors else pd.DataFrame(columns=ERROR_COLUMNS)
+    count(rows=first_row - 1, imported=len(real_estate_df), errors=len(errors))
+    segment = None
+    if not dry_run and not real_estate_df.empty:
+        segment = append_real_estate(real_estate_df)
+    return {'imported': len(real_estate_df), 'errors': errors, 'ignored_columns': ignored_columns, 'segment': segment}
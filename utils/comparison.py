@@ -0,0 +1,111 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from utils.financial import compute_cashflow_kpis
+from utils.schema import content_hashes, records_from_df
+from utils.transformations import CASHFLOW_LINES, build_cashflow_arrays, create_additional_features
+
+
+# Hypotheses the Comparaison sliders can set for every compared property
+COMPARISON_PARAMETERS = ['durée_de_détention_(année)', 'durée_de_crédit_(année)', 'taux_d_emprunt', 'taux_d_actualisation']
+COMPARISON_KPIS = ['irr', 'van', 'eqx', 'min_cash_flow', 'cash_on_cash']
+
+# Projections shared by every session of the process, the least recently used ones are evicted first
+PROJECTION_CACHE_MAX_ENTRIES = 512
+
+_projection_cache = OrderedDict()  # (real_estate_id, inputs hash, parameters, time_horizon) -> projection of one property
+_projection_cache_lock = threading.Lock()
+_projection_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def _projection_key(real_estate_id, inputs_hash, parameters, time_horizon):
+    return str(real_estate_id), int(inputs_hash), parameters, time_horizon
+
+
+def _project(latest_df, parameters, time_horizon):
+    """Project properties in one batch and return one {'lines', 'kpis', 'detention_period'} dict per row"""
+    records = records_from_df(latest_df)
+    for name, value in parameters:
+        records[name] = value
+    enriched = create_additional_features(records)
+    lines = build_cashflow_arrays(enriched, time_horizon)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        kpis = compute_cashflow_kpis(lines, enriched).assign(cash_on_cash=lines['cash_flow_after_debt'][:, 1] / enriched['apport'])
+    kpi_values = kpis[COMPARISON_KPIS].to_numpy(dtype=float)
+    stacked = np.stack([lines[name] for name in CASHFLOW_LINES], axis=1)  # (properties, lines, years)
+    return [
+        {
+            'lines': stacked[row].copy(),  # not a view, so that a cached property does not keep its whole batch alive
+            'kpis': dict(zip(COMPARISON_KPIS, kpi_values[row])),
+            'detention_period': int(enriched['durée_de_détention_(année)'][row]),
+        }
+        for row in range(len(latest_df))
+    ]
+
+
+def compare_properties(latest_df: pd.DataFrame, parameters: dict = None, time_horizon: int = 30) -> dict:
+    """
+    This function projects the properties to compare side by side.
+    Projections are memoized per (property inputs, parameters, horizon) in a process-wide LRU cache: only the
+    properties missing from it are computed, in a single batch, so adding a property to a comparison computes
+    only that property and going back to a previous selection is a cache read.
+
+    Parameters:
+    - latest_df (pd.DataFrame): The properties to compare (e.g. rows of load_latest_index), before create_additional_features,
+      with their real_estate_id.
+    - parameters (dict): Values of COMPARISON_PARAMETERS applied to every property instead of its own hypotheses.
+    - time_horizon (int): The number of years to project the cashflow.
+
+    Returns:
+    - dict with:
+        - kpis: dataframe indexed by real_estate_id with the detention period and COMPARISON_KPIS
+          (see compute_cashflow_kpis, cash_on_cash being the first year cash flow after debt divided by the apport)
+        - lines: {line: dataframe of properties (rows) by year (columns)} for CASHFLOW_LINES, NaN after each detention period
+    """
+    parameters = tuple(sorted((parameters or {}).items()))
+    keys = [
+        _projection_key(real_estate_id, inputs_hash, parameters, time_horizon)
+        for real_estate_id, inputs_hash in zip(latest_df['real_estate_id'], content_hashes(latest_df))
+    ]
+    projections = {}
+    with _projection_cache_lock:
+        for key in keys:
+            if key in _projection_cache:
+                _projection_cache.move_to_end(key)
+                projections[key] = _projection_cache[key]
+                _projection_cache_stats["hits"] += 1
+    missing = [row for row, key in enumerate(keys) if key not in projections]
+    if missing:
+        computed = _project(latest_df.iloc[missing], parameters, time_horizon)
+        with _projection_cache_lock:
+            _projection_cache_stats["misses"] += len(missing)
+            for row, projection in zip(missing, computed):
+                projections[keys[row]] = _projection_cache[keys[row]] = projection
+            while len(_projection_cache) > PROJECTION_CACHE_MAX_ENTRIES:
+                _projection_cache.popitem(last=False)
+                _projection_cache_stats["evictions"] += 1
+
+    index = pd.Index(latest_df['real_estate_id'], name='real_estate_id')
+    rows = [projections[key] for key in keys]
+    kpis = pd.DataFrame(
+        [{'durée_de_détention_(année)': row['detention_period'], **row['kpis']} for row in rows],
+        index=index,
+        columns=['durée_de_détention_(année)', *COMPARISON_KPIS],
+    )
+    years = np.arange(time_horizon + 1)
+    stacked = np.array([row['lines'] for row in rows]).reshape(len(rows), len(CASHFLOW_LINES), len(years))
+    held = years[None, :] <= kpis['durée_de_détention_(année)'].to_numpy(dtype=float)[:, None]
+    lines = {
+        name: pd.DataFrame(np.where(held, stacked[:, i], np.nan), index=index, columns=years)
+        for i, name in enumerate(CASHFLOW_LINES)
+    }
+    return {'kpis': kpis, 'lines': lines}
+
+
+def projection_cache_stats():
+    """Return the hit/miss/eviction counters and the size of the projections cache"""
+    with _projection_cache_lock:
+        return {**_projection_cache_stats, "entries": len(_projection_cache)}
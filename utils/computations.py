@@ -1,11 +1,15 @@
+from utils.amortization import compound_growth, payment
+
+
 def PMT(C, n, t):
     """
     Compute the monthly payment for a given loan
     C: Capital
     n: Number of periods
     t: Yearly Interest rate
+    Works element-wise on arrays and falls back to C/n when the rate is 0.
     """ 
-    return (C * t/12)/(1-(1 + t/12)**-n)
+    return payment(C, t, n)
 
 
 def compute_remaining_capital_after_y_years(C, M, t, y):
@@ -15,5 +19,6 @@ def compute_remaining_capital_after_y_years(C, M, t, y):
     M: Monthly payment
     t: Yearly Interest rate
     y: Number of years
+    Works element-wise on arrays and falls back to C - 12*y*M when the rate is 0.
     """
-    return (C-M/(t/12))*(1+t/12)**(y*12) + M/(t/12)
\ No newline at end of file
+    return C*(1+t/12)**(y*12) - M*compound_growth(t/12, y*12)
\ No newline at end of file
@@ -0,0 +1,292 @@
+import datetime
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from utils.gcp_connector import (
+    delete_file,
+    download_dataframe,
+    download_dataframes,
+    get_generation,
+    list_files,
+    upload_dataframe,
+)
+from utils.schema import REAL_ESTATE_DTYPES, coerce_real_estate_df
+from utils.serialization import filter_dataframe
+from utils.storage import MAX_ATTEMPTS, GenerationMismatchError
+
+
+# Append-only layout: a typed, delta-encoded Parquet base snapshot plus one immutable segment per save
+DATABASE_FILENAME = "02data_history.parquet"
+# Full-row Parquet snapshot used before delta encoding, still read while the delta-encoded one does not exist
+FULL_DATABASE_FILENAME = "02data.parquet"
+# Untyped CSV snapshot used before the Parquet migration, still read while no Parquet snapshot exists
+LEGACY_DATABASE_FILENAME = "02data.csv"
+SEGMENTS_PREFIX = "02data_segments/"
+# One row per real estate holding its latest version, maintained on every save
+LATEST_INDEX_FILENAME = "02data_latest.parquet"
+# Name of the base snapshot column recording the segment each row was folded from
+SEGMENT_COLUMN = "_segment"
+# Name of the base snapshot column listing the inputs left empty because they equal the previous version's
+# (separated by UNCHANGED_SEPARATOR, input names containing commas; null for the first version of a real estate)
+UNCHANGED_COLUMN = "_unchanged"
+UNCHANGED_SEPARATOR = "|"
+# Readers fold the segments into the base snapshot once there are more than this
+MAX_SEGMENTS = 50
+
+_segments_cache = {}  # segment filename -> DataFrame, segments never change once written
+
+
+def append_real_estate(real_estate_df: pd.DataFrame) -> str:
+    """
+    Save new real estate rows as a new segment and return its filename.
+    The cost does not depend on the size of the database, and concurrent saves never overwrite each other:
+    every segment has a unique name and is written with a "must not exist" precondition.
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    segment = f"{SEGMENTS_PREFIX}{now:%Y%m%dT%H%M%S%f}_{uuid.uuid4().hex}.parquet"
+    real_estate_df = coerce_real_estate_df(real_estate_df)
+    upload_dataframe(real_estate_df, segment, if_generation_match=0)
+    _update_latest_index(real_estate_df)
+    return segment
+
+
+def latest_rows(df):
+    """Keep the latest version of each real estate, the last saved one winning timestamp ties"""
+    return (
+        df
+        .sort_values('timestamp', kind='stable')
+        .drop_duplicates('real_estate_id', keep='last')
+        .sort_values('real_estate_id')
+        .reset_index(drop=True)
+    )
+
+
+def _update_latest_index(real_estate_df, max_attempts=5):
+    """Upsert new versions into the latest index, retrying when another save updated it concurrently"""
+    for _ in range(max_attempts):
+        generation = get_generation(LATEST_INDEX_FILENAME)
+        if not generation:
+            rebuild_latest_index()
+            return
+        latest_df = download_dataframe(LATEST_INDEX_FILENAME)
+        try:
+            upload_dataframe(latest_rows(pd.concat([latest_df, real_estate_df], ignore_index=True)), LATEST_INDEX_FILENAME, if_generation_match=generation)
+            return
+        except GenerationMismatchError:
+            continue
+    raise GenerationMismatchError(LATEST_INDEX_FILENAME)
+
+
+def rebuild_latest_index() -> pd.DataFrame:
+    """Recompute the latest index from the whole history, e.g. after a compaction or an interrupted save"""
+    latest_df = latest_rows(load_real_estate_database())
+    upload_dataframe(latest_df, LATEST_INDEX_FILENAME)
+    return latest_df
+
+
+def load_latest_index() -> pd.DataFrame:
+    """
+    Return the latest version of every real estate, indexed by real_estate_id.
+    Reads the small maintained index instead of the whole history, which is only scanned if the index does not exist yet.
+    """
+    try:
+        latest_df = download_dataframe(LATEST_INDEX_FILENAME)
+    except FileNotFoundError:
+        latest_df = rebuild_latest_index()
+    return coerce_real_estate_df(latest_df).set_index('real_estate_id', drop=False)
+
+
+def get_latest_index_version() -> int:
+    """Return the generation of the latest index, which changes on every save: a cheap cache key for anything derived from it"""
+    return get_generation(LATEST_INDEX_FILENAME)
+
+
+def list_real_estate_ids() -> list:
+    """Return the ids of the saved real estates, sorted"""
+    return load_latest_index().index.tolist()
+
+
+def get_latest_real_estate(real_estate_id) -> pd.DataFrame:
+    """Return the latest version of one real estate as a single-row dataframe"""
+    return load_latest_index().loc[[real_estate_id]].reset_index(drop=True)
+
+
+def _read_segments(segments):
+    """Return the dataframes of segments ({filename: generation}), downloading the new ones concurrently"""
+    for segment in set(_segments_cache) - set(segments):
+        del _segments_cache[segment]
+    new_segments = {segment: generation for segment, generation in segments.items() if segment not in _segments_cache}
+    for segment, df in download_dataframes(new_segments).items():
+        _segments_cache[segment] = coerce_real_estate_df(df)
+    return [_segments_cache[segment] for segment in segments]
+
+
+def _delta_encode(df):
+    """
+    Empty the inputs equal to the previous version of the same real estate, listing them in UNCHANGED_COLUMN.
+    df must be sorted by real_estate_id then timestamp; the first version of each real estate is kept whole.
+    """
+    fields = [field for field in REAL_ESTATE_DTYPES if field in df]
+    ids = df['real_estate_id'].to_numpy(dtype=object)
+    same_id = np.zeros(len(df), dtype=bool)
+    same_id[1:] = ids[1:] == ids[:-1]
+    unchanged = np.column_stack([
+        same_id & df[field].eq(df[field].shift()).fillna(False).to_numpy(dtype=bool) for field in fields
+    ]) if fields else np.zeros((len(df), 0), dtype=bool)
+    patterns, inverse = np.unique(unchanged, axis=0, return_inverse=True)
+    names = np.array([UNCHANGED_SEPARATOR.join(np.array(fields, dtype=object)[pattern]) for pattern in patterns], dtype=object)
+    encoded = df.assign(**{field: df[field].mask(unchanged[:, i]) for i, field in enumerate(fields)})
+    encoded[UNCHANGED_COLUMN] = pd.array(np.where(same_id, names[inverse.ravel()], None), dtype='string')
+    return encoded
+
+
+def _delta_decode(df):
+    """Fill the inputs of delta-encoded rows from the previous version of their real estate (inverse of _delta_encode)"""
+    if UNCHANGED_COLUMN not in df:
+        return df
+    unchanged = df[UNCHANGED_COLUMN]
+    patterns = [pattern for pattern in unchanged.dropna().unique() if pattern]
+    positions = np.arange(len(df), dtype=float)
+    columns = {}
+    for field in df.columns:
+        field_patterns = [pattern for pattern in patterns if field in pattern.split(UNCHANGED_SEPARATOR)]
+        if not field_patterns:
+            continue
+        # Each row takes the value of the last version where the input changed, genuine nulls included
+        source = pd.Series(np.where(unchanged.isin(field_patterns), np.nan, positions), index=df.index)
+        source = source.groupby(df['real_estate_id'].to_numpy()).ffill().to_numpy(dtype=int)
+        columns[field] = df[field].iloc[source].set_axis(df.index)
+    return df.assign(**columns).drop(columns=UNCHANGED_COLUMN)
+
+
+def _read_snapshot(columns=None, filters=None):
+    """
+    Return the decoded base snapshot (with its SEGMENT_COLUMN if any), or an empty dataframe if none exists.
+    Delta-encoded rows need the previous versions of their real estate, so only real_estate_id filters are pushed down
+    to the delta-encoded snapshot, the other ones being applied once decoded.
+    """
+    filters = filters or []
+    if columns is not None:
+        columns = list(dict.fromkeys([*columns, SEGMENT_COLUMN]))
+    pushed = [condition for condition in filters if condition[0] == 'real_estate_id']
+    read_columns = None if columns is None else list(dict.fromkeys([*columns, *(condition[0] for condition in filters), 'real_estate_id', UNCHANGED_COLUMN]))
+    try:
+        base_df = _delta_decode(download_dataframe(DATABASE_FILENAME, columns=read_columns, filters=pushed or None))
+        base_df = filter_dataframe(base_df, [condition for condition in filters if condition[0] != 'real_estate_id'])
+    except FileNotFoundError:
+        try:
+            base_df = download_dataframe(FULL_DATABASE_FILENAME, columns=columns, filters=filters or None)
+        except FileNotFoundError:
+            try:
+                base_df = download_dataframe(LEGACY_DATABASE_FILENAME)
+            except FileNotFoundError:
+                return pd.DataFrame()
+            base_df = filter_dataframe(base_df, filters)
+    if columns is not None:
+        base_df = base_df[[column for column in columns if column in base_df]]
+    return base_df
+
+
+def _read_base(columns=None, filters=None):
+    """
+    Return the base snapshot (without its bookkeeping column) and the set of segments it already contains.
+    Filters are applied before collecting the folded segments: a folded segment row passing the filters is
+    still in the filtered snapshot, so no matching row is read twice.
+    """
+    base_df = _read_snapshot(columns, filters)
+    if SEGMENT_COLUMN not in base_df:
+        return base_df, set()
+    folded = set(base_df[SEGMENT_COLUMN].dropna())
+    return base_df.drop(columns=SEGMENT_COLUMN), folded
+
+
+def _write_base(df, generation):
+    """
+    Write the delta-encoded Parquet base snapshot, sorted by real_estate_id and timestamp so that successive versions
+    are delta-encoded and row groups can be skipped when filtering on real_estate_id
+    """
+    if SEGMENT_COLUMN not in df:
+        df = df.assign(**{SEGMENT_COLUMN: None})
+    base_df = (
+        coerce_real_estate_df(df.drop(columns=UNCHANGED_COLUMN, errors='ignore'))
+        .astype({SEGMENT_COLUMN: 'string'})
+        .sort_values(['real_estate_id', 'timestamp'], kind='stable')
+        .reset_index(drop=True)
+    )
+    upload_dataframe(_delta_encode(base_df), DATABASE_FILENAME, if_generation_match=generation)
+
+
+def load_real_estate_database(columns=None, filters=None) -> pd.DataFrame:
+    """
+    Return the saved versions of the real estates: the base snapshot followed by the segments.
+    Segments already folded into the base snapshot by a compaction are skipped.
+    
+    Parameters:
+    - columns (list): Only return these columns.
+    - filters (list): Only return the rows matching every (column, op, value) condition,
+      e.g. [('real_estate_id', '=', 'Dreux'), ('timestamp', '>=', pd.Timestamp('2024-01-01'))].
+      The Parquet snapshot skips the row groups that cannot match.
+
+    The read is restarted (MAX_ATTEMPTS times at most, as storage retries) after a compaction folded the segments:
+    the last attempt neither compacts nor swallows the FileNotFoundError of a segment deleted meanwhile.
+    """
+    for attempt in range(MAX_ATTEMPTS):
+        last_attempt = attempt == MAX_ATTEMPTS - 1
+        base_df, folded = _read_base(columns, filters)
+        segments = {segment: generation for segment, generation in list_files(SEGMENTS_PREFIX).items() if segment not in folded}
+        if len(segments) > MAX_SEGMENTS and not last_attempt:
+            try:
+                compact_segments()
+                continue
+            except (GenerationMismatchError, FileNotFoundError):
+                pass  # another session is compacting, read the segments as they are
+        try:
+            segment_dfs = _read_segments(segments)
+        except FileNotFoundError:
+            if last_attempt:
+                raise
+            continue  # a concurrent compaction folded and deleted some segments, read the new snapshot
+        segment_dfs = [filter_dataframe(df, filters or []) for df in segment_dfs]
+        if columns is not None:
+            segment_dfs = [df[columns] for df in segment_dfs]
+        frames = [df for df in [base_df, *segment_dfs] if not df.empty]
+        return coerce_real_estate_df(pd.concat(frames, ignore_index=True)) if frames else pd.DataFrame(columns=columns)
+
+
+def compact_segments() -> int:
+    """
+    Fold every pending segment into the base snapshot and return the number of folded segments.
+    The snapshot is only replaced if nobody changed it since it was read, so a concurrent compaction
+    raises GenerationMismatchError instead of losing rows. Segments are deleted once the new snapshot is written.
+    Before the delta-encoded snapshot exists, the full-row Parquet snapshot (or the legacy CSV one) is the starting point.
+    """
+    generation = get_generation(DATABASE_FILENAME)
+    base_df = _read_snapshot()
+    folded = set(base_df[SEGMENT_COLUMN].dropna()) if SEGMENT_COLUMN in base_df else set()
+    segments = list_files(SEGMENTS_PREFIX)
+    pending = {segment: segment_generation for segment, segment_generation in segments.items() if segment not in folded}
+    if pending:
+        new_rows = [df.assign(**{SEGMENT_COLUMN: segment}) for segment, df in zip(pending, _read_segments(pending))]
+        _write_base(pd.concat([df for df in [base_df, *new_rows] if not df.empty], ignore_index=True), generation)
+    for segment in segments:
+        delete_file(segment)
+    if pending:
+        rebuild_latest_index()
+    return len(pending)
+
+
+def migrate_base_snapshot() -> int:
+    """
+    One-shot migration of the previous base snapshot (full-row Parquet, or else legacy CSV) to the delta-encoded one;
+    return the number of migrated rows. Raises GenerationMismatchError if the delta-encoded snapshot already exists.
+    The previous files are left untouched. Compactions also migrate, this only avoids waiting for MAX_SEGMENTS saves.
+    """
+    base_df = _read_snapshot()
+    _write_base(base_df, generation=0)
+    return len(base_df)
+
+
+if __name__ == "__main__":
+    print(f"Migrated {migrate_base_snapshot()} rows to {DATABASE_FILENAME}")
@@ -0,0 +1,76 @@
+import hashlib
+import pickle
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from utils.transformations import build_yearly_cashflow_df
+
+
+# Subtotal lines of the yearly cashflow, highlighted in the Checks table
+HIGHLIGHTED_LINES = [
+    "gross_effective_revenues", "total_charges_récurrantes", "net_operating_income", "total_non_recurring_charges",
+    "cash_flow_after_debt", "valeur_nette_de_sortie", "net_cash_flow"
+]
+HIGHLIGHT_STYLE = 'font-weight: bold; background-color: #e6f2ff'
+
+# Rendered Checks tables, keyed on the property inputs and horizon (least recently used ones are evicted first)
+RENDER_CACHE_MAX_ENTRIES = 64
+
+_render_cache = OrderedDict()  # (inputs hash, time_horizon) -> (yearly_cashflow_df, html)
+_render_cache_lock = threading.Lock()
+_render_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def _yearly_cashflow_styles(table: pd.DataFrame) -> pd.DataFrame:
+    # Whole-table CSS in one pass: negative amounts in red, subtotal lines highlighted
+    colors = np.where(table.to_numpy() < 0, 'color: red', 'color: black').astype(object)
+    highlighted = table.index.isin(HIGHLIGHTED_LINES)
+    colors[highlighted] = colors[highlighted] + f'; {HIGHLIGHT_STYLE}'
+    return pd.DataFrame(colors, index=table.index, columns=table.columns)
+
+
+def style_yearly_cashflow_df(yearly_cashflow_df: pd.DataFrame):
+    """
+    Style the yearly cashflow of build_yearly_cashflow_df for the Checks page: one row per line item, rounded to the euro,
+    negative amounts in red and subtotal lines highlighted.
+    """
+    return yearly_cashflow_df.T.round().astype(int).style.apply(_yearly_cashflow_styles, axis=None)
+
+
+def _inputs_key(real_estate_df: pd.DataFrame, time_horizon: int):
+    # Digest of the column names and values of the first row (pickle keeps NaN equal to itself, unlike tuple keys)
+    row = real_estate_df.iloc[0]
+    return hashlib.sha1(pickle.dumps((row.index.tolist(), row.tolist()))).hexdigest(), time_horizon
+
+
+def render_yearly_cashflow(real_estate_df: pd.DataFrame, time_horizon: int = 30):
+    """
+    Return (yearly_cashflow_df, html) of the styled yearly cashflow of the first property of an enriched dataframe.
+    Results are memoized on a hash of the property inputs and the horizon, so reruns with unchanged inputs
+    neither rebuild nor restyle the table. The returned dataframe is shared between reruns and must not be modified.
+    """
+    key = _inputs_key(real_estate_df, time_horizon)
+    with _render_cache_lock:
+        if key in _render_cache:
+            _render_cache.move_to_end(key)
+            _render_cache_stats["hits"] += 1
+            return _render_cache[key]
+        _render_cache_stats["misses"] += 1
+
+    yearly_cashflow_df = build_yearly_cashflow_df(real_estate_df, time_horizon)
+    rendered = yearly_cashflow_df, style_yearly_cashflow_df(yearly_cashflow_df).to_html()
+    with _render_cache_lock:
+        _render_cache[key] = rendered
+        while len(_render_cache) > RENDER_CACHE_MAX_ENTRIES:
+            _render_cache.popitem(last=False)
+            _render_cache_stats["evictions"] += 1
+    return rendered
+
+
+def render_cache_stats():
+    """Return the hit/miss/eviction counters and the size of the rendered tables cache"""
+    with _render_cache_lock:
+        return {**_render_cache_stats, "entries": len(_render_cache)}
@@ -0,0 +1,126 @@
+from collections import Counter
+
+import numpy as np
+
+
+class Graph:
+    """
+    Declaration of derived values: every node is a function of other nodes (its dependencies) or of inputs.
+    Nodes are declared with the node decorator:
+
+        @graph.node('ltv', 'prix_acquisition', 'apport')
+        def _(prix_acquisition, apport):
+            return (prix_acquisition - apport) / prix_acquisition
+    """
+
+    def __init__(self):
+        self.nodes = {}  # name -> (dependencies, function)
+        self._dependents = {}  # name -> names of the nodes using it directly
+        self._plans = {}  # (names, given) -> evaluation steps, see plan
+
+    def node(self, name, *dependencies):
+        def decorator(function):
+            self.nodes[name] = (dependencies, function)
+            self._plans.clear()
+            for dependency in dependencies:
+                self._dependents.setdefault(dependency, set()).add(name)
+            return function
+        return decorator
+
+    def plan(self, names, given):
+        """
+        Return the evaluation steps of names when the given nodes are overridden by values (other names are inputs), as
+        (node, dependencies, nodes to release after it) in dependency order. Plans are cached.
+        """
+        key = names, given
+        if key not in self._plans:
+            order, visited = [], set()
+
+            def visit(name):
+                if name in visited:
+                    return
+                visited.add(name)
+                if name in self.nodes and name not in given:
+                    for dependency in self.nodes[name][0]:
+                        visit(dependency)
+                    order.append(name)
+
+            for name in names:
+                visit(name)
+            last_use = {dependency: step for step, name in enumerate(order) for dependency in self.nodes[name][0]}
+            released = [[] for _ in order]
+            for dependency, step in last_use.items():
+                if dependency in self.nodes and dependency not in given and dependency not in names:
+                    released[step].append(dependency)
+            self._plans[key] = [(name, self.nodes[name][0], tuple(released[step])) for step, name in enumerate(order)]
+        return self._plans[key]
+
+    def downstream(self, names):
+        """Return every node depending, directly or not, on one of names"""
+        result, stack = set(), list(names)
+        while stack:
+            for dependent in self._dependents.get(stack.pop(), ()):
+                if dependent not in result:
+                    result.add(dependent)
+                    stack.append(dependent)
+        return result
+
+
+def _same(a, b):
+    if a is b:
+        return True
+    try:
+        return np.array_equal(a, b)
+    except TypeError:
+        return a == b
+
+
+class GraphState:
+    """
+    Memoized evaluation of a Graph for given inputs. Values are computed on first access (state[name]) and kept
+    until an input they depend on changes: update only drops the downstream nodes of the inputs whose value changed,
+    so the next accesses recompute the minimum. evaluations counts the computations of every node.
+
+    A value given for a node name overrides the node (e.g. a feature already present in an enriched dataframe).
+    """
+
+    def __init__(self, graph: Graph, values: dict):
+        self.graph = graph
+        self.values = dict(values)
+        self.evaluations = Counter()
+        self._memo = {}
+
+    def __getitem__(self, name):
+        if name in self.values:
+            return self.values[name]
+        if name not in self._memo:
+            try:
+                dependencies, function = self.graph.nodes[name]
+            except KeyError:
+                raise KeyError(f"{name!r} is neither an input nor a node of the graph") from None
+            self._memo[name] = function(*(self[dependency] for dependency in dependencies))
+            self.evaluations[name] += 1
+        return self._memo[name]
+
+    def evaluate(self, names):
+        """
+        Return {name: value} for names, as one-shot evaluation: intermediate nodes are computed in dependency order
+        and dropped from the memo after their last use, bounding peak memory to the live values.
+        """
+        nodes, values, memo = self.graph.nodes, self.values, self._memo
+        for name, dependencies, released in self.graph.plan(tuple(names), frozenset(values).intersection(nodes)):
+            if name not in memo:
+                memo[name] = nodes[name][1](*[values[d] if d in values else memo[d] for d in dependencies])
+                self.evaluations[name] += 1
+            for dependency in released:
+                memo.pop(dependency, None)
+        return {name: self[name] for name in names}
+
+    def update(self, **values):
+        """Change some inputs, and return the names of the nodes to recompute"""
+        changed = [name for name, value in values.items() if name not in self.values or not _same(self.values[name], value)]
+        self.values.update(values)
+        stale = self.graph.downstream(changed)
+        for name in stale:
+            self._memo.pop(name, None)
+        return stale
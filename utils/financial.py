@@ -0,0 +1,156 @@
+import numpy as np
+import pandas as pd
+
+from utils.tracing import count, traced
+
+
+# Rates where the NPV sign is first checked, to bracket the IRR before refining it
+IRR_BRACKET_GRID = np.array([
+    -0.9999, -0.999, -0.995, -0.99, -0.98, -0.95, -0.9, -0.8, -0.7, -0.6, -0.5, -0.4, -0.3, -0.25, -0.2, -0.15, -0.1, -0.075, -0.05, -0.025,
+    0., 0.025, 0.05, 0.075, 0.1, 0.15, 0.2, 0.25, 0.3, 0.4, 0.5, 0.75, 1., 1.5, 2., 3., 5., 10., 20., 50., 100., 1000., 10000.
+])
+
+
+def npv(rate, cash_flows):
+    """
+    Compute the net present value of every series of a cash flow array at once, like numpy_financial.npv
+    rate: Discount rate, broadcastable to cash_flows.shape[:-1]
+    cash_flows: Array of shape (..., n_periods), the first period being undiscounted
+    """
+    cash_flows = np.asarray(cash_flows, dtype=float)
+    periods = np.arange(cash_flows.shape[-1])
+    return (cash_flows * (1 + np.asarray(rate, dtype=float)[..., None]) ** -periods).sum(axis=-1)
+
+
+def _npv_and_derivative(rate, cash_flows, periods):
+    discount = (1 + rate[:, None]) ** -periods
+    value = (cash_flows * discount).sum(axis=1)
+    derivative = -(periods * cash_flows * discount).sum(axis=1) / (1 + rate)
+    return value, derivative
+
+
+def _refine(cash_flows, periods, low, high, low_npv, high_npv, tol, max_iterations):
+    # Newton step when it stays inside the bracket [low, high], bisection otherwise
+    rate = np.where(low_npv == 0, low, np.where(high_npv == 0, high, (low + high) / 2))
+    converged = (low_npv == 0) | (high_npv == 0)
+    for _ in range(max_iterations):
+        if converged.all():
+            break
+        value, derivative = _npv_and_derivative(rate, cash_flows, periods)
+        same_sign_as_low = np.sign(value) == np.sign(low_npv)
+        low = np.where(same_sign_as_low, rate, low)
+        low_npv = np.where(same_sign_as_low, value, low_npv)
+        high = np.where(same_sign_as_low, high, rate)
+        newton = rate - value / derivative
+        inside = np.isfinite(newton) & (newton > np.minimum(low, high)) & (newton < np.maximum(low, high))
+        new_rate = np.where(value == 0, rate, np.where(inside, newton, (low + high) / 2))
+        done = (np.abs(new_rate - rate) < tol) | (value == 0)
+        rate = np.where(converged, rate, new_rate)
+        converged |= done
+    return rate, converged
+
+
+@traced("solve_irr")
+def solve_irr(cash_flows, tol=1e-10, max_iterations=100):
+    """
+    Compute the internal rate of return of every series of a cash flow array at once
+    cash_flows: Array of shape (..., n_periods), the first period being undiscounted
+    tol: Convergence tolerance on the rate
+    max_iterations: Maximum number of refinement steps
+
+    The NPV is evaluated on IRR_BRACKET_GRID to find, for every series, the sign changes closest to a 0% rate
+    on each side of it. The roots are refined with Newton steps, falling back to bisection whenever a step leaves
+    the bracket, so every series converges, and the one closest to 0 is returned like numpy_financial.irr does.
+    Roots are only searched within the grid, between -99.99% and 1,000,000%, and two roots between consecutive
+    grid rates (no sign change, e.g. a double root) are missed: only cash flows with several sign changes can
+    have them, not the conventional ones of build_yearly_cashflow_df.
+
+    Returns (irr, converged): two arrays of shape cash_flows.shape[:-1]. The IRR is NaN and converged False
+    for series whose NPV never changes sign on the grid (no IRR) or that did not reach tol.
+    """
+    cash_flows = np.asarray(cash_flows, dtype=float)
+    batch_shape = cash_flows.shape[:-1]
+    cash_flows = cash_flows.reshape(-1, cash_flows.shape[-1])
+    count(rows=len(cash_flows))
+    periods = np.arange(cash_flows.shape[1])
+    rows = np.arange(len(cash_flows))
+
+    with np.errstate(all='ignore'):
+        # Bracket: sign changes of the NPV between consecutive grid rates, keeping the closest to 0% on each side
+        grid_npv = cash_flows @ ((1 + IRR_BRACKET_GRID[None, :]) ** -periods[:, None])
+        sign_change = (np.sign(grid_npv[:, :-1]) * np.sign(grid_npv[:, 1:]) <= 0) & (cash_flows != 0).any(axis=1)[:, None]
+        distance_to_zero = np.minimum(np.abs(IRR_BRACKET_GRID[:-1]), np.abs(IRR_BRACKET_GRID[1:]))
+        negative = IRR_BRACKET_GRID[1:] <= 0
+        brackets = [np.where(sign_change & side, distance_to_zero, np.inf).argmin(axis=1) for side in (negative, ~negative)]
+        found = [sign_change[rows, bracket] for bracket in brackets]
+
+        # Refine the bracket closest to 0% of every series, and the other side's one only where both sides have one
+        first = np.where(found[0] & (~found[1] | (distance_to_zero[brackets[0]] <= distance_to_zero[brackets[1]])), 0, 1)
+        bracket = np.where(first == 0, brackets[0], brackets[1])
+        has_root = found[0] | found[1]
+        rate, converged = _refine(
+            cash_flows, periods, IRR_BRACKET_GRID[bracket], IRR_BRACKET_GRID[bracket + 1],
+            grid_npv[rows, bracket], grid_npv[rows, bracket + 1], tol, max_iterations
+        )
+        both = np.flatnonzero(found[0] & found[1])
+        if len(both):
+            other = np.where(first[both] == 0, brackets[1][both], brackets[0][both])
+            other_rate, other_converged = _refine(
+                cash_flows[both], periods, IRR_BRACKET_GRID[other], IRR_BRACKET_GRID[other + 1],
+                grid_npv[both, other], grid_npv[both, other + 1], tol, max_iterations
+            )
+            closer = other_converged & (~converged[both] | (np.abs(other_rate) < np.abs(rate[both])))
+            rate[both] = np.where(closer, other_rate, rate[both])
+            converged[both] |= closer
+
+    converged &= has_root
+    irr = np.where(converged, rate, np.nan)
+    return irr.reshape(batch_shape)[()], converged.reshape(batch_shape)[()]
+
+
+def irr(cash_flows, tol=1e-10, max_iterations=100):
+    """
+    Compute the internal rate of return of every series of a cash flow array at once, NaN when there is none
+    cash_flows: Array of shape (..., n_periods), the first period being undiscounted
+    """
+    return solve_irr(cash_flows, tol, max_iterations)[0]
+
+
+def eqx(cash_flows, apport):
+    """
+    Compute the equity multiple of every series: cumulative cash flow over the apport
+    cash_flows: Array of shape (..., n_periods)
+    apport: Personal contribution, broadcastable to cash_flows.shape[:-1]
+    """
+    return np.asarray(cash_flows, dtype=float).sum(axis=-1) / apport
+
+
+def compute_cashflow_kpis(lines: dict, real_estate_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    This function computes the KPIs of every row of a batch projection.
+
+    Parameters:
+    - lines (dict): The output of build_cashflow_arrays for real_estate_df.
+    - real_estate_df (pd.DataFrame): The enriched dataframe (or records) the projection was built from.
+
+    Returns:
+    - pd.DataFrame: A dataframe with the index of real_estate_df (a range index for records) and the columns
+        - irr: internal rate of return of the net cash flow (NaN when there is none), irr_converged flagging the solved ones
+        - van: net present value of the net cash flow at each row's taux_d_actualisation
+        - eqx: cumulative net cash flow at the end of the detention period divided by the apport
+        - min_cash_flow: minimum yearly net cash flow after year 0 over the detention period
+    """
+    net_cash_flow = lines['net_cash_flow']
+    years = np.arange(net_cash_flow.shape[1])
+    held = years[None, :] <= np.asarray(real_estate_df['durée_de_détention_(année)'])[:, None]
+    rates, converged = solve_irr(net_cash_flow)
+    return pd.DataFrame(
+        {
+            'irr': rates,
+            'irr_converged': converged,
+            'van': npv(np.asarray(real_estate_df['taux_d_actualisation'], dtype=float), net_cash_flow),
+            'eqx': eqx(net_cash_flow, np.asarray(real_estate_df['apport'], dtype=float)),
+            'min_cash_flow': np.where(held, net_cash_flow, np.inf)[:, 1:].min(axis=1),
+        },
+        index=getattr(real_estate_df, 'index', None)
+    )
@@ -1,41 +1,213 @@
-import streamlit as st
-import pandas as pd
-import io
-from google.cloud import storage
-from google.oauth2 import service_account
-
-
-service_account_info = {
-    "type": st.secrets["connections"]["gcs"]["type"],
-    "project_id": st.secrets["connections"]["gcs"]["project_id"],
-    "private_key_id": st.secrets["connections"]["gcs"]["private_key_id"],
-    "private_key": st.secrets["connections"]["gcs"]["private_key"].replace('\\n', '\n'),
-    "client_email": st.secrets["connections"]["gcs"]["client_email"],
-    "client_id": st.secrets["connections"]["gcs"]["client_id"],
-    "auth_uri": st.secrets["connections"]["gcs"]["auth_uri"],
-    "token_uri": st.secrets["connections"]["gcs"]["token_uri"],
-    "auth_provider_x509_cert_url": st.secrets["connections"]["gcs"]["auth_provider_x509_cert_url"],
-    "client_x509_cert_url": st.secrets["connections"]["gcs"]["client_x509_cert_url"],
-    "universe_domain": st.secrets["connections"]["gcs"]["universe_domain"]
-}
-
-# Create credentials and client
-credentials = service_account.Credentials.from_service_account_info(service_account_info)
-client = storage.Client(credentials=credentials)
-bucket_name = st.secrets["connections"]["gcs"]["gcp_bucket_name"]
-bucket = client.bucket(bucket_name)
-
-
-def download_dataframe(filename):
-    blob = bucket.blob(filename)
-    content = blob.download_as_text()
-    return pd.read_csv(io.StringIO(content))
-
-
-def upload_dataframe(df, filename):
-    csv_buffer = io.BytesIO()
-    df.to_csv(csv_buffer, index=False)
-    csv_buffer.seek(0)
-    
-    blob = bucket.blob(filename)
-    blob.upload_from_file(csv_buffer, content_type='text/csv')
\ No newline at end of file
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import quote
+
+from utils.serialization import parse_dataframe, serialize_dataframe
+from utils.storage import get_backend, set_backend
+from utils.tracing import count, span, traced
+
+
+# Files are stored through the backend of utils.storage (the GCS bucket by default, see STORAGE_BACKEND_ENV)
+
+# Read cache: parsed DataFrames in memory and raw objects on disk, both keyed on the file generation
+CACHE_DIR = os.path.join(tempfile.gettempdir(), "bp_invest_cache")
+CACHE_MAX_ENTRIES = 16
+CACHE_TTL_SECONDS = 15 * 60
+
+_cache = OrderedDict()  # (filename, columns, filters) -> (generation, DataFrame, last access time)
+_cache_lock = threading.Lock()
+_cache_stats = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+
+def _disk_cache_path(filename, generation):
+    return os.path.join(CACHE_DIR, f"{quote(filename, safe='')}.{generation}")
+
+
+def _remove_disk_copies(filename):
+    prefix = f"{quote(filename, safe='')}."
+    if os.path.isdir(CACHE_DIR):
+        for name in os.listdir(CACHE_DIR):
+            if name.startswith(prefix) and not name.endswith(".tmp"):
+                try:
+                    os.remove(os.path.join(CACHE_DIR, name))
+                except FileNotFoundError:
+                    pass
+
+
+def _evict(now):
+    for key, (_, _, last_access) in list(_cache.items()):
+        if now - last_access > CACHE_TTL_SECONDS:
+            del _cache[key]
+            _cache_stats["evictions"] += 1
+    while len(_cache) > CACHE_MAX_ENTRIES:
+        _cache.popitem(last=False)
+        _cache_stats["evictions"] += 1
+
+
+def _read_disk_copy(filename, generation):
+    """Return the disk copy of a file generation, None if there is none"""
+    path = _disk_cache_path(filename, generation)
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        content = f.read()
+    count(disk_bytes=len(content))
+    return content
+
+
+def _write_disk_copy(filename, generation, content):
+    path = _disk_cache_path(filename, generation)
+    _remove_disk_copies(filename)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def use_backend(backend):
+    """Switch the storage backend (see utils.storage) and drop the cached copies of the previous one"""
+    set_backend(backend)
+    invalidate_cache()
+
+
+def get_cache_stats():
+    """Return the read cache counters and the number of DataFrames held in memory"""
+    with _cache_lock:
+        return {**_cache_stats, "entries": len(_cache)}
+
+
+def invalidate_cache(filename=None):
+    """Drop the cached copies of one file, or of every file when filename is None"""
+    with _cache_lock:
+        filenames = {key[0] for key in _cache} if filename is None else {filename}
+        for key in [key for key in _cache if key[0] in filenames]:
+            del _cache[key]
+        for name in filenames:
+            _remove_disk_copies(name)
+
+
+def _get_cached(key, generation, now):
+    """Return a copy of the cached DataFrame of a file generation, None on a miss"""
+    with _cache_lock:
+        _evict(now)
+        cached = _cache.get(key)
+        if cached is None or cached[0] != generation:
+            return None
+        _cache[key] = (generation, cached[1], now)
+        _cache.move_to_end(key)
+        _cache_stats["hits"] += 1
+    count(cache_hits=1, rows=len(cached[1]))
+    return cached[1].copy()
+
+
+def _parse_and_cache(key, content, generation, from_disk, columns, filters, now):
+    with span("parse_dataframe") as parse_span:
+        df = parse_dataframe(content, key[0], columns, filters)
+        parse_span.add(rows=len(df))
+    count(cache_misses=1)
+    with _cache_lock:
+        _cache_stats["disk_hits" if from_disk else "misses"] += 1
+        _cache[key] = (generation, df, now)
+        _cache.move_to_end(key)
+        _evict(now)
+    return df.copy()
+
+
+@traced("storage.download_dataframe")
+def download_dataframe(filename, columns=None, filters=None):
+    """
+    Download a CSV or Parquet file (chosen by extension) as a DataFrame.
+    columns: only read these columns
+    filters: only read the rows matching every (column, op, value) condition; Parquet row groups whose
+        statistics exclude the condition are skipped without being decoded
+    columns and filters reduce the decoding and the memory of the DataFrame, not the transfer: the whole object is
+    downloaded once per generation and kept on disk, so the other reads of the file (whatever their columns and
+    filters) are served from the disk copy.
+    """
+    backend = get_backend()
+    # Cheap metadata request: only the generation is compared with the cached copy
+    generation = backend.with_retry(backend.get_generation, filename)
+    if not generation:
+        raise FileNotFoundError(backend.describe(filename))
+    key = (filename, None if columns is None else tuple(columns), None if filters is None else repr(filters))
+    now = time.monotonic()
+    df = _get_cached(key, generation, now)
+    if df is not None:
+        return df
+
+    content = _read_disk_copy(filename, generation)
+    from_disk = content is not None
+    if not from_disk:
+        content, generation = backend.with_retry(backend.get, filename)
+        count(downloaded_bytes=len(content))
+        _write_disk_copy(filename, generation, content)
+    return _parse_and_cache(key, content, generation, from_disk, columns, filters, now)
+
+
+@traced("storage.download_dataframes")
+def download_dataframes(files):
+    """
+    Download many CSV or Parquet files at once, fetching concurrently (with retries) the ones without a disk copy.
+    files: {filename: generation} of the files to read, as returned by list_files
+    Returns {filename: DataFrame}. The DataFrames are not kept in the in-memory cache, which is meant for a few large files:
+    callers reading many small immutable files (e.g. segments) keep their own copies.
+    Raises FileNotFoundError if one of the files does not exist anymore.
+    """
+    backend = get_backend()
+    contents = {}
+    for filename, generation in files.items():
+        content = _read_disk_copy(filename, generation)
+        if content is not None:
+            contents[filename] = content
+    missing = [filename for filename in files if filename not in contents]
+    for filename, (content, generation) in backend.fetch_many(missing).items():
+        count(downloaded_bytes=len(content))
+        _write_disk_copy(filename, generation, content)
+        contents[filename] = content
+    with _cache_lock:
+        _cache_stats["disk_hits"] += len(files) - len(missing)
+        _cache_stats["misses"] += len(missing)
+    with span("parse_dataframe") as parse_span:
+        dfs = {filename: parse_dataframe(contents[filename], filename) for filename in files}
+        parse_span.add(rows=sum(len(df) for df in dfs.values()))
+    return dfs
+
+
+@traced("storage.upload_dataframe")
+def upload_dataframe(df, filename, if_generation_match=None):
+    """
+    Upload a DataFrame as CSV or Parquet (chosen by extension) and return the generation of the written file.
+    if_generation_match: only write if the current generation matches (0 means the file must not exist yet)
+    """
+    backend = get_backend()
+    content, content_type = serialize_dataframe(df, filename)
+    count(rows=len(df), uploaded_bytes=len(content))
+    try:
+        return backend.with_retry(backend.put, filename, content, content_type, if_generation_match)
+    finally:
+        invalidate_cache(filename)
+
+
+def get_generation(filename):
+    """Return the current generation of a file, 0 if it does not exist"""
+    backend = get_backend()
+    return backend.with_retry(backend.get_generation, filename)
+
+
+def list_files(prefix):
+    """Return {filename: generation} for every file starting with prefix, in lexicographic order"""
+    backend = get_backend()
+    return backend.with_retry(backend.list, prefix)
+
+
+def delete_file(filename, if_generation_match=None):
+    """Delete a file, ignoring files that are already gone"""
+    backend = get_backend()
+    try:
+        backend.with_retry(backend.delete, filename, if_generation_match)
+    finally:
+        invalidate_cache(filename)
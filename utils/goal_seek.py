@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+
+from utils.financial import compute_cashflow_kpis
+from utils.schema import records_from_df
+from utils.transformations import build_cashflow_arrays, create_additional_features
+
+
+# Direction of the search for each input: the highest price, the smallest deposit or the lowest rent reaching the target
+GOAL_SEEK_VARIABLES = {
+    'prix_d_achat': 'max',
+    'apport': 'min',
+    'loyer_mensuel': 'min',
+}
+
+GOAL_SEEK_KPIS = ['irr', 'van', 'min_cash_flow', 'eqx']
+
+# Default search interval of each input, relative to the property's current prix_d_achat / loyer_mensuel,
+# and to its prix_acquisition for the apport (from no deposit to no loan)
+DEFAULT_BOUNDS = {
+    'prix_d_achat': (0.5, 2.),
+    'apport': (0., 1.),
+    'loyer_mensuel': (0., 3.),
+}
+
+
+def _evaluate(real_estate_df, variable, values, kpi, time_horizon):
+    """KPI of every property (rows) for every candidate value (columns), in a single batch projection"""
+    n_properties, n_candidates = values.shape
+    # The batch is one contiguous array of records rather than a repeated dataframe
+    batch = np.repeat(records_from_df(real_estate_df), n_candidates)
+    batch[variable] = values.ravel()
+    batch = create_additional_features(batch)
+    with np.errstate(divide='ignore', invalid='ignore'):  # eqx of a zero apport
+        kpis = compute_cashflow_kpis(build_cashflow_arrays(batch, time_horizon), batch)
+    return kpis[kpi].to_numpy(dtype=float).reshape(n_properties, n_candidates)
+
+
+def _default_bounds(real_estate_df, variable):
+    low, high = DEFAULT_BOUNDS[variable]
+    if variable == 'apport':
+        reference = create_additional_features(real_estate_df)['prix_acquisition'].to_numpy(dtype=float)
+    else:
+        reference = real_estate_df[variable].to_numpy(dtype=float, na_value=np.nan)
+    return low * reference, high * reference
+
+
+def goal_seek(real_estate_df: pd.DataFrame, variable: str, kpi: str, target: float, bounds: tuple = None,
+              time_horizon: int = 30, grid_size: int = 33, refine_size: int = 17, tol: float = 1., max_rounds: int = 20) -> pd.DataFrame:
+    """
+    This function finds, for every property of a real estate dataframe, the most favourable value of an input that still
+    reaches a KPI target: the highest prix_d_achat, the smallest apport or the lowest loyer_mensuel (see GOAL_SEEK_VARIABLES).
+    Candidate values are evaluated for all properties at once with build_cashflow_arrays: a coarse grid over the bounds
+    brackets the boundary of the feasible values, then each bracket is refined with a finer grid until it is smaller than tol.
+
+    Parameters:
+    - real_estate_df (pd.DataFrame): The dataframe of the property inputs (before create_additional_features), one row per property.
+    - variable (str): The input to solve for, a key of GOAL_SEEK_VARIABLES.
+    - kpi (str): The KPI to reach, one of GOAL_SEEK_KPIS (as computed by compute_cashflow_kpis).
+    - target (float): The minimum value of the KPI, e.g. 0.08 for an 8% IRR.
+    - bounds (tuple): The (low, high) search interval, scalars or one value per property. Defaults to DEFAULT_BOUNDS.
+    - time_horizon (int): The number of years to project the cashflow.
+    - grid_size (int): The number of candidates of the coarse grid.
+    - refine_size (int): The number of candidates of each refinement grid (each round divides the bracket by refine_size - 1).
+    - tol (float): The width of the final bracket, in euros.
+    - max_rounds (int): The maximum number of refinement rounds.
+
+    Returns:
+    - pd.DataFrame: A dataframe with the index of real_estate_df and the columns
+        - value: the solved value of the input, the reported value always reaching the target (NaN when no value does)
+        - kpi: the KPI at that value
+        - status: 'found', 'bound' when the whole interval up to the favourable bound reaches the target, or 'infeasible'
+    """
+    if variable not in GOAL_SEEK_VARIABLES:
+        raise ValueError(f"Unknown goal seek variable {variable!r}, expected one of {list(GOAL_SEEK_VARIABLES)}")
+    if kpi not in GOAL_SEEK_KPIS:
+        raise ValueError(f"Unknown goal seek KPI {kpi!r}, expected one of {GOAL_SEEK_KPIS}")
+    index = real_estate_df.index
+    real_estate_df = real_estate_df.reset_index(drop=True)
+    n_properties = len(real_estate_df)
+    rows = np.arange(n_properties)
+    low, high = _default_bounds(real_estate_df, variable) if bounds is None else bounds
+    low = np.broadcast_to(np.asarray(low, dtype=float), (n_properties,))
+    high = np.broadcast_to(np.asarray(high, dtype=float), (n_properties,))
+
+    # Bracket: the most favourable feasible candidate of the coarse grid and its unfeasible neighbour
+    grid = low[:, None] + (high - low)[:, None] * np.linspace(0, 1, grid_size)[None, :]
+    feasible = _evaluate(real_estate_df, variable, grid, kpi, time_horizon) >= target  # NaN KPIs are never feasible
+    found = feasible.any(axis=1)
+    if GOAL_SEEK_VARIABLES[variable] == 'max':
+        best = grid_size - 1 - feasible[:, ::-1].argmax(axis=1)
+        neighbour = best + 1
+    else:
+        best = feasible.argmax(axis=1)
+        neighbour = best - 1
+    at_bound = found & ((neighbour < 0) | (neighbour >= grid_size))
+    feasible_end = grid[rows, best]
+    unfeasible_end = grid[rows, np.clip(neighbour, 0, grid_size - 1)]
+
+    # Refine: candidates from the feasible end to the unfeasible end, keeping the first transition
+    refining = found & ~at_bound
+    steps = np.linspace(0, 1, refine_size)[None, :]
+    for _ in range(max_rounds):
+        refining &= np.abs(unfeasible_end - feasible_end) > tol
+        if not refining.any():
+            break
+        candidates = feasible_end[refining, None] + (unfeasible_end - feasible_end)[refining, None] * steps
+        candidates_feasible = _evaluate(real_estate_df.loc[refining], variable, candidates, kpi, time_horizon) >= target
+        candidates_feasible[:, 0] = True
+        candidates_feasible[:, -1] = False
+        transition = (~candidates_feasible).argmax(axis=1)
+        refined_rows = np.arange(len(candidates))
+        feasible_end[refining] = candidates[refined_rows, transition - 1]
+        unfeasible_end[refining] = candidates[refined_rows, transition]
+
+    value = np.where(found, feasible_end, np.nan)
+    solved_kpi = np.full(n_properties, np.nan)
+    solved_kpi[found] = _evaluate(real_estate_df.loc[found], variable, value[found, None], kpi, time_horizon)[:, 0]
+    return pd.DataFrame(
+        {
+            'value': value,
+            'kpi': solved_kpi,
+            'status': np.where(found, np.where(at_bound, 'bound', 'found'), 'infeasible'),
+        },
+        index=index
+    )
@@ -0,0 +1,62 @@
+import pandas as pd
+
+from utils.database import latest_rows, load_real_estate_database
+from utils.portfolio import compute_portfolio
+from utils.schema import REAL_ESTATE_DTYPES
+
+
+# The latest state comes from load_latest_index, which never reads the history; these queries scan the saved versions.
+
+
+def list_versions(real_estate_id) -> pd.DataFrame:
+    """
+    Return every saved version of a real estate in save order, with a 'version' column numbering them from 0.
+    Only the row groups of this real estate are read from the base snapshot.
+    """
+    versions = load_real_estate_database(filters=[('real_estate_id', '=', real_estate_id)])
+    if versions.empty:
+        raise KeyError(f"No saved version of {real_estate_id!r}")
+    versions = versions.sort_values('timestamp', kind='stable').reset_index(drop=True)
+    return versions.assign(version=versions.index)
+
+
+def _same_value(a, b):
+    # Missing values (NA for text, NaN for numbers) are equal to each other and differ from any value
+    if pd.isna(a) or pd.isna(b):
+        return pd.isna(a) and pd.isna(b)
+    return a == b
+
+
+def diff_versions(versions: pd.DataFrame, before: int = -2, after: int = -1) -> pd.DataFrame:
+    """
+    Return the inputs that differ between two versions of list_versions (positions, negative ones counting from the
+    latest version), as a dataframe indexed by input with the 'before' and 'after' values.
+    """
+    fields = [field for field in REAL_ESTATE_DTYPES if field in versions]
+    old, new = versions.iloc[before][fields], versions.iloc[after][fields]
+    changed = [field for field in fields if not _same_value(old[field], new[field])]
+    return pd.DataFrame({'before': old[changed], 'after': new[changed]}).rename_axis('input')
+
+
+def as_of(date, real_estate_ids: list = None) -> pd.DataFrame:
+    """
+    Return the version of every real estate (or of real_estate_ids) that was the latest one on date,
+    indexed by real_estate_id like load_latest_index. Real estates first saved after date are left out.
+    """
+    filters = [('timestamp', '<=', pd.Timestamp(date))]
+    if real_estate_ids is not None:
+        filters.append(('real_estate_id', 'in', list(real_estate_ids)))
+    versions = load_real_estate_database(filters=filters)
+    if versions.empty:
+        return versions
+    return latest_rows(versions).set_index('real_estate_id', drop=False)
+
+
+def portfolio_as_of(date, real_estate_ids: list = None, time_horizon: int = 30) -> dict:
+    """Recompute the portfolio (see compute_portfolio) from the versions that were the latest ones on date"""
+    return compute_portfolio(as_of(date, real_estate_ids), time_horizon)
+
+
+def kpis_as_of(date, real_estate_ids: list = None, time_horizon: int = 30) -> pd.DataFrame:
+    """Recompute the portfolio KPIs (see compute_portfolio) of the versions that were the latest ones on date"""
+    return portfolio_as_of(date, real_estate_ids, time_horizon)['kpis']
@@ -0,0 +1,156 @@
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from utils.financial import irr
+from utils.transformations import YEARLY_PATH_INPUTS, build_cashflow_arrays, create_additional_features
+
+
+# Distribution of the yearly draws of each market hypothesis, 'mean' defaulting to the property's own value.
+# distribution: 'normal' (mean, std), 'lognormal' (1 + value is lognormal with this mean and std), 'uniform' (low, high) or 'fixed'
+# low / high: optional bounds the draws are clipped to
+DEFAULT_DISTRIBUTIONS = {
+    'market_value_growth': {'distribution': 'normal', 'std': 0.03},
+    'market_rent_growth': {'distribution': 'normal', 'std': 0.01},
+    'property_tax_growth': {'distribution': 'normal', 'std': 0.01},
+    'vacancy': {'distribution': 'normal', 'std': 0.02, 'low': 0, 'high': 1},
+    'loyers_impayés': {'distribution': 'normal', 'std': 0.01, 'low': 0, 'high': 1},
+}
+
+# Correlations between the draws of the same year (Gaussian copula), pairs not listed being independent
+DEFAULT_CORRELATIONS = {
+    ('market_value_growth', 'market_rent_growth'): 0.5,
+    ('market_rent_growth', 'property_tax_growth'): 0.3,
+    ('market_rent_growth', 'vacancy'): -0.3,
+    ('vacancy', 'loyers_impayés'): 0.4,
+}
+
+# Paths simulated together; each chunk holds a few (CHUNK_SIZE, time_horizon + 1) arrays per cashflow line
+CHUNK_SIZE = 2500
+
+
+def _normal_cdf(z):
+    # Standard normal CDF on float arrays, erf by the Abramowitz & Stegun 7.1.26 approximation (absolute error below 1.5e-7)
+    x = np.abs(z) / math.sqrt(2)
+    t = 1 / (1 + 0.3275911 * x)
+    erf = 1 - t * (0.254829592 + t * (-0.284496736 + t * (1.421413741 + t * (-1.453152027 + t * 1.061405429)))) * np.exp(-x ** 2)
+    return 0.5 * (1 + np.sign(z) * erf)
+
+
+def _cholesky(correlations):
+    matrix = np.eye(len(YEARLY_PATH_INPUTS))
+    for (first, second), correlation in correlations.items():
+        i, j = YEARLY_PATH_INPUTS.index(first), YEARLY_PATH_INPUTS.index(second)
+        matrix[i, j] = matrix[j, i] = correlation
+    try:
+        return np.linalg.cholesky(matrix)
+    except np.linalg.LinAlgError as e:
+        raise ValueError("The correlations do not form a valid correlation matrix") from e
+
+
+def _draw(z, distribution, mean):
+    kind = distribution.get('distribution', 'normal')
+    mean = distribution.get('mean', mean)
+    if kind == 'normal':
+        values = mean + distribution['std'] * z
+    elif kind == 'lognormal':
+        sigma = math.sqrt(math.log(1 + (distribution['std'] / (1 + mean)) ** 2))
+        values = (1 + mean) * np.exp(sigma * z - sigma ** 2 / 2) - 1
+    elif kind == 'uniform':
+        values = distribution['low'] + (distribution['high'] - distribution['low']) * _normal_cdf(z)
+    elif kind == 'fixed':
+        values = np.full(z.shape, mean, dtype=float)
+    else:
+        raise ValueError(f"Unknown distribution {kind!r}")
+    return np.clip(values, distribution.get('low', -np.inf), distribution.get('high', np.inf))
+
+
+def draw_yearly_paths(real_estate_df, n_paths, rng, distributions=None, correlations=None, time_horizon=30):
+    """
+    Draw correlated yearly paths of the YEARLY_PATH_INPUTS of a single property.
+    Returns a dict of arrays of shape (n_paths, time_horizon + 1), ready for build_cashflow_arrays(yearly_paths=...).
+    """
+    distributions = {**DEFAULT_DISTRIBUTIONS, **(distributions or {})}
+    cholesky = _cholesky(DEFAULT_CORRELATIONS if correlations is None else correlations)
+    z = rng.standard_normal((n_paths, time_horizon + 1, len(YEARLY_PATH_INPUTS))) @ cholesky.T
+    return {
+        name: _draw(z[:, :, i], distributions[name], float(real_estate_df[name].iloc[0]))
+        for i, name in enumerate(YEARLY_PATH_INPUTS)
+    }
+
+
+def _simulate_chunk(real_estate_df, n_paths, seed, distributions, correlations, time_horizon):
+    rng = np.random.default_rng(seed)
+    yearly_paths = draw_yearly_paths(real_estate_df, n_paths, rng, distributions, correlations, time_horizon)
+    lines = build_cashflow_arrays(real_estate_df, time_horizon, yearly_paths=yearly_paths)
+    net_cash_flow = lines['net_cash_flow']
+    years = np.arange(time_horizon + 1)
+    held = years <= real_estate_df['durée_de_détention_(année)'].iloc[0]
+    cumulative = lines['cumulative_net_cash_flow'][:, held]
+    discount_factors = (1 + real_estate_df['taux_d_actualisation'].iloc[0]) ** -years
+    return {
+        'irr': irr(net_cash_flow),
+        'van': net_cash_flow @ discount_factors,
+        'cumulative_net_cash_flow': lines['cumulative_net_cash_flow'][:, -1],
+        'max_drawdown': (np.maximum.accumulate(cumulative, axis=1) - cumulative).max(axis=1),
+    }
+
+
+def simulate(real_estate_df: pd.DataFrame, n_paths: int = 10_000, seed: int = 0, distributions: dict = None,
+             correlations: dict = None, time_horizon: int = 30, chunk_size: int = CHUNK_SIZE, n_workers: int = 1) -> pd.DataFrame:
+    """
+    This function runs a Monte Carlo simulation of a property's cashflow under stochastic market hypotheses.
+    Every year of every path draws market_value_growth, market_rent_growth, property_tax_growth, vacancy and loyers_impayés
+    from their distributions, and all paths of a chunk go through build_cashflow_arrays as one (paths x years) computation.
+
+    Parameters:
+    - real_estate_df (pd.DataFrame): The single-row dataframe of the property inputs (before create_additional_features).
+    - n_paths (int): The number of simulated paths.
+    - seed (int): The seed of the random draws. Chunks get independent child seeds, so results only depend on
+      seed, n_paths and chunk_size, not on the number of workers.
+    - distributions (dict): Overrides of DEFAULT_DISTRIBUTIONS, by input name.
+    - correlations (dict): Correlations by pair of input names, replacing DEFAULT_CORRELATIONS.
+    - time_horizon (int): The number of years to project the cashflow.
+    - chunk_size (int): The number of paths simulated together, bounding the memory used per chunk.
+    - n_workers (int): The number of processes simulating chunks in parallel (None for every core).
+
+    Returns:
+    - pd.DataFrame: One row per path with irr, van (at the property's taux_d_actualisation),
+      cumulative_net_cash_flow at the end of the detention period and max_drawdown (largest peak-to-trough decline of the
+      cumulative net cash flow over the detention period).
+    """
+    real_estate_df = create_additional_features(real_estate_df.iloc[:1].reset_index(drop=True))
+    chunk_sizes = [min(chunk_size, n_paths - start) for start in range(0, n_paths, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunk_sizes))
+    arguments = [
+        (real_estate_df, size, chunk_seed, distributions, correlations, time_horizon)
+        for size, chunk_seed in zip(chunk_sizes, seeds)
+    ]
+    n_workers = os.cpu_count() if n_workers is None else n_workers
+    if n_workers > 1 and len(arguments) > 1:
+        with ProcessPoolExecutor(max_workers=min(n_workers, len(arguments))) as executor:
+            chunks = list(executor.map(_simulate_chunk, *zip(*arguments)))
+    else:
+        chunks = [_simulate_chunk(*chunk_arguments) for chunk_arguments in arguments]
+    return pd.DataFrame({name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]})
+
+
+def summarize_simulation(results: pd.DataFrame, percentiles=(5, 25, 50, 75, 95)) -> dict:
+    """
+    Summarize the paths of simulate.
+
+    Returns:
+    - dict with:
+        - percentiles: dataframe of the mean and percentiles of every result column (IRR of non-converged paths ignored)
+        - probability_negative_cash_flow: share of paths ending the detention period with a negative cumulative net cash flow
+    """
+    summary = pd.DataFrame(
+        {f'p{q}': results.quantile(q / 100) for q in percentiles}
+    ).assign(mean=results.mean())
+    return {
+        'percentiles': summary,
+        'probability_negative_cash_flow': float((results['cumulative_net_cash_flow'] < 0).mean()),
+    }
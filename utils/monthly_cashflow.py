@@ -0,0 +1,147 @@
+import numpy as np
+import pandas as pd
+
+from utils.amortization import amortization_schedule
+from utils.transformations import CASHFLOW_LINES, CUMULATIVE_LINES, RECURRING_CHARGES
+
+
+MONTHLY_CASHFLOW_LINES = CASHFLOW_LINES + ['intérêts', 'capital_remboursé', 'indemnités_de_remboursement_anticipé']
+
+# Lines holding an amount at a date rather than a flow over the period: rolled up with their end-of-year value
+STOCK_LINES = ['valeur_vénale', 'capital_restant_dû']
+
+# French cap on early repayment penalties: the lowest of 6 months of interest and 3% of the remaining capital
+FRENCH_EARLY_REPAYMENT_PENALTY = {'months_of_interest': 6, 'capital_rate': 0.03}
+
+
+def build_monthly_cashflow_arrays(real_estate_df: pd.DataFrame, time_horizon: int = 30, exit_month=None, early_repayment_penalty: dict = None) -> dict:
+    """
+    This function projects the monthly cashflow of every property of an enriched real estate dataframe in a single pass.
+    Yearly amounts of build_cashflow_arrays are spread evenly over the months of their year, the loan is amortized month by month
+    and the sale can happen in any month.
+
+    Parameters:
+    - real_estate_df (pd.DataFrame): The output of create_additional_features, with one row per property.
+    - time_horizon (int): The number of years to project the cashflow (12 * time_horizon months).
+    - exit_month (int or array): The month of the sale, per property. Defaults to 12 * "durée_de_détention_(année)".
+    - early_repayment_penalty (dict): Penalty paid on the capital repaid at the sale, the lowest of
+      'months_of_interest' months of interest and 'capital_rate' * remaining capital (e.g. FRENCH_EARLY_REPAYMENT_PENALTY).
+      No penalty by default.
+
+    Returns:
+    - dict: A mapping from each line item of MONTHLY_CASHFLOW_LINES to an array of shape (n_properties, 12 * time_horizon + 1),
+      column m holding month m (month 0 being the acquisition). On top of the yearly lines:
+        - intérêts / capital_remboursé: interest and principal parts of the remboursements (algebric values)
+        - indemnités_de_remboursement_anticipé: early repayment penalty in the month of the sale, included in valeur_nette_de_sortie
+    """
+    def column(name):
+        return real_estate_df[name].to_numpy(dtype=float, na_value=np.nan)[:, None]
+
+    months = np.arange(12 * time_horizon + 1)[None, :]
+    first_month = months == 0
+    year = np.ceil(months / 12)
+    year_end = (months % 12 == 0) & ~first_month
+    exit_month = column('durée_de_détention_(année)') * 12 if exit_month is None else np.asarray(exit_month, dtype=float).reshape(-1, 1)
+    held = months <= exit_month
+    selling_month = months == exit_month
+    frequency = column('fréquence')
+    credit_months = column('durée_de_crédit_(année)') * 12
+    lines = {}
+
+    # Income
+    lines['rent'] = np.where(first_month, 0, column('loyer_mensuel') * (1 + column('market_rent_growth')) ** (year - 1))
+    lines['vacancy'] = -lines['rent'] * column('vacancy')
+    lines['unpaied_rent'] = -lines['rent'] * column('loyers_impayés')
+    lines['gross_effective_revenues'] = lines['rent'] + lines['vacancy'] + lines['unpaied_rent']
+    # Recurring charges
+    charges_growth = (1 + column('property_tax_growth')) ** (year - 1) / 12
+    for charge in RECURRING_CHARGES:
+        lines[charge] = np.where(first_month, 0, -column(charge) * charges_growth)
+    lines['total_charges_récurrantes'] = sum(lines[charge] for charge in RECURRING_CHARGES)
+    lines['net_operating_income'] = lines['gross_effective_revenues'] + lines['total_charges_récurrantes']
+    # Non Recurring charges, the works being paid in the last month of their year
+    lines['apport'] = np.where(first_month, -column('apport'), 0)
+    works_month = (frequency > 0) & year_end & (year % np.where(frequency > 0, frequency, 1) == 0)
+    lines['travaux_non_récurrents'] = np.where(works_month, -column('travaux_non_récurrent'), 0)
+    lines['total_non_recurring_charges'] = lines['apport'] + lines['travaux_non_récurrents']
+    # Debt
+    schedule = amortization_schedule(column('montant_emprunté'), column('taux_d_emprunt'), credit_months, months)
+    lines['remboursements'] = -schedule['payments']
+    lines['intérêts'] = -schedule['interest']
+    lines['capital_remboursé'] = -schedule['principal']
+    lines['cash_flow_after_debt'] = lines['net_operating_income'] + lines['total_non_recurring_charges'] + lines['remboursements']
+    # Selling hypothesis
+    lines['valeur_vénale'] = column('valeur_vénale') * (1 + column('market_value_growth')) ** (months / 12)
+    lines['valeur_vénale_à_la_vente'] = np.where(selling_month, lines['valeur_vénale'], 0)
+    lines['frais_de_vente'] = -lines['valeur_vénale_à_la_vente'] * column('frais_de_vente_(taux)')
+    lines['capital_restant_dû'] = -schedule['balance']
+    lines['capital_residuel_à_la_vente'] = np.where(selling_month, lines['capital_restant_dû'], 0)
+    if early_repayment_penalty is None:
+        lines['indemnités_de_remboursement_anticipé'] = np.zeros(months.shape)
+    else:
+        interest_penalty = lines['capital_residuel_à_la_vente'] * column('taux_d_emprunt') / 12 * early_repayment_penalty['months_of_interest']
+        capital_penalty = lines['capital_residuel_à_la_vente'] * early_repayment_penalty['capital_rate']
+        lines['indemnités_de_remboursement_anticipé'] = np.maximum(interest_penalty, capital_penalty)  # algebric values, so the lowest penalty
+    lines['valeur_nette_de_sortie'] = (
+        lines['valeur_vénale_à_la_vente'] + lines['frais_de_vente'] + lines['capital_residuel_à_la_vente'] + lines['indemnités_de_remboursement_anticipé']
+    )
+    # Net Cash Flow
+    lines['net_cash_flow'] = lines['cash_flow_after_debt'] + lines['valeur_nette_de_sortie']
+
+    # Remove months after the sale, then accumulate
+    shape = (len(real_estate_df), months.shape[1])
+    for name, values in lines.items():
+        values = np.where(held, values, 0.)
+        lines[name] = values if values.shape == shape else np.broadcast_to(values, shape)
+    lines['cumulative_cash_flow_after_debt'] = lines['cash_flow_after_debt'].cumsum(axis=1)
+    lines['cumulative_net_cash_flow'] = lines['net_cash_flow'].cumsum(axis=1)
+    return {name: lines[name] for name in MONTHLY_CASHFLOW_LINES}
+
+
+def roll_up_yearly(monthly_lines: dict, exit_month) -> dict:
+    """
+    Aggregate the output of build_monthly_cashflow_arrays into yearly lines, with the layout of build_cashflow_arrays.
+    Year 0 is month 0 and year y gathers months 12 * (y - 1) + 1 to 12 * y: flows are summed, STOCK_LINES keep the value
+    of the last month held in the year and CUMULATIVE_LINES are accumulated again. With the default whole-year exit and
+    no early repayment penalty, the result matches build_cashflow_arrays up to floating point rounding.
+    exit_month: The month of the sale used for the projection, per property (e.g. 12 * "durée_de_détention_(année)").
+    """
+    n_properties, n_months = monthly_lines['net_cash_flow'].shape
+    n_years = (n_months - 1) // 12
+    # Month 0 alone, then the 12 months of each year
+    year_starts = np.concatenate([[0], 12 * np.arange(n_years) + 1])
+    exit_month = np.broadcast_to(np.asarray(exit_month, dtype=int).reshape(-1, 1), (n_properties, 1))
+    year_ends = np.minimum(12 * np.arange(n_years + 1)[None, :], exit_month)
+    held_years = 12 * np.arange(n_years + 1)[None, :] - 11 <= exit_month
+    yearly_lines = {}
+    for name, values in monthly_lines.items():
+        if name in STOCK_LINES:
+            yearly_lines[name] = np.where(held_years, np.take_along_axis(values, year_ends, axis=1), 0.)
+        elif name not in CUMULATIVE_LINES:
+            yearly_lines[name] = np.add.reduceat(values, year_starts, axis=1)
+    yearly_lines['cumulative_cash_flow_after_debt'] = yearly_lines['cash_flow_after_debt'].cumsum(axis=1)
+    yearly_lines['cumulative_net_cash_flow'] = yearly_lines['net_cash_flow'].cumsum(axis=1)
+    return {name: yearly_lines[name] for name in MONTHLY_CASHFLOW_LINES}
+
+
+def build_monthly_cashflow_df(real_estate_df: pd.DataFrame, time_horizon: int = 30, exit_month: int = None, early_repayment_penalty: dict = None) -> pd.DataFrame:
+    """
+    This function builds the monthly cashflow dataframe of the first property of a real estate dataframe.
+
+    Parameters:
+    - real_estate_df (pd.DataFrame): The output of create_additional_features.
+    - time_horizon (int): The number of years to project the cashflow.
+    - exit_month (int): The month of the sale, defaults to the end of the detention period.
+    - early_repayment_penalty (dict): See build_monthly_cashflow_arrays.
+
+    Returns:
+    - pd.DataFrame: A dataframe indexed by 'month_{i}' up to the month of the sale, with the MONTHLY_CASHFLOW_LINES as columns.
+    """
+    lines = build_monthly_cashflow_arrays(real_estate_df.iloc[:1], time_horizon, exit_month, early_repayment_penalty)
+    exit_month = int(real_estate_df.iloc[0]['durée_de_détention_(année)']) * 12 if exit_month is None else int(exit_month)
+    monthly_cashflow_df = (
+        pd.DataFrame({name: values[0, :exit_month + 1] for name, values in lines.items()})
+        .rename(index=lambda i: f'month_{i}')
+        .rename_axis('month')
+    )
+    return monthly_cashflow_df
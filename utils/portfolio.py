@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+
+from utils.financial import compute_cashflow_kpis
+from utils.transformations import build_cashflow_arrays, create_additional_features
+
+
+PORTFOLIO_KPIS = ['irr', 'van', 'eqx', 'cash_on_cash', 'ltv', 'min_cash_flow']
+
+
+def compute_portfolio(latest_df: pd.DataFrame, time_horizon: int = 30) -> dict:
+    """
+    This function computes the KPIs of every property of the portfolio in a single batch projection.
+
+    Parameters:
+    - latest_df (pd.DataFrame): The latest version of every real estate (e.g. load_latest_index), before create_additional_features.
+    - time_horizon (int): The number of years to project the cashflow.
+
+    Returns:
+    - dict with:
+        - kpis: dataframe with one row per property (index of latest_df), the descriptive columns adresse, ville, dpe,
+          prix_d_achat and apport, then PORTFOLIO_KPIS:
+            - irr, van, eqx, min_cash_flow: see compute_cashflow_kpis
+            - cash_on_cash: cash flow after debt of the first year divided by the apport
+            - ltv: loan-to-value ratio of create_additional_features
+        - yearly: dataframe indexed by year since acquisition, summing the cashflow lines of all properties
+          (rent, net_operating_income, remboursements, cash_flow_after_debt, net_cash_flow, cumulative_net_cash_flow)
+        - net_cash_flow: dataframe of the net cash flow of every property (rows) and year (columns), to aggregate a selection
+    """
+    if latest_df.empty:
+        return {'kpis': pd.DataFrame(columns=PORTFOLIO_KPIS), 'yearly': pd.DataFrame(), 'net_cash_flow': pd.DataFrame()}
+    real_estate_df = create_additional_features(latest_df)
+    lines = build_cashflow_arrays(real_estate_df, time_horizon)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        kpis = compute_cashflow_kpis(lines, real_estate_df).assign(
+            cash_on_cash=lines['cash_flow_after_debt'][:, 1] / real_estate_df['apport'].to_numpy(dtype=float),
+            ltv=real_estate_df['ltv'],
+        )
+    descriptive_columns = [column for column in ['adresse', 'ville', 'dpe', 'prix_d_achat', 'apport'] if column in real_estate_df]
+    years = pd.RangeIndex(time_horizon + 1, name='year')
+    yearly = pd.DataFrame(
+        {
+            name: lines[name].sum(axis=0)
+            for name in ['rent', 'net_operating_income', 'remboursements', 'cash_flow_after_debt', 'net_cash_flow', 'cumulative_net_cash_flow']
+        },
+        index=years
+    )
+    return {
+        'kpis': pd.concat([real_estate_df[descriptive_columns], kpis[['irr_converged', *PORTFOLIO_KPIS]]], axis=1),
+        'yearly': yearly,
+        'net_cash_flow': pd.DataFrame(lines['net_cash_flow'], index=real_estate_df.index, columns=years),
+    }
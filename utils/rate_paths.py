@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+
+from utils.financial import compute_cashflow_kpis
+from utils.schema import records_from_df
+from utils.transformations import build_cashflow_arrays, create_additional_features
+
+
+# Named market rate paths: change of the market borrowing rate since the acquisition, by year, given as (year, change)
+# points linearly interpolated and flat after the last one. A loan's market rate is its own taux_d_emprunt plus the change.
+RATE_PATHS = {
+    'stable': [(0, 0.)],
+    'hausse_progressive': [(0, 0.), (8, 0.02)],
+    'choc_+2pts': [(0, 0.), (1, 0.02)],
+    'pic_puis_retour': [(0, 0.), (3, 0.03), (8, 0.)],
+    'baisse': [(0, 0.), (4, -0.01)],
+}
+
+# How the rate of the loans follows the market rate path:
+# type: 'fixed' (taux_d_emprunt for the whole loan), 'variable' (the market rate, set at every reset) or 'capped'
+# (variable, within taux_d_emprunt +/- cap)
+# reset_years: number of years between two rate resets of variable and capped loans, the first period keeping taux_d_emprunt
+# renegotiation_year: year at the end of which the loan switches to a fixed rate at the market rate when it is lower
+# than its own (None for no renegotiation)
+DEFAULT_LOAN = {'type': 'capped', 'reset_years': 1, 'cap': 0.01, 'renegotiation_year': None}
+LOAN_TYPES = ['fixed', 'variable', 'capped']
+
+STRESS_KPIS = ['irr', 'van', 'eqx', 'min_cash_flow', 'total_remboursements']
+
+# Rows (properties x rate paths) projected per batch, bounding memory use
+BATCH_SIZE = 20_000
+
+
+def market_rate_changes(rate_paths, time_horizon: int = 30) -> np.ndarray:
+    """Return the changes of the market rate of every path (a name of RATE_PATHS or (year, change) points) as a (n_paths, time_horizon + 1) array"""
+    years = np.arange(time_horizon + 1)
+    changes = []
+    for path in rate_paths:
+        points = np.asarray(RATE_PATHS[path] if isinstance(path, str) else path, dtype=float).reshape(-1, 2)
+        changes.append(np.interp(years, points[:, 0], points[:, 1]))
+    return np.array(changes).reshape(len(changes), time_horizon + 1)
+
+
+def loan_rates(taux_d_emprunt, changes, loan: dict = None) -> np.ndarray:
+    """
+    Return the yearly loan rates of loans of initial rates taux_d_emprunt ((n, 1) array) for market rate changes
+    ((n_paths, time_horizon + 1), see market_rate_changes) under the loan terms (see DEFAULT_LOAN),
+    as a (n, n_paths, time_horizon + 1) array: every reset period and every renegotiation at once, without loop over the years.
+    """
+    loan = {**DEFAULT_LOAN, **(loan or {})}
+    if loan['type'] not in LOAN_TYPES:
+        raise ValueError(f"Unknown loan type {loan['type']!r}, expected one of {', '.join(LOAN_TYPES)}")
+    initial = np.asarray(taux_d_emprunt, dtype=float).reshape(-1, 1, 1)
+    market = np.maximum(initial + changes[None], 0)
+    if loan['type'] == 'fixed':
+        rates = np.broadcast_to(initial, market.shape)
+    else:
+        # Every reset period starts in year 1, 1 + reset_years, ... at the market rate of the end of the previous year
+        years = np.arange(changes.shape[-1])
+        rates = market[..., np.maximum((years - 1) // int(loan['reset_years']) * int(loan['reset_years']), 0)]
+        if loan['type'] == 'capped':
+            rates = np.clip(rates, initial - loan['cap'], initial + loan['cap'])
+    year = loan['renegotiation_year']
+    if year is not None and 0 < year < changes.shape[-1] - 1:
+        renegotiated = np.minimum(rates[..., year:year + 1], market[..., year:year + 1])
+        rates = np.concatenate([rates[..., :year + 1], np.broadcast_to(renegotiated, (*rates.shape[:-1], rates.shape[-1] - year - 1))], axis=-1)
+    return rates
+
+
+def stress_rate_paths(latest_df: pd.DataFrame, rate_paths=None, loan: dict = None, time_horizon: int = 30) -> dict:
+    """
+    This function projects every property under every market rate path, the loans following the loan terms.
+    Properties and paths are flattened into (property, path) rows projected in batches of BATCH_SIZE rows, the payments
+    and balances being recomputed every year from the loan rate (see amortization.variable_rate_schedule).
+
+    Parameters:
+    - latest_df (pd.DataFrame): The properties (e.g. load_latest_index), before create_additional_features.
+    - rate_paths (list): Names of RATE_PATHS or lists of (year, change) points, every RATE_PATHS by default.
+    - loan (dict): Overrides of DEFAULT_LOAN.
+    - time_horizon (int): The number of years to project the cashflow.
+
+    Returns:
+    - dict with:
+        - kpis: dataframe indexed by (index of latest_df, rate path) with STRESS_KPIS (see compute_cashflow_kpis,
+          total_remboursements being the loan payments over the detention period)
+        - portfolio: dataframe indexed by rate path with the total van and total_remboursements, the median irr and
+          the lowest min_cash_flow of the portfolio
+    """
+    rate_paths = list(RATE_PATHS) if rate_paths is None else list(rate_paths)
+    names = [path if isinstance(path, str) else f"path_{i}" for i, path in enumerate(rate_paths)]
+    changes = market_rate_changes(rate_paths, time_horizon)
+    records = create_additional_features(records_from_df(latest_df))
+    n_paths = len(names)
+    kpis = {name: [] for name in STRESS_KPIS}
+    step = max(1, BATCH_SIZE // n_paths)
+    for start in range(0, len(records), step):
+        batch = records[start:start + step]
+        rates = loan_rates(batch['taux_d_emprunt'], changes, loan).reshape(-1, time_horizon + 1)
+        rows = np.repeat(batch, n_paths)
+        lines = build_cashflow_arrays(rows, time_horizon, yearly_paths={'taux_d_emprunt': rates})
+        with np.errstate(divide='ignore', invalid='ignore'):
+            batch_kpis = compute_cashflow_kpis(lines, rows)
+        batch_kpis['total_remboursements'] = lines['remboursements'].sum(axis=1)
+        for name in STRESS_KPIS:
+            kpis[name].append(batch_kpis[name].to_numpy(dtype=float))
+    index = pd.MultiIndex.from_product([latest_df.index, names], names=[latest_df.index.name, 'rate_path'])
+    kpis = pd.DataFrame({name: np.concatenate(values) if values else [] for name, values in kpis.items()}, index=index)
+    portfolio = kpis.groupby(level='rate_path', sort=False).agg(
+        van=('van', 'sum'), irr=('irr', 'median'), min_cash_flow=('min_cash_flow', 'min'), total_remboursements=('total_remboursements', 'sum')
+    )
+    return {'kpis': kpis, 'portfolio': portfolio}
@@ -0,0 +1,123 @@
+import numpy as np
+import pandas as pd
+
+from utils.inputs import REAL_ESTATE_INPUTS
+
+
+# Storage dtype of each REAL_ESTATE_INPUTS type tag ('int' holds surfaces such as 55.77, so it is stored as a float;
+# 'year' is the nullable Int64, so that an empty duration stays missing instead of failing the cast)
+TYPE_TAG_DTYPES = {
+    'text': 'string',
+    'euros': 'float64',
+    'rate': 'float64',
+    'percentage': 'float64',
+    'year': 'Int64',
+    'int': 'float64',
+}
+
+REAL_ESTATE_DTYPES = {
+    field: TYPE_TAG_DTYPES[input_properties[0]]
+    for fields in REAL_ESTATE_INPUTS.values()
+    for field, input_properties in fields.items()
+}
+
+# Columns added when a real estate is saved
+METADATA_DTYPES = {
+    'real_estate_id': 'string',
+    'timestamp': 'datetime64[us]',
+}
+
+DATABASE_DTYPES = {**METADATA_DTYPES, **REAL_ESTATE_DTYPES}
+
+
+def coerce_real_estate_df(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Cast the known columns of a real estate dataframe to their storage dtype.
+    Unknown columns are kept as they are, and a ValueError names the column that cannot be converted.
+    """
+    columns = {}
+    for column, dtype in DATABASE_DTYPES.items():
+        if column not in df or df[column].dtype == dtype:
+            continue
+        try:
+            if dtype == 'string':
+                columns[column] = df[column].astype('string')
+            elif dtype.startswith('datetime64'):
+                columns[column] = pd.to_datetime(df[column]).astype(dtype)
+            else:
+                columns[column] = pd.to_numeric(df[column]).astype(dtype)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Column {column!r} cannot be stored as {dtype}: {e}") from e
+    return df.assign(**columns)
+
+
+def content_hashes(df: pd.DataFrame, exclude=()) -> np.ndarray:
+    """
+    Return a 64-bit hash of the inputs (REAL_ESTATE_DTYPES columns but the exclude ones) of every row, to tell apart
+    versions that the timestamp does not: the Inputs form saves the day only, so same-day saves share a timestamp.
+    """
+    columns = [column for column in REAL_ESTATE_DTYPES if column in df and column not in exclude]
+    return pd.util.hash_pandas_object(coerce_real_estate_df(df[columns]), index=False).to_numpy()
+
+
+# Property records: one NumPy structured row per property, an alternative to single-row dataframes.
+# Numeric inputs are float64 (the transformations compute in floats, so reading a field is free) and text inputs fixed-width
+# unicode, TEXT_FIELD_WIDTH characters wide at least (see property_dtype).
+TEXT_FIELD_WIDTH = 64
+PROPERTY_DTYPE = np.dtype([
+    (field, f'U{TEXT_FIELD_WIDTH}' if dtype == 'string' else 'float64')
+    for field, dtype in REAL_ESTATE_DTYPES.items()
+])
+
+
+def property_dtype(df: pd.DataFrame = None) -> np.dtype:
+    """Return PROPERTY_DTYPE with its text fields widened to the longest text of df, so that no text is truncated"""
+    width = TEXT_FIELD_WIDTH
+    if df is not None:
+        for field in PROPERTY_DTYPE.names:
+            if PROPERTY_DTYPE[field].kind == 'U' and field in df and len(df):
+                width = max(width, int(df[field].fillna('').astype(str).str.len().max()))
+    return np.dtype([(field, f'U{width}' if PROPERTY_DTYPE[field].kind == 'U' else PROPERTY_DTYPE[field]) for field in PROPERTY_DTYPE.names])
+
+
+def as_records(properties) -> np.ndarray:
+    """Return a 1-D structured array from a single record (np.void or 0-d array) or an array of records"""
+    records = np.atleast_1d(np.asarray(properties))
+    if records.dtype.names is None or records.ndim != 1:
+        raise TypeError(f"Expected property records of a structured dtype such as PROPERTY_DTYPE, got {records.dtype} with shape {records.shape}")
+    return records
+
+
+def default_record() -> np.void:
+    """Return a record holding the REAL_ESTATE_INPUTS defaults, rates divided by 100 as in the Inputs form"""
+    record = np.zeros((), PROPERTY_DTYPE)
+    for fields in REAL_ESTATE_INPUTS.values():
+        for field, (input_type, default) in fields.items():
+            record[field] = default / 100 if input_type in ['percentage', 'rate'] else default
+    return record[()]
+
+
+def records_from_df(df: pd.DataFrame, dtype: np.dtype = None) -> np.ndarray:
+    """
+    Convert the rows of a real estate dataframe to one contiguous array of records, of property_dtype(df) by default.
+    Missing numeric fields are NaN and missing text fields empty; other columns are left out.
+    A ValueError names the text field too narrow for a value of the given dtype, rather than truncating it.
+    """
+    dtype = property_dtype(df) if dtype is None else np.dtype(dtype)
+    records = np.zeros(len(df), dtype)
+    for field in dtype.names:
+        if dtype[field].kind == 'U':
+            texts = df[field].fillna('').astype(str) if field in df else pd.Series('', index=df.index)
+            width = dtype[field].itemsize // np.dtype('U1').itemsize
+            if len(texts) and texts.str.len().max() > width:
+                raise ValueError(f"Field {field!r} holds {width} characters, its longest text has {texts.str.len().max()}")
+            records[field] = texts.to_numpy()
+        else:
+            records[field] = pd.to_numeric(df[field]).to_numpy(dtype=float, na_value=np.nan) if field in df else np.nan
+    return records
+
+
+def records_to_df(records) -> pd.DataFrame:
+    """Convert records (a single one or an array) back to a dataframe, known columns cast to their storage dtype"""
+    records = as_records(records)
+    return coerce_real_estate_df(pd.DataFrame({field: records[field] for field in records.dtype.names}))
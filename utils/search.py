@@ -0,0 +1,316 @@
+import re
+import threading
+
+import numpy as np
+import pandas as pd
+
+from utils.batch_eval import evaluate_shard
+from utils.database import get_latest_index_version, load_latest_index
+from utils.schema import content_hashes, records_from_df
+from utils.tracing import count, traced
+
+
+# Indexed fields: a set of positions per value for the categorical ones, an array of positions sorted by value for the
+# numeric ones (inputs, and KPIs computed once per saved version)
+CATEGORICAL_FIELDS = ['ville', 'dpe']
+NUMERIC_FIELDS = ['prix_d_achat', 'surface_(m²)', 'loyer_mensuel', 'rent_yield', 'irr', 'van', 'cash_on_cash']
+RESULT_COLUMNS = ['real_estate_id', 'adresse', *CATEGORICAL_FIELDS, *NUMERIC_FIELDS]
+
+# Short names of the fields in search queries, and the fields whose query values are percentages
+QUERY_ALIASES = {'prix': 'prix_d_achat', 'surface': 'surface_(m²)', 'loyer': 'loyer_mensuel', 'rendement': 'rent_yield', 'yield': 'rent_yield', 'coc': 'cash_on_cash'}
+PERCENTAGE_FIELDS = ['rent_yield', 'irr', 'cash_on_cash']
+QUERY_HELP = (
+    "Words matching a ville filter on it, other words search the id and adresse. "
+    "Filters: ville:Dreux, dpe:D,E, prix<120k, surface>=40, loyer>600, rendement>7%, irr>5%, van>0. "
+    "Order: sort:irr (best first), sort:prix:asc, top:10."
+)
+
+# Updates touching more than this share of the properties re-sort the numeric indexes instead of moving every value
+RESORT_RATIO = 0.05
+
+_QUERY_TERM = re.compile(r"^(?P<field>[^<>=:]+)(?P<op><=|>=|<|>|=|:)(?P<value>.*)$")
+_MULTIPLIERS = {'k': 1e3, 'm': 1e6}
+
+
+def _normalize(values):
+    return pd.Series(values, dtype=object).fillna('').astype(str).str.strip().str.casefold().to_numpy(dtype=object)
+
+
+class PropertyIndex:
+    """
+    Secondary indexes over the latest version of every property, answering combined filters and top-k queries
+    without scanning the whole portfolio (see search). Every property keeps a position in the column arrays;
+    update only evaluates the KPIs of the new or changed versions and moves their values in the indexes.
+    """
+
+    def __init__(self, time_horizon: int = 30):
+        self.time_horizon = time_horizon
+        self.positions = {}  # real_estate_id -> position
+        self.columns = {name: np.array([], dtype=object) for name in ['real_estate_id', 'adresse', *CATEGORICAL_FIELDS]}
+        self.columns.update({name: np.array([], dtype=float) for name in NUMERIC_FIELDS})
+        self.hashes = np.array([], dtype=np.uint64)  # of the indexed inputs, see content_hashes
+        self._keys = {field: np.array([], dtype=object) for field in CATEGORICAL_FIELDS}  # normalized values
+        self._categories = {field: {} for field in CATEGORICAL_FIELDS}  # normalized value -> set of positions
+        self._sorted = {field: (np.array([], dtype=float), np.array([], dtype=np.int64)) for field in NUMERIC_FIELDS}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.positions)
+
+    def categories(self, field: str) -> set:
+        """Return the normalized values of a CATEGORICAL_FIELDS held by at least one property"""
+        with self._lock:
+            return {key for key, positions in self._categories[field].items() if positions}
+
+    def _evaluate(self, latest_df):
+        """Indexed values of properties, the KPIs coming from one batch projection"""
+        records = records_from_df(latest_df)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values, _ = evaluate_shard(records, self.time_horizon)
+            values['rent_yield'] = records['loyer_mensuel'] * 12 / values['prix_acquisition']
+        values.update({field: records[field] for field in ['prix_d_achat', 'surface_(m²)', 'loyer_mensuel']})
+        return values
+
+    @traced("search_index.update")
+    def update(self, latest_df: pd.DataFrame) -> int:
+        """
+        Index the properties of latest_df that are new or whose inputs changed and return their number.
+        Changes are detected on a hash of the inputs, as same-day saves keep the timestamp.
+        """
+        ids = latest_df['real_estate_id'].astype(str).to_numpy(dtype=object)
+        hashes = content_hashes(latest_df)
+        known = np.array([self.positions.get(real_estate_id, -1) for real_estate_id in ids], dtype=np.int64)
+        changed = known < 0
+        changed[~changed] = hashes[~changed] != self.hashes[known[~changed]]
+        rows = np.flatnonzero(changed)
+        count(rows=len(ids), updated=len(rows))
+        if not len(rows):
+            return 0
+        changed_df = latest_df.iloc[rows]
+        values = self._evaluate(changed_df)
+        with self._lock:
+            n_old = len(self.hashes)
+            new_ids = [real_estate_id for real_estate_id in ids[rows] if real_estate_id not in self.positions]
+            for real_estate_id in dict.fromkeys(new_ids):
+                self.positions[real_estate_id] = len(self.positions)
+            positions = np.array([self.positions[real_estate_id] for real_estate_id in ids[rows]], dtype=np.int64)
+            n = len(self.positions)
+            moved = positions[positions < n_old]
+            old_values = {field: self.columns[field][moved] for field in NUMERIC_FIELDS}
+            old_keys = {field: self._keys[field][moved] for field in CATEGORICAL_FIELDS}
+
+            def grown(array, fill):
+                return np.concatenate([array, np.full(n - len(array), fill, dtype=array.dtype)]) if n > len(array) else array
+
+            self.hashes = grown(self.hashes, 0)
+            self.hashes[positions] = hashes[rows]
+            for name in ['real_estate_id', 'adresse', *CATEGORICAL_FIELDS]:
+                self.columns[name] = grown(self.columns[name], None)
+                self.columns[name][positions] = changed_df[name].to_numpy(dtype=object) if name in changed_df else None
+            for field in CATEGORICAL_FIELDS:
+                self._keys[field] = grown(self._keys[field], None)
+                keys = _normalize(self.columns[field][positions])
+                for position, key in zip(moved, old_keys[field]):
+                    self._categories[field][key].discard(position)
+                for position, key in zip(positions, keys):
+                    self._categories[field].setdefault(key, set()).add(position)
+                self._keys[field][positions] = keys
+            for field in NUMERIC_FIELDS:
+                self.columns[field] = grown(self.columns[field], np.nan)
+                self.columns[field][positions] = values[field]
+                if len(rows) > RESORT_RATIO * n:
+                    order = np.argsort(self.columns[field], kind='stable')
+                    self._sorted[field] = self.columns[field][order], order
+                else:
+                    self._move(field, moved, old_values[field], positions)
+        return len(rows)
+
+    def _move(self, field, moved, old_values, positions):
+        """Remove the old values of moved positions from a sorted index, then insert the new values of positions"""
+        sorted_values, order = self._sorted[field]
+        if len(moved):
+            drop = []
+            for position, value in zip(moved, old_values):
+                left, right = np.searchsorted(sorted_values, value, 'left'), np.searchsorted(sorted_values, value, 'right')
+                drop.append(left + np.flatnonzero(order[left:right] == position)[0])
+            sorted_values, order = np.delete(sorted_values, drop), np.delete(order, drop)
+        positions = positions[np.argsort(self.columns[field][positions], kind='stable')]
+        new_values = self.columns[field][positions]
+        at = np.searchsorted(sorted_values, new_values)
+        self._sorted[field] = np.insert(sorted_values, at, new_values), np.insert(order, at, positions)
+
+    def _condition(self, field, value):
+        """(estimated number of matches, candidate positions or None if not indexed, mask of positions) of a filter"""
+        if field in CATEGORICAL_FIELDS:
+            keys = list(_normalize([value] if isinstance(value, str) else list(value)))
+            matches = [self._categories[field].get(key, ()) for key in keys]
+            return (
+                sum(len(positions) for positions in matches),
+                lambda: np.fromiter((p for positions in matches for p in positions), dtype=np.int64),
+                lambda positions: np.isin(self._keys[field][positions], keys),
+            )
+        if field in NUMERIC_FIELDS:
+            low, high = value
+            low = -np.inf if low is None else low
+            high = np.inf if high is None else high
+            sorted_values, order = self._sorted[field]
+            left, right = np.searchsorted(sorted_values, low, 'left'), np.searchsorted(sorted_values, high, 'right')
+            return (
+                right - left,
+                lambda: order[left:right],
+                lambda positions: (self.columns[field][positions] >= low) & (self.columns[field][positions] <= high),
+            )
+        if field == 'text':
+            words = list(_normalize(value.split() if isinstance(value, str) else list(value)))
+
+            def mask(positions):
+                text = _normalize(self.columns['real_estate_id'][positions]) + " " + _normalize(self.columns['adresse'][positions])
+                return np.all([[word in line for line in text] for word in words], axis=0).reshape(len(positions))
+
+            return len(self), None, mask
+        raise ValueError(f"Unknown search field {field!r}, expected one of {', '.join([*CATEGORICAL_FIELDS, *NUMERIC_FIELDS, 'text'])}")
+
+    @traced("search_index.search")
+    def search(self, filters: dict = None, sort_by: str = None, ascending: bool = False, k: int = None) -> pd.DataFrame:
+        """
+        Return the properties matching every filter, as a dataframe of RESULT_COLUMNS.
+
+        Parameters:
+        - filters (dict): {field: condition}, the condition being a value or a list of values for CATEGORICAL_FIELDS
+          (case insensitive), a (low, high) inclusive range for NUMERIC_FIELDS (None for an open bound), and words that
+          must all appear in the real_estate_id or adresse for 'text'.
+        - sort_by (str): A NUMERIC_FIELDS to order the results by, largest first unless ascending (NaN last).
+        - k (int): Only return the first k results.
+
+        The filter matching the fewest properties (counted in the indexes) gives the candidates, on which the other
+        filters are checked. When it is not selective and a top-k is requested, the properties are instead walked in
+        the order of the sort_by index until k of them match.
+        """
+        with self._lock:
+            n = len(self)
+            conditions = [self._condition(field, value) for field, value in (filters or {}).items()]
+            conditions.sort(key=lambda condition: condition[0] if condition[1] is not None else n + 1)
+            best = conditions[0][0] if conditions and conditions[0][1] is not None else n
+            if sort_by is not None and sort_by not in NUMERIC_FIELDS:
+                raise ValueError(f"Cannot sort by {sort_by!r}, expected one of {', '.join(NUMERIC_FIELDS)}")
+            if sort_by is not None and k is not None and best * best > k * n:
+                positions = self._walk(sort_by, ascending, k, [mask for _, _, mask in conditions])
+            else:
+                if conditions and conditions[0][1] is not None:
+                    positions, masks = conditions[0][1](), [mask for _, _, mask in conditions[1:]]
+                else:
+                    positions, masks = np.arange(n), [mask for _, _, mask in conditions]
+                for mask in masks:
+                    positions = positions[mask(positions)] if len(positions) else positions
+                positions = self._ordered(np.sort(positions), sort_by, ascending, k)
+            count(rows=len(positions))
+            return pd.DataFrame({name: self.columns[name][positions] for name in RESULT_COLUMNS})
+
+    def _ordered(self, positions, sort_by, ascending, k):
+        if sort_by is None:
+            return positions[:k]
+        values = self.columns[sort_by][positions]
+        keys = values if ascending else -values
+        if k is not None and k < len(positions):
+            keep = np.argpartition(keys, k - 1)[:k]
+            return positions[keep[np.argsort(keys[keep], kind='stable')]]
+        return positions[np.argsort(keys, kind='stable')][:k]
+
+    def _walk(self, sort_by, ascending, k, masks):
+        """First k positions matching every mask in the order of the sort_by index, checked by growing blocks"""
+        sorted_values, order = self._sorted[sort_by]
+        valid = np.searchsorted(sorted_values, np.inf, 'right')  # NaN values are last
+        order = np.concatenate([order[:valid] if ascending else order[:valid][::-1], order[valid:]])
+        found, start, block = [], 0, max(4 * k, 256)
+        while start < len(order) and sum(len(positions) for positions in found) < k:
+            positions = order[start:start + block]
+            for mask in masks:
+                positions = positions[mask(positions)] if len(positions) else positions
+            found.append(positions)
+            start, block = start + block, 2 * block
+        return np.concatenate(found)[:k] if found else np.array([], dtype=np.int64)
+
+
+def _parse_number(text, percentage):
+    text = text.strip().lower().replace("€", "").replace(",", ".")
+    scale = 1.
+    if text.endswith("%"):
+        text, scale = text[:-1], 0.01
+    elif text[-1:] in _MULTIPLIERS:
+        text, scale = text[:-1], _MULTIPLIERS[text[-1]]
+    elif percentage:
+        scale = 0.01
+    try:
+        return float(text) * scale
+    except ValueError:
+        raise ValueError(f"{text!r} is not a number") from None
+
+
+def parse_query(query: str, villes=()) -> dict:
+    """
+    Parse a search box query (see QUERY_HELP) into the keyword arguments of PropertyIndex.search.
+    Bare words equal to one of villes (normalized) filter on the ville, the other ones are 'text' words.
+    """
+    filters, text, arguments = {}, [], {}
+    villes = set(villes)
+    for term in query.split():
+        match = _QUERY_TERM.match(term)
+        if match is None:
+            if _normalize([term])[0] in villes:
+                filters.setdefault('ville', []).append(term)
+            else:
+                text.append(term)
+            continue
+        field, op, value = match['field'].lower(), match['op'], match['value']
+        if field == 'sort' and op in ':=':
+            name, _, direction = value.partition(':')
+            arguments['sort_by'] = QUERY_ALIASES.get(name.lower(), name.lower())
+            arguments['ascending'] = direction.lower() == 'asc'
+        elif field == 'top' and op in ':=':
+            arguments['k'] = int(value)
+        elif field in CATEGORICAL_FIELDS and op in ':=':
+            filters.setdefault(field, []).extend(value.split(','))
+        else:
+            field = QUERY_ALIASES.get(field, field)
+            if field not in NUMERIC_FIELDS:
+                raise ValueError(f"Unknown search field {match['field']!r} in {term!r}")
+            number = _parse_number(value, field in PERCENTAGE_FIELDS)
+            low, high = filters.get(field, (None, None))
+            if op in ['>', '>=', '=', ':']:
+                low = np.nextafter(number, np.inf) if op == '>' else number
+            if op in ['<', '<=', '=', ':']:
+                high = np.nextafter(number, -np.inf) if op == '<' else number
+            filters[field] = (low, high)
+    if text:
+        filters['text'] = text
+    return {'filters': filters, **arguments}
+
+
+# Index of the latest versions shared by every session of the process, brought up to date with the latest index on use
+_search_index = None
+_search_index_version = None
+_search_index_lock = threading.Lock()
+
+
+def get_search_index(latest_df: pd.DataFrame = None, version: int = None) -> PropertyIndex:
+    """
+    Return the process-wide PropertyIndex of the saved properties. After a save (a new latest index generation),
+    only the new or changed versions are evaluated and moved in the indexes.
+    latest_df / version: the latest index already loaded by the caller (see load_latest_index) and the generation read
+    before loading it, so that it is not loaded again
+    """
+    global _search_index, _search_index_version
+    version = get_latest_index_version() if version is None else version
+    with _search_index_lock:
+        if _search_index is None:
+            _search_index = PropertyIndex()
+        if version != _search_index_version:
+            _search_index.update(load_latest_index() if latest_df is None else latest_df)
+            _search_index_version = version
+        return _search_index
+
+
+def search_properties(query: str, latest_df: pd.DataFrame = None, version: int = None) -> pd.DataFrame:
+    """Run a search box query (see parse_query) on the saved properties (see get_search_index for latest_df and version)"""
+    index = get_search_index(latest_df, version)
+    return index.search(**parse_query(query, index.categories('ville')))
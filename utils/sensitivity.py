@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+
+from utils.financial import irr
+from utils.schema import records_from_df
+from utils.transformations import build_cashflow_arrays, create_additional_features
+
+
+# Grid of the Comparaison sliders, the property's own values are added to the rate axes
+DETENTION_PERIODS = np.arange(1, 31)
+CREDIT_DURATIONS = np.arange(1, 31)
+CREDIT_RATES = np.round(np.arange(0, 501, 10) / 10000, 4)  # 0% to 5% by 0.1%
+DISCOUNT_RATES = np.round(np.arange(0, 1001, 25) / 10000, 4)  # 0% to 10% by 0.25%
+
+# Rows of the (detention period, credit duration, credit rate) grid evaluated per batch, bounding memory use
+BATCH_SIZE = 5000
+
+
+def _with_value(axis, value):
+    return np.unique(np.append(axis, round(float(value), 6)))
+
+
+def compute_sensitivity_surface(real_estate_df: pd.DataFrame, time_horizon: int = 30) -> dict:
+    """
+    This function computes the KPIs of a property for every combination of the Comparaison sliders.
+    Every (detention period, credit duration, credit rate) scenario is projected with build_cashflow_arrays in a few
+    large batches, and the VAN of every discount rate is obtained at once from the net cash flows.
+
+    Parameters:
+    - real_estate_df (pd.DataFrame): The single-row dataframe of the property inputs (before create_additional_features).
+    - time_horizon (int): The number of years to project the cashflow.
+
+    Returns:
+    - dict with:
+        - axes: dict of the grid values for 'durée_de_détention_(année)', 'durée_de_crédit_(année)', 'taux_d_emprunt' and 'taux_d_actualisation'
+        - irr: array of shape (n_detention, n_duration, n_rate)
+        - eqx: cumulative net cash flow at the end of the detention period divided by the apport, same shape
+        - min_cash_flow: minimum yearly net cash flow after year 0, same shape
+        - van: array of shape (n_detention, n_duration, n_rate, n_discount)
+    """
+    axes = {
+        'durée_de_détention_(année)': DETENTION_PERIODS[DETENTION_PERIODS <= time_horizon],
+        'durée_de_crédit_(année)': CREDIT_DURATIONS,
+        'taux_d_emprunt': _with_value(CREDIT_RATES, real_estate_df['taux_d_emprunt'].iloc[0]),
+        'taux_d_actualisation': _with_value(DISCOUNT_RATES, real_estate_df['taux_d_actualisation'].iloc[0]),
+    }
+    grid = np.meshgrid(axes['durée_de_détention_(année)'], axes['durée_de_crédit_(année)'], axes['taux_d_emprunt'], indexing='ij')
+    shape = grid[0].shape
+    scenarios = {name: values.ravel() for name, values in zip(['durée_de_détention_(année)', 'durée_de_crédit_(année)', 'taux_d_emprunt'], grid)}
+
+    years = np.arange(time_horizon + 1)
+    discount_factors = (1 + axes['taux_d_actualisation'][None, :]) ** -years[:, None]
+    apport = float(real_estate_df['apport'].iloc[0])
+    record = records_from_df(real_estate_df.iloc[:1])
+    kpis = {'irr': [], 'eqx': [], 'min_cash_flow': [], 'van': []}
+    for start in range(0, len(scenarios['taux_d_emprunt']), BATCH_SIZE):
+        batch = np.repeat(record, min(BATCH_SIZE, len(scenarios['taux_d_emprunt']) - start))
+        for name, values in scenarios.items():
+            batch[name] = values[start:start + BATCH_SIZE]
+        lines = build_cashflow_arrays(create_additional_features(batch), time_horizon)
+        net_cash_flow = lines['net_cash_flow']
+        held = years[None, :] <= batch['durée_de_détention_(année)'][:, None]
+        kpis['irr'].append(irr(net_cash_flow))
+        kpis['eqx'].append(lines['cumulative_net_cash_flow'][:, -1] / apport)
+        kpis['min_cash_flow'].append(np.where(held, net_cash_flow, np.inf)[:, 1:].min(axis=1))
+        kpis['van'].append(net_cash_flow @ discount_factors)
+
+    surface = {name: np.concatenate(values).reshape(shape + np.shape(values[0])[1:]) for name, values in kpis.items()}
+    surface['axes'] = axes
+    return surface
+
+
+def lookup_sensitivity_surface(surface: dict, **parameters) -> dict:
+    """
+    Read the KPIs of one point of a sensitivity surface, each parameter being snapped to the nearest grid value.
+
+    Parameters:
+    - surface (dict): The output of compute_sensitivity_surface.
+    - parameters: A value for each axis of the surface, e.g. taux_d_emprunt=0.0272.
+
+    Returns:
+    - dict: irr, van, eqx and min_cash_flow at that point.
+    """
+    position = {name: int(np.abs(axis - parameters[name]).argmin()) for name, axis in surface['axes'].items()}
+    point = tuple(position[name] for name in ['durée_de_détention_(année)', 'durée_de_crédit_(année)', 'taux_d_emprunt'])
+    return {
+        'irr': surface['irr'][point],
+        'van': surface['van'][point + (position['taux_d_actualisation'],)],
+        'eqx': surface['eqx'][point],
+        'min_cash_flow': surface['min_cash_flow'][point],
+    }
@@ -0,0 +1,40 @@
+import io
+
+import pandas as pd
+
+
+# Parquet files are written in row groups of this size so that filtered reads can skip whole groups
+PARQUET_ROW_GROUP_SIZE = 10_000
+
+
+def filter_dataframe(df, filters):
+    """Apply pyarrow-style filters [(column, op, value), ...] to an already parsed DataFrame"""
+    operators = {
+        "=": lambda c, v: c == v, "==": lambda c, v: c == v, "!=": lambda c, v: c != v,
+        "<": lambda c, v: c < v, "<=": lambda c, v: c <= v, ">": lambda c, v: c > v, ">=": lambda c, v: c >= v,
+        "in": lambda c, v: c.isin(v), "not in": lambda c, v: ~c.isin(v),
+    }
+    mask = pd.Series(True, index=df.index)
+    for column, op, value in filters:
+        mask &= operators[op](df[column], value)
+    return df[mask].reset_index(drop=True)
+
+
+def parse_dataframe(content, filename, columns=None, filters=None):
+    """Parse CSV or Parquet content (chosen by the extension of filename), reading only the requested columns and rows"""
+    if filename.endswith(".parquet"):
+        return pd.read_parquet(io.BytesIO(content), columns=columns, filters=filters)
+    df = pd.read_csv(io.BytesIO(content))
+    if filters:
+        df = filter_dataframe(df, filters)
+    return df if columns is None else df[columns]
+
+
+def serialize_dataframe(df, filename):
+    """Return the CSV or Parquet content (chosen by the extension of filename) of a DataFrame and its content type"""
+    buffer = io.BytesIO()
+    if filename.endswith(".parquet"):
+        df.to_parquet(buffer, index=False, row_group_size=PARQUET_ROW_GROUP_SIZE, compression='zstd')
+        return buffer.getvalue(), 'application/vnd.apache.parquet'
+    df.to_csv(buffer, index=False)
+    return buffer.getvalue(), 'text/csv'
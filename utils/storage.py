@@ -0,0 +1,314 @@
+import abc
+import inspect
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Backend used by gcp_connector: "gcs" (default, the bucket of the Streamlit secrets) or "local" (a directory)
+STORAGE_BACKEND_ENV = "BP_INVEST_STORAGE"
+# Root directory of the local backend
+LOCAL_STORAGE_DIR_ENV = "BP_INVEST_STORAGE_DIR"
+DEFAULT_LOCAL_STORAGE_DIR = "data"
+# Bucket of the gcs backend outside Streamlit (e.g. utils.batch_eval), with the application default credentials
+GCS_BUCKET_ENV = "BP_INVEST_GCS_BUCKET"
+
+# Bulk transfers: concurrent requests, and retries of transient errors with exponential backoff (plus jitter)
+MAX_WORKERS = 8
+MAX_ATTEMPTS = 4
+BACKOFF_SECONDS = 0.2
+
+
+class GenerationMismatchError(RuntimeError):
+    """Raised when a write or delete precondition on the blob generation does not hold"""
+
+
+class StorageBackend(abc.ABC):
+    """
+    Object storage holding immutable generations of named files.
+    A generation is a positive integer changing on every write of a file; 0 stands for a missing file.
+    Implementations define get, get_generation, put, list and delete; fetch_many and put_many run them concurrently.
+    """
+    # Errors worth retrying (network, throttling, server side); FileNotFoundError and GenerationMismatchError never are
+    transient_errors = (ConnectionError, TimeoutError)
+
+    def describe(self, name):
+        """Human readable location of a file, for error messages"""
+        return name
+
+    @abc.abstractmethod
+    def get(self, name):
+        """Return (content, generation) of the current generation of a file, FileNotFoundError if it does not exist"""
+
+    @abc.abstractmethod
+    def get_generation(self, name):
+        """Return the current generation of a file, 0 if it does not exist (metadata only)"""
+
+    @abc.abstractmethod
+    def put(self, name, content, content_type=None, if_generation_match=None):
+        """
+        Write a file and return its new generation.
+        if_generation_match: only write if the current generation matches (0 means the file must not exist yet),
+        GenerationMismatchError otherwise
+        """
+
+    @abc.abstractmethod
+    def list(self, prefix):
+        """Return {name: generation} for every file starting with prefix, in lexicographic order"""
+
+    @abc.abstractmethod
+    def delete(self, name, if_generation_match=None):
+        """Delete a file, ignoring files that are already gone"""
+
+    def with_retry(self, function, *args, **kwargs):
+        """
+        Call function, retrying transient errors with exponential backoff.
+        A put retried after a transient error may fail its generation precondition because the failed attempt was
+        written nonetheless (e.g. a timeout after the upload): the write is then confirmed by the current content.
+        """
+        for attempt in range(MAX_ATTEMPTS):
+            try:
+                return function(*args, **kwargs)
+            except self.transient_errors:
+                if attempt == MAX_ATTEMPTS - 1:
+                    raise
+                time.sleep(BACKOFF_SECONDS * 2 ** attempt * (1 + random.random()))
+            except GenerationMismatchError:
+                generation = self._written_generation(*args, **kwargs) if attempt and function == self.put else 0
+                if not generation:
+                    raise
+                return generation
+
+    def _written_generation(self, *args, **kwargs):
+        """Return the generation of a file if it holds the content of a put (same arguments as put), 0 otherwise"""
+        arguments = inspect.signature(self.put).bind(*args, **kwargs).arguments
+        try:
+            content, generation = self.with_retry(self.get, arguments['name'])
+        except FileNotFoundError:
+            return 0
+        return generation if content == arguments['content'] else 0
+
+    def _map(self, function, items, max_workers):
+        items = list(items)
+        if len(items) <= 1 or max_workers <= 1:
+            return [self.with_retry(function, *item) for item in items]
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+            return list(executor.map(lambda item: self.with_retry(function, *item), items))
+
+    def fetch_many(self, names, max_workers=MAX_WORKERS):
+        """Return {name: (content, generation)}, downloading the files concurrently. The first failure is raised."""
+        names = list(names)
+        return dict(zip(names, self._map(self.get, [(name,) for name in names], max_workers)))
+
+    def put_many(self, files, max_workers=MAX_WORKERS):
+        """
+        Write {name: (content, content_type, if_generation_match)} concurrently and return {name: generation}.
+        Writes are independent: when one fails, the others may already be written.
+        """
+        return dict(zip(files, self._map(self.put, [(name, *file) for name, file in files.items()], max_workers)))
+
+
+class GCSBackend(StorageBackend):
+    """
+    Google Cloud Storage bucket. The credentials, client and bucket handle are created on first use from the
+    "connections.gcs" Streamlit secrets (or from BP_INVEST_GCS_BUCKET and the application default credentials when set),
+    or given directly as bucket. google-cloud is only imported then.
+    """
+
+    def __init__(self, bucket=None):
+        self._bucket = bucket
+        self._lock = threading.Lock()
+
+    @property
+    def transient_errors(self):
+        from google.api_core import exceptions
+        return (
+            ConnectionError, TimeoutError, exceptions.TooManyRequests, exceptions.InternalServerError,
+            exceptions.BadGateway, exceptions.ServiceUnavailable, exceptions.GatewayTimeout,
+        )
+
+    @property
+    def bucket(self):
+        """The bucket handle, created once and shared by every thread (the client pools its connections)"""
+        if self._bucket is None:
+            with self._lock:
+                if self._bucket is None:
+                    self._bucket = self._create_bucket()
+        return self._bucket
+
+    @staticmethod
+    def _create_bucket():
+        from google.cloud import storage
+
+        if os.environ.get(GCS_BUCKET_ENV):
+            return storage.Client().bucket(os.environ[GCS_BUCKET_ENV])
+
+        import streamlit as st
+        from google.oauth2 import service_account
+
+        secrets = st.secrets["connections"]["gcs"]
+        service_account_info = {
+            "type": secrets["type"],
+            "project_id": secrets["project_id"],
+            "private_key_id": secrets["private_key_id"],
+            "private_key": secrets["private_key"].replace('\\n', '\n'),
+            "client_email": secrets["client_email"],
+            "client_id": secrets["client_id"],
+            "auth_uri": secrets["auth_uri"],
+            "token_uri": secrets["token_uri"],
+            "auth_provider_x509_cert_url": secrets["auth_provider_x509_cert_url"],
+            "client_x509_cert_url": secrets["client_x509_cert_url"],
+            "universe_domain": secrets["universe_domain"]
+        }
+
+        # Create credentials and client
+        credentials = service_account.Credentials.from_service_account_info(service_account_info)
+        client = storage.Client(credentials=credentials)
+        return client.bucket(secrets["gcp_bucket_name"])
+
+    def describe(self, name):
+        return f"gs://{self.bucket.name}/{name}"
+
+    def get(self, name):
+        from google.api_core.exceptions import NotFound
+
+        blob = self.bucket.blob(name)
+        try:
+            content = blob.download_as_bytes()
+        except NotFound as e:
+            raise FileNotFoundError(self.describe(name)) from e
+        return content, blob.generation
+
+    def get_generation(self, name):
+        blob = self.bucket.get_blob(name)
+        return 0 if blob is None else blob.generation
+
+    def put(self, name, content, content_type=None, if_generation_match=None):
+        from google.api_core.exceptions import PreconditionFailed
+
+        blob = self.bucket.blob(name)
+        try:
+            blob.upload_from_string(content, content_type=content_type, if_generation_match=if_generation_match)
+        except PreconditionFailed as e:
+            raise GenerationMismatchError(name) from e
+        return blob.generation
+
+    def list(self, prefix):
+        return {blob.name: blob.generation for blob in self.bucket.list_blobs(prefix=prefix)}
+
+    def delete(self, name, if_generation_match=None):
+        from google.api_core.exceptions import NotFound, PreconditionFailed
+
+        try:
+            self.bucket.blob(name).delete(if_generation_match=if_generation_match)
+        except NotFound:
+            pass
+        except PreconditionFailed as e:
+            raise GenerationMismatchError(name) from e
+
+
+class LocalBackend(StorageBackend):
+    """
+    Directory of files, for offline development, tests and benchmarks. Names map to relative paths ("/" makes sub-directories)
+    and the generation of a file is its modification time in nanoseconds.
+    Writes go through a temporary file and an atomic rename. Preconditions are atomic between the threads of a process
+    ("must not exist" ones also between processes), which is enough for a single-user local setup.
+    """
+
+    def __init__(self, root=None):
+        self.root = os.path.abspath(root or os.environ.get(LOCAL_STORAGE_DIR_ENV, DEFAULT_LOCAL_STORAGE_DIR))
+        self._lock = threading.Lock()
+
+    def _path(self, name):
+        return os.path.join(self.root, *name.split("/"))
+
+    def describe(self, name):
+        return self._path(name)
+
+    def get(self, name):
+        try:
+            with open(self._path(name), "rb") as f:
+                return f.read(), os.fstat(f.fileno()).st_mtime_ns
+        except FileNotFoundError as e:
+            raise FileNotFoundError(self.describe(name)) from e
+
+    def get_generation(self, name):
+        try:
+            return os.stat(self._path(name)).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    def put(self, name, content, content_type=None, if_generation_match=None):
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._lock:
+            previous = self.get_generation(name)
+            if if_generation_match is not None and previous != if_generation_match:
+                raise GenerationMismatchError(name)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(content)
+            if if_generation_match == 0:
+                try:
+                    os.link(tmp_path, path)  # fails if another process created the file meanwhile
+                except FileExistsError as e:
+                    raise GenerationMismatchError(name) from e
+                finally:
+                    os.remove(tmp_path)
+            else:
+                # Generations must change on every write, even within the clock resolution
+                stat = os.stat(tmp_path)
+                if stat.st_mtime_ns <= previous:
+                    os.utime(tmp_path, ns=(stat.st_atime_ns, previous + 1))
+                os.replace(tmp_path, path)
+            return self.get_generation(name)
+
+    def list(self, prefix):
+        directory = self._path(prefix.rsplit("/", 1)[0]) if "/" in prefix else self.root
+        names = {}
+        for dirpath, _, filenames in os.walk(directory):
+            for filename in filenames:
+                if filename.endswith(".tmp"):
+                    continue
+                name = os.path.relpath(os.path.join(dirpath, filename), self.root).replace(os.sep, "/")
+                if name.startswith(prefix):
+                    names[name] = self.get_generation(name)
+        return {name: generation for name, generation in sorted(names.items()) if generation}
+
+    def delete(self, name, if_generation_match=None):
+        with self._lock:
+            if if_generation_match is not None and self.get_generation(name) != if_generation_match:
+                raise GenerationMismatchError(name)
+            try:
+                os.remove(self._path(name))
+            except FileNotFoundError:
+                pass
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> StorageBackend:
+    """Return the configured storage backend, created on first use from the BP_INVEST_STORAGE environment variable"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                kind = os.environ.get(STORAGE_BACKEND_ENV, "gcs")
+                if kind == "gcs":
+                    _backend = GCSBackend()
+                elif kind == "local":
+                    _backend = LocalBackend()
+                else:
+                    raise ValueError(f"Unknown storage backend {kind!r} in {STORAGE_BACKEND_ENV}, expected 'gcs' or 'local'")
+    return _backend
+
+
+def set_backend(backend: StorageBackend):
+    """Use another storage backend for the rest of the process (e.g. LocalBackend(tmp_dir) in benchmarks)"""
+    global _backend
+    with _backend_lock:
+        _backend = backend
@@ -0,0 +1,130 @@
+import contextvars
+import functools
+import json
+import time
+from contextlib import contextmanager
+
+
+# Spans of the trace being recorded in the current context (each Streamlit rerun runs in its own thread), None when tracing is off
+_current_trace = contextvars.ContextVar("bp_invest_trace", default=None)
+_current_span = contextvars.ContextVar("bp_invest_span", default=None)
+
+
+class Span:
+    """A timed stage of a trace, with counters such as bytes downloaded, cache hits or rows processed"""
+    __slots__ = ("name", "depth", "start", "seconds", "counters")
+
+    def __init__(self, name, depth, start):
+        self.name = name
+        self.depth = depth
+        self.start = start
+        self.seconds = None
+        self.counters = {}
+
+    def add(self, **counters):
+        """Increment counters of the span"""
+        for name, value in counters.items():
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def to_dict(self):
+        return {"name": self.name, "depth": self.depth, "start": self.start, "seconds": self.seconds, **self.counters}
+
+
+class _NullSpan:
+    """Span returned when tracing is off: every call is a no-op"""
+    __slots__ = ()
+
+    def add(self, **counters):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _SpanContext:
+    __slots__ = ("spans", "origin", "span", "token")
+
+    def __init__(self, spans, origin, name, counters):
+        parent = _current_span.get()
+        self.spans = spans
+        self.origin = origin
+        self.span = Span(name, 0 if parent is None else parent.depth + 1, None)
+        self.span.add(**counters)
+
+    def __enter__(self):
+        self.spans.append(self.span)
+        self.token = _current_span.set(self.span)
+        self.span.start = time.perf_counter() - self.origin
+        return self.span
+
+    def __exit__(self, *exc_info):
+        self.span.seconds = time.perf_counter() - self.origin - self.span.start
+        _current_span.reset(self.token)
+        return False
+
+
+def span(name, **counters):
+    """
+    Time a stage of the current trace: `with span("gcs.download", files=1) as s: ...; s.add(bytes=len(content))`.
+    Spans opened inside another one are nested under it. Without an active trace, a shared no-op span is returned.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return _NULL_SPAN
+    return _SpanContext(trace[0], trace[1], name, counters)
+
+
+def count(**counters):
+    """Increment counters of the innermost open span, if any"""
+    current = _current_span.get()
+    if current is not None:
+        current.add(**counters)
+
+
+def traced(name):
+    """Decorator recording every call of a function as a span"""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            trace = _current_trace.get()
+            if trace is None:
+                return function(*args, **kwargs)
+            with _SpanContext(trace[0], trace[1], name, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def is_tracing():
+    """Whether a trace is being recorded in the current context"""
+    return _current_trace.get() is not None
+
+
+@contextmanager
+def trace():
+    """Record the spans of a block (e.g. a page rerun) into the yielded list"""
+    spans = []
+    token = _current_trace.set((spans, time.perf_counter()))
+    span_token = _current_span.set(None)
+    try:
+        yield spans
+    finally:
+        _current_span.reset(span_token)
+        _current_trace.reset(token)
+
+
+def spans_to_jsonl(spans, **fields):
+    """Serialize spans as JSON lines, each line holding the span and the extra fields (e.g. page, rerun timestamp)"""
+    return "".join(json.dumps({**fields, **span.to_dict()}, ensure_ascii=False, default=str) + "\n" for span in spans)
+
+
+def export_jsonl(spans, path, **fields):
+    """Append spans as JSON lines to a file"""
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(spans_to_jsonl(spans, **fields))
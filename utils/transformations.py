@@ -1,20 +1,25 @@
-from utils.computations import PMT, compute_remaining_capital_after_y_years
-from utils.gcp_connector import download_dataframe
+from utils.amortization import payment, remaining_balance, variable_rate_schedule
+from utils.feature_graph import Graph, GraphState
+from utils.financial import eqx, npv, solve_irr
+from utils.schema import as_records
+from utils.tracing import count, traced
 import pandas as pd
-import streamlit as st
 import numpy as np
 
 
+@traced("create_additional_features")
 def create_additional_features(database_inputs: pd.DataFrame):
     """
     This function creates additional features for a real estate dataframe.
     It is used to enrich the input dataframe with calculated columns based on various financial, market, and operational hypotheses.
     
     Parameters:
-    - database_inputs (pd.DataFrame): The input dataframe containing initial real estate data.
+    - database_inputs (pd.DataFrame): The input dataframe containing initial real estate data, or property records
+      (a single one or an array, see schema.PROPERTY_DTYPE).
     
     Returns:
-    - pd.DataFrame: A dataframe with additional calculated features.
+    - pd.DataFrame: A dataframe with additional calculated features. Records give records of the same shape with
+      the features as extra float64 fields.
     
     The following sections and features are added:
     
@@ -25,10 +30,10 @@ def create_additional_features(database_inputs: pd.DataFrame):
     input_financial_hypothesis:
     - ltv: Loan-to-value ratio calculated as the loan amount divided by the acquisition price.
     - montant_emprunté: Loan amount based on the loan-to-value ratio and acquisition price.
-    - mensualité: Monthly payment calculated using the PMT function.
+    - mensualité: Monthly payment calculated using the amortization.payment function.
     
     input_market_hypothesis:
-    - capital_restant_dû: Remaining capital after a certain number of years, calculated using the compute_remaining_capital_after_y_years function.
+    - capital_restant_dû: Remaining capital after the holding period, calculated using the amortization.remaining_balance function (0 once the loan is repaid).
     - valeur_de_sortie: Exit value of the property based on market value growth over the holding period.
     - frais_de_vente: Selling fees calculated as a percentage of the exit value.
     - valeur_nette_de_sortie: Net exit value after deducting selling fees and remaining capital.
@@ -43,43 +48,293 @@ def create_additional_features(database_inputs: pd.DataFrame):
     input_operating_capex:
     - total_charges_récurrantes: Total recurring charges including repayments, property management, accounting, co-ownership fees, property tax, maintenance fees, and insurance fees.
     """
+    # The features are nodes of TRANSFORMATIONS, recomputed from the inputs even if the dataframe already holds them
+    state = GraphState(TRANSFORMATIONS, graph_inputs(database_inputs, exclude=FEATURES))
+    count(rows=state['shape'][0])
+    if not isinstance(database_inputs, pd.DataFrame):
+        records = as_records(database_inputs)
+        dtype = [(name, records.dtype[name]) for name in records.dtype.names if name not in FEATURES]
+        enriched = np.empty(records.shape, dtype + [(feature, 'float64') for feature in FEATURES])
+        for name, _ in dtype:
+            enriched[name] = records[name]
+        for feature in FEATURES:
+            enriched[feature] = state[feature][:, 0]
+        return enriched[0] if np.ndim(database_inputs) == 0 else enriched
     real_estate_df = (
         database_inputs
         .copy()
-        .assign(
-            # section "input_buying_hypothesis"
-            frais_d_acquisition = lambda x: x["frais_d_acquisition_(prct_prix_d_achat)"] * x["prix_d_achat"],
-            prix_acquisition = lambda x: x["prix_d_achat"] + x["frais_d_acquisition"] + x["travaux"],
-            # section "input_financial_hypothesis"
-            ltv = lambda x: (x["prix_acquisition"] - x["apport"]) / x["prix_acquisition"],
-            montant_emprunté = lambda x: x["ltv"] * x["prix_acquisition"],
-            mensualité = lambda x: PMT(C=x["montant_emprunté"], n=x["durée_de_crédit_(année)"]*12, t=x["taux_d_emprunt"]),
-            # section "input_market_hypothesis"
-            capital_restant_dû = lambda x: - compute_remaining_capital_after_y_years(C=x["montant_emprunté"], M=x["mensualité"], t=x["taux_d_emprunt"], y=x["durée_de_détention_(année)"]),
-            valeur_de_sortie = lambda x: x["valeur_vénale"] * (1+ x["market_value_growth"]) ** x["durée_de_détention_(année)"],
-            frais_de_vente = lambda x: - x["frais_de_vente_(taux)"] * x["valeur_de_sortie"],
-            valeur_nette_de_sortie = lambda x: x["valeur_de_sortie"] + x["frais_de_vente"] + x["capital_restant_dû"],
-            # section "input_annual_revenue"
-            remboursements = lambda x: - x["mensualité"] * 12,
-            # section "input_recurring_charges"
-            frais_d_entretien = lambda x: x["frais_d_entretien_(prct_prix_d_achat)"] * x["prix_d_achat"],
-            assurance_gli_pno = lambda x: x["assurance_(gli,_pno)_(prct_loyer)"] * x['loyer_mensuel'] * 12,
-            # section "input_operating_capex"
-            total_charges_récurrantes = lambda x: x["remboursements"] + x["gestion_locative"] + x["comptabilité"] + x["frais_de_copropriété"] + x["taxe_foncière"] + x["frais_d_entretien"] + x["assurance_gli_pno"]
-        )
+        .assign(**{feature: state[feature][:, 0] for feature in FEATURES})
         .rename(columns=lambda x: x.lower().replace(" ", "_").replace("'", "_"))
     )
     return real_estate_df
 
 
-def build_yearly_cashflow_df(real_estate_df: pd.DataFrame, time_horizon: int = 30) -> pd.DataFrame:
+RECURRING_CHARGES = ['gestion_locative', 'comptabilité', 'frais_de_copropriété', 'taxe_foncière', 'frais_d_entretien', 'assurance_gli_pno']
+
+CASHFLOW_LINES = [
+    # Income
+    'rent', 'vacancy', 'unpaied_rent', 'gross_effective_revenues',
+    # Recurring charges
+    *RECURRING_CHARGES, 'total_charges_récurrantes', 'net_operating_income',
+    # Non Recurring charges
+    'apport', 'travaux_non_récurrents', 'total_non_recurring_charges',
+    # Debt
+    'remboursements', 'cash_flow_after_debt', 'cumulative_cash_flow_after_debt',
+    # Selling hypothesis
+    'valeur_vénale', 'valeur_vénale_à_la_vente', 'frais_de_vente', 'capital_restant_dû', 'capital_residuel_à_la_vente', 'valeur_nette_de_sortie',
+    # Net Cash Flow
+    'net_cash_flow', 'cumulative_net_cash_flow'
+]
+
+CUMULATIVE_LINES = ['cumulative_cash_flow_after_debt', 'cumulative_net_cash_flow']
+
+
+# Market hypotheses that can be given as yearly paths instead of constants
+YEARLY_PATH_INPUTS = ['market_value_growth', 'market_rent_growth', 'property_tax_growth', 'vacancy', 'loyers_impayés']
+
+
+# Derived values as a dependency graph (see utils.feature_graph), evaluated by create_additional_features, build_cashflow_arrays
+# and, incrementally, by cashflow_state. Nodes work on arrays with one row per property: inputs are (n, 1) columns and
+# yearly values (n, time_horizon + 1) arrays. Node names:
+# - FEATURES: the columns added by create_additional_features
+# - 'yearly:{input}': the YEARLY_PATH_INPUTS and taux_d_emprunt, constant unless a yearly path is given
+# - 'debt_schedule': payments and balances of variable-rate loans (None unless a taux_d_emprunt path is given)
+# - 'growth:{input}': cumulative growth factors
+# - 'line:{line}': CASHFLOW_LINES before the years after the detention period are removed, 'cashflow:{line}': after
+# - 'kpi:{kpi}': irr, irr_converged, van, eqx and min_cash_flow (see financial.compute_cashflow_kpis)
+# Extra inputs: 'years' (the (1, time_horizon + 1) year numbers), 'shape' (of the yearly arrays) and 'yearly_paths' (names of
+# the YEARLY_PATH_INPUTS given as paths).
+TRANSFORMATIONS = Graph()
+_node = TRANSFORMATIONS.node
+
+FEATURES = [
+    'frais_d_acquisition', 'prix_acquisition', 'ltv', 'montant_emprunté', 'mensualité', 'capital_restant_dû', 'valeur_de_sortie',
+    'frais_de_vente', 'valeur_nette_de_sortie', 'remboursements', 'frais_d_entretien', 'assurance_gli_pno', 'total_charges_récurrantes'
+]
+
+# section "input_buying_hypothesis"
+_node('frais_d_acquisition', 'frais_d_acquisition_(prct_prix_d_achat)', 'prix_d_achat')(lambda rate, prix_d_achat: rate * prix_d_achat)
+_node('prix_acquisition', 'prix_d_achat', 'frais_d_acquisition', 'travaux')(lambda prix_d_achat, frais, travaux: prix_d_achat + frais + travaux)
+# section "input_financial_hypothesis"
+_node('ltv', 'prix_acquisition', 'apport')(lambda prix_acquisition, apport: (prix_acquisition - apport) / prix_acquisition)
+_node('montant_emprunté', 'ltv', 'prix_acquisition')(lambda ltv, prix_acquisition: ltv * prix_acquisition)
+_node('mensualité', 'montant_emprunté', 'taux_d_emprunt', 'durée_de_crédit_(année)')(
+    lambda capital, rate, duration: payment(capital=capital, yearly_rate=rate, n_months=duration * 12)
+)
+# section "input_market_hypothesis"
+_node('capital_restant_dû', 'montant_emprunté', 'taux_d_emprunt', 'durée_de_crédit_(année)', 'durée_de_détention_(année)')(
+    lambda capital, rate, duration, detention: - remaining_balance(capital=capital, yearly_rate=rate, n_months=duration * 12, months=detention * 12)
+)
+_node('valeur_de_sortie', 'valeur_vénale', 'market_value_growth', 'durée_de_détention_(année)')(
+    lambda valeur_vénale, growth, detention: valeur_vénale * (1 + growth) ** detention
+)
+_node('frais_de_vente', 'frais_de_vente_(taux)', 'valeur_de_sortie')(lambda rate, valeur_de_sortie: - rate * valeur_de_sortie)
+_node('valeur_nette_de_sortie', 'valeur_de_sortie', 'frais_de_vente', 'capital_restant_dû')(lambda *amounts: sum(amounts))
+# section "input_annual_revenue"
+_node('remboursements', 'mensualité')(lambda mensualité: - mensualité * 12)
+# section "input_recurring_charges"
+_node('frais_d_entretien', 'frais_d_entretien_(prct_prix_d_achat)', 'prix_d_achat')(lambda rate, prix_d_achat: rate * prix_d_achat)
+_node('assurance_gli_pno', 'assurance_(gli,_pno)_(prct_loyer)', 'loyer_mensuel')(lambda rate, loyer_mensuel: rate * loyer_mensuel * 12)
+# section "input_operating_capex"
+_node('total_charges_récurrantes', 'remboursements', *RECURRING_CHARGES)(lambda *charges: sum(charges))
+
+
+def _growth_index(name, base_year):
+    """Cumulative growth factor, 1 up to base_year"""
+    def growth_index(rate, years, yearly_paths):
+        if name in yearly_paths:
+            return np.where(years > base_year, 1 + rate, 1.).cumprod(axis=1)
+        return (1 + rate) ** (years - base_year)
+    return growth_index
+
+
+def _debt_schedule(capital, rates, duration, yearly_paths):
+    """Yearly payments and balances of the loans when their rate is given as a yearly path, None for fixed-rate loans"""
+    if 'taux_d_emprunt' not in yearly_paths:
+        return None
+    return variable_rate_schedule(capital, rates, duration * 12)
+
+
+for _name in YEARLY_PATH_INPUTS:
+    _node(f'yearly:{_name}', _name)(lambda value: value)
+_node('growth:market_rent_growth', 'yearly:market_rent_growth', 'years', 'yearly_paths')(_growth_index('market_rent_growth', 1))
+_node('growth:property_tax_growth', 'yearly:property_tax_growth', 'years', 'yearly_paths')(_growth_index('property_tax_growth', 1))
+_node('growth:market_value_growth', 'yearly:market_value_growth', 'years', 'yearly_paths')(_growth_index('market_value_growth', 0))
+# The loan rate can also be given as a yearly path (variable, capped or renegotiated loans, see utils.rate_paths)
+_node('yearly:taux_d_emprunt', 'taux_d_emprunt')(lambda value: value)
+_node('debt_schedule', 'montant_emprunté', 'yearly:taux_d_emprunt', 'durée_de_crédit_(année)', 'yearly_paths')(_debt_schedule)
+_node('first_year', 'years')(lambda years: years == 0)
+_node('held', 'years', 'durée_de_détention_(année)')(lambda years, detention: years <= detention)
+_node('selling_year', 'years', 'durée_de_détention_(année)')(lambda years, detention: years == detention)
+
+# Income
+_node('line:rent', 'first_year', 'loyer_mensuel', 'growth:market_rent_growth')(
+    lambda first_year, loyer_mensuel, growth: np.where(first_year, 0, loyer_mensuel * 12 * growth)
+)
+_node('line:vacancy', 'line:rent', 'yearly:vacancy')(lambda rent, vacancy: -rent * vacancy)
+_node('line:unpaied_rent', 'line:rent', 'yearly:loyers_impayés')(lambda rent, loyers_impayés: -rent * loyers_impayés)
+_node('line:gross_effective_revenues', 'line:rent', 'line:vacancy', 'line:unpaied_rent')(lambda *lines: sum(lines))
+# Recurring charges
+for _charge in RECURRING_CHARGES:
+    _node(f'line:{_charge}', 'first_year', _charge, 'growth:property_tax_growth')(
+        lambda first_year, charge, growth: np.where(first_year, 0, -charge * growth)
+    )
+_node('line:total_charges_récurrantes', *(f'line:{charge}' for charge in RECURRING_CHARGES))(lambda *lines: sum(lines))
+_node('line:net_operating_income', 'line:gross_effective_revenues', 'line:total_charges_récurrantes')(lambda *lines: sum(lines))
+# Non Recurring charges
+_node('line:apport', 'first_year', 'apport')(lambda first_year, apport: np.where(first_year, -apport, 0))
+_node('line:travaux_non_récurrents', 'first_year', 'years', 'fréquence', 'travaux_non_récurrent')(
+    lambda first_year, years, frequency, travaux: np.where(
+        (frequency > 0) & ~first_year & (years % np.where(frequency > 0, frequency, 1) == 0), -travaux, 0
+    )
+)
+_node('line:total_non_recurring_charges', 'line:apport', 'line:travaux_non_récurrents')(lambda *lines: sum(lines))
+# Debt
+_node('line:remboursements', 'first_year', 'years', 'durée_de_crédit_(année)', 'remboursements', 'debt_schedule')(
+    lambda first_year, years, duration, remboursements, schedule: (
+        np.where(first_year | (years > duration), 0, remboursements) if schedule is None else -schedule['payments']
+    )
+)
+_node('line:cash_flow_after_debt', 'line:net_operating_income', 'line:total_non_recurring_charges', 'line:remboursements')(lambda *lines: sum(lines))
+# Selling hypothesis
+_node('line:valeur_vénale', 'valeur_vénale', 'growth:market_value_growth')(lambda valeur_vénale, growth: valeur_vénale * growth)
+_node('line:valeur_vénale_à_la_vente', 'selling_year', 'line:valeur_vénale')(lambda selling_year, value: np.where(selling_year, value, 0))
+_node('line:frais_de_vente', 'line:valeur_vénale_à_la_vente', 'frais_de_vente_(taux)')(lambda value, rate: -value * rate)
+_node('line:capital_restant_dû', 'montant_emprunté', 'taux_d_emprunt', 'durée_de_crédit_(année)', 'years', 'debt_schedule')(
+    lambda capital, rate, duration, years, schedule: (
+        -remaining_balance(capital=capital, yearly_rate=rate, n_months=duration * 12, months=years * 12)
+        if schedule is None else -schedule['balance']
+    )
+)
+_node('line:capital_residuel_à_la_vente', 'selling_year', 'line:capital_restant_dû')(lambda selling_year, value: np.where(selling_year, value, 0))
+_node('line:valeur_nette_de_sortie', 'line:valeur_vénale_à_la_vente', 'line:frais_de_vente', 'line:capital_residuel_à_la_vente')(lambda *lines: sum(lines))
+# Net Cash Flow
+_node('line:net_cash_flow', 'line:cash_flow_after_debt', 'line:valeur_nette_de_sortie')(lambda *lines: sum(lines))
+
+
+def _held_values(values, held, shape):
+    """Remove the years after the detention period"""
+    values = np.where(held, values, 0.)
+    return values if values.shape == shape else np.broadcast_to(values, shape)
+
+
+for _line in CASHFLOW_LINES:
+    if _line not in CUMULATIVE_LINES:
+        _node(f'cashflow:{_line}', f'line:{_line}', 'held', 'shape')(_held_values)
+_node('cashflow:cumulative_cash_flow_after_debt', 'cashflow:cash_flow_after_debt')(lambda values: values.cumsum(axis=1))
+_node('cashflow:cumulative_net_cash_flow', 'cashflow:net_cash_flow')(lambda values: values.cumsum(axis=1))
+
+# KPIs
+_node('kpi:solve_irr', 'cashflow:net_cash_flow')(solve_irr)
+_node('kpi:irr', 'kpi:solve_irr')(lambda solved: solved[0])
+_node('kpi:irr_converged', 'kpi:solve_irr')(lambda solved: solved[1])
+_node('kpi:van', 'taux_d_actualisation', 'cashflow:net_cash_flow')(lambda rate, net_cash_flow: npv(rate[:, 0], net_cash_flow))
+_node('kpi:eqx', 'cashflow:net_cash_flow', 'apport')(lambda net_cash_flow, apport: eqx(net_cash_flow, apport[:, 0]))
+_node('kpi:min_cash_flow', 'cashflow:net_cash_flow', 'held')(
+    lambda net_cash_flow, held: np.where(held, net_cash_flow, np.inf)[:, 1:].min(axis=1)
+)
+
+
+def graph_inputs(real_estate_df, time_horizon: int = 30, yearly_paths: dict = None, exclude=()) -> dict:
+    """
+    Build the inputs of TRANSFORMATIONS from a real estate dataframe or property records: every numeric column (or field)
+    but the exclude ones as a (n, 1) float array, the yearly_paths (see build_cashflow_arrays) as 'yearly:{input}' values,
+    and the years, shape and yearly_paths inputs.
+    """
+    yearly_paths = yearly_paths or {}
+    if isinstance(real_estate_df, pd.DataFrame):
+        numeric_df = real_estate_df.select_dtypes('number')
+        numeric = numeric_df.to_numpy(dtype=float)  # a single conversion, sliced into columns
+        values = {column: numeric[:, i:i + 1] for i, column in enumerate(numeric_df.columns) if column not in exclude}
+        n_rows = len(real_estate_df)
+    else:
+        # Float fields of records are read as strided views, without any copy
+        records = as_records(real_estate_df)
+        values = {
+            name: np.asarray(records[name], dtype=float)[:, None]
+            for name in records.dtype.names if records.dtype[name].kind in 'biuf' and name not in exclude
+        }
+        n_rows = len(records)
+    values.update({f'yearly:{name}': np.asarray(path, dtype=float) for name, path in yearly_paths.items()})
+    values['years'] = np.arange(time_horizon + 1)[None, :]
+    values['shape'] = np.broadcast_shapes((n_rows, time_horizon + 1), *(np.shape(path) for path in yearly_paths.values()))
+    values['yearly_paths'] = frozenset(yearly_paths)
+    return values
+
+
+def cashflow_state(real_estate_df, time_horizon: int = 30) -> GraphState:
+    """
+    Return a memoized evaluation of TRANSFORMATIONS for the properties of a real estate dataframe or property records
+    (before or after create_additional_features, the features being recomputed from the inputs). Read cashflow lines with
+    state['cashflow:{line}'] and KPIs with state['kpi:{kpi}']; after state.update(**{input: (n, 1) array}), only the
+    nodes depending on the changed inputs are recomputed, e.g. moving taux_d_actualisation only recomputes kpi:van.
+    """
+    return GraphState(TRANSFORMATIONS, graph_inputs(real_estate_df, time_horizon, exclude=FEATURES))
+
+
+
+@traced("build_cashflow_arrays")
+def build_cashflow_arrays(real_estate_df, time_horizon: int = 30, yearly_paths: dict = None) -> dict:
+    """
+    This function projects the yearly cashflow of every property of an enriched real estate dataframe in a single pass.
+    It is the batch counterpart of build_yearly_cashflow_df: each line item is computed for all properties and all years at once
+    as a 2-D NumPy block, instead of running one single-row DataFrame pipeline per property.
+    
+    Parameters:
+    - real_estate_df (pd.DataFrame): The output of create_additional_features, with one row per property (or its records).
+    - time_horizon (int): The number of years to project the cashflow.
+    - yearly_paths (dict): Optional yearly values replacing some YEARLY_PATH_INPUTS columns, as arrays broadcastable to
+      (n_rows, time_horizon + 1), column j holding the rate of year j. Growth rates are then compounded year by year.
+      With a single property and (n_paths, time_horizon + 1) paths, every path is projected at once (Monte Carlo).
+      A 'taux_d_emprunt' path gives the loan rate of every year: remboursements and capital_restant_dû then follow
+      amortization.variable_rate_schedule (the features keep the fixed-rate mensualité and capital_restant_dû).
+    
+    Returns:
+    - dict: A mapping from each line item of CASHFLOW_LINES to a float array of shape (n_properties, time_horizon + 1)
+      (or the broadcast shape with yearly_paths), column j holding year j. Lines follow the definitions of build_yearly_cashflow_df.
+    
+    Per-property durations are handled by masks:
+    - remboursements are only paid from year 1 up to each property's "durée_de_crédit_(année)".
+    - the sale happens in each property's "durée_de_détention_(année)" year, and every value is set to 0 after it
+      (except cumulative_net_cash_flow and cumulative_cash_flow_after_debt, which stay flat).
+    """
+    values = graph_inputs(real_estate_df, time_horizon, yearly_paths)
+    count(rows=values['shape'][0], years=values['shape'][1])
+    lines = GraphState(TRANSFORMATIONS, values).evaluate([f'cashflow:{name}' for name in CASHFLOW_LINES])
+    return {name: lines[f'cashflow:{name}'] for name in CASHFLOW_LINES}
+
+
+def build_portfolio_cashflow_df(real_estate_df: pd.DataFrame, time_horizon: int = 30) -> pd.DataFrame:
+    """
+    This function builds the yearly cashflow of every property of an enriched real estate dataframe as a long dataframe.
+    
+    Parameters:
+    - real_estate_df (pd.DataFrame): The output of create_additional_features, with one row per property.
+    - time_horizon (int): The number of years to project the cashflow.
+    
+    Returns:
+    - pd.DataFrame: A dataframe indexed by (real_estate_df index, year) with one column per line item of CASHFLOW_LINES.
+      Only the years up to each property's detention period are kept, as in build_yearly_cashflow_df.
+    """
+    lines = build_cashflow_arrays(real_estate_df, time_horizon)
+    years = np.arange(time_horizon + 1)
+    portfolio_cashflow_df = pd.DataFrame(
+        {name: values.ravel() for name, values in lines.items()},
+        index=pd.MultiIndex.from_product([real_estate_df.index, years], names=[real_estate_df.index.name, 'year'])
+    )
+    held = (years[None, :] <= real_estate_df['durée_de_détention_(année)'].to_numpy()[:, None]).ravel()
+    return portfolio_cashflow_df[held]
+
+
+@traced("build_yearly_cashflow_df")
+def build_yearly_cashflow_df(real_estate_df, time_horizon: int = 30) -> pd.DataFrame:
     """
     This function builds a yearly cashflow dataframe from a real estate dataframe.
     It is used to check the financial feasibility of the investment.
     It is a yearly cashflow, with a row for each year of the time horizon and the following columns (sliced in different sections):
     
     Parameters:
-    - real_estate_df (pd.DataFrame): The input dataframe containing initial real estate data.
+    - real_estate_df (pd.DataFrame): The input dataframe containing initial real estate data (or a property record).
     - time_horizon (int): The number of years to project the cashflow.
     
     Returns:
@@ -120,7 +375,7 @@ def build_yearly_cashflow_df(real_estate_df: pd.DataFrame, time_horizon: int = 3
     - valeur_vénale: previous year's valeur_vénale * (1 + real_estate_df["market_value_growth"]), initialized with real_estate_df.loc[0, "valeur_vénale"]
     - valeur_vénale_à_la_vente: valeur_vénale only in the selling year, 0 otherwise
     - frais_de_vente: valeur_vénale_à_la_vente * real_estate_df["frais_de_vente_(taux)"]
-    - capital_restant_dû: - compute_remaining_capital_after_y_years(C=real_estate_df["montant_emprunté"], M=real_estate_df["mensualité"], t=real_estate_df["taux_d_emprunt"], y=year)
+    - capital_restant_dû: - remaining_balance(capital=real_estate_df["montant_emprunté"], yearly_rate=real_estate_df["taux_d_emprunt"], n_months=12 * real_estate_df["durée_de_crédit_(année)"], months=12 * year), 0 once the loan is repaid
     - capital_residuel_à_la_vente: capital_restant_dû only in the selling year, 0 otherwise
     - valeur_nette_de_sortie: algebric sum of valeur_vénale_à_la_vente, frais_de_vente and capital_restant_dû_à_la_vente only in the selling year, 0 otherwise
 
@@ -130,70 +385,24 @@ def build_yearly_cashflow_df(real_estate_df: pd.DataFrame, time_horizon: int = 3
 
     Every value is set to 0 after the selling year (except cumulative_net_cash_flow and cumulative_cash_flow_after_debt).
     """
-    # Initialize the DataFrame with years and apply transformations using operator chaining
-    yearly_cashflow_df = (
-        pd.DataFrame({'year': range(time_horizon + 1)})
-        # Income
-        .assign(
-            rent=lambda df: np.where(df['year'] == 0, 0, real_estate_df.loc[0, 'loyer_mensuel'] * 12 * (1 + real_estate_df.loc[0, 'market_rent_growth']) ** (df['year'] - 1)),
-            vacancy=lambda df: -df['rent'] * real_estate_df.loc[0, 'vacancy'],
-            unpaied_rent=lambda df: -df['rent'] * real_estate_df.loc[0, 'loyers_impayés'],
-            gross_effective_revenues=lambda df: df['rent'] + df['vacancy'] + df['unpaied_rent']
-        )
-        # Recurring charges
-        .assign(**{
-            charge: lambda df, charge=charge: np.where(df['year'] == 0, 0, -real_estate_df.loc[0, charge] * (1 + real_estate_df.loc[0, 'property_tax_growth']) ** (df['year'] - 1))
-            for charge in ['gestion_locative', 'comptabilité', 'frais_de_copropriété', 'taxe_foncière', 'frais_d_entretien', 'assurance_gli_pno']
-        })
-        .assign(
-            total_charges_récurrantes=lambda df: df[['gestion_locative', 'comptabilité', 'frais_de_copropriété', 'taxe_foncière', 'frais_d_entretien', 'assurance_gli_pno']].sum(axis=1),
-            net_operating_income=lambda df: df['gross_effective_revenues'] + df['total_charges_récurrantes']
-        )
-        # Non Recurring charges
-        .assign(
-            apport=lambda df: np.where(df['year'] == 0, -real_estate_df.loc[0, 'apport'], 0),
-            travaux_non_récurrents=lambda df: np.where((df['year'] % real_estate_df.loc[0, 'fréquence'] == 0) & (df['year'] != 0), -real_estate_df.loc[0, 'travaux_non_récurrent'], 0),
-            total_non_recurring_charges=lambda df: df['apport'] + df['travaux_non_récurrents']
-        )
-        # Debt
-        .assign(
-            remboursements=lambda df: np.where((df['year'] == 0) | (df['year'] > real_estate_df.loc[0, 'durée_de_crédit_(année)']), 0, real_estate_df.loc[0, 'remboursements']),
-            cash_flow_after_debt=lambda df: df['net_operating_income'] + df['total_non_recurring_charges'] + df['remboursements'],
-            cumulative_cash_flow_after_debt=lambda df: df['cash_flow_after_debt'].cumsum()
-        )
-        # Selling hypothesis
-        .assign(
-            valeur_vénale=lambda df: real_estate_df.loc[0, 'valeur_vénale'] * (1 + real_estate_df.loc[0, 'market_value_growth']) ** df['year'],
-            valeur_vénale_à_la_vente=lambda df: np.where(df['year'] == real_estate_df.loc[0, 'durée_de_détention_(année)'], df['valeur_vénale'], 0),
-            frais_de_vente=lambda df: -df['valeur_vénale_à_la_vente'] * real_estate_df.loc[0, 'frais_de_vente_(taux)'],
-            capital_restant_dû=lambda df: df.apply(lambda row: -compute_remaining_capital_after_y_years(
-                C=real_estate_df.loc[0, 'montant_emprunté'],
-                M=real_estate_df.loc[0, 'mensualité'],
-                t=real_estate_df.loc[0, 'taux_d_emprunt'],
-                y=row['year']
-            ), axis=1),
-            capital_residuel_à_la_vente=lambda df: np.where(df['year'] == real_estate_df.loc[0, 'durée_de_détention_(année)'], df['capital_restant_dû'], 0),
-            valeur_nette_de_sortie=lambda df: np.where(
-                df['year'] == real_estate_df.loc[0, 'durée_de_détention_(année)'],
-                df['valeur_vénale_à_la_vente'] + df['frais_de_vente'] + df['capital_residuel_à_la_vente'],
-                0
-            )
-        )
-        # Net Cash Flow
-        .assign(
-            net_cash_flow=lambda df: df['cash_flow_after_debt'] + df['valeur_nette_de_sortie'],
-            cumulative_net_cash_flow=lambda df: df['net_cash_flow'].cumsum()
-        )        
-        # Remove years after the detention period
-        .loc[lambda df: df['year'] <= real_estate_df.loc[0, 'durée_de_détention_(année)']]
-        # Map the 'year' column to 'year_{i}' format and set it as the index
-        .assign(year=lambda df: df['year'].apply(lambda i: f'year_{i}'))
-        .set_index('year')
-    )
-    return yearly_cashflow_df
+    if isinstance(real_estate_df, pd.DataFrame):
+        first_property, detention_period = real_estate_df.iloc[:1], real_estate_df.iloc[0]['durée_de_détention_(année)']
+    else:
+        first_property = as_records(real_estate_df)[:1]
+        detention_period = first_property[0]['durée_de_détention_(année)']
+    lines = build_cashflow_arrays(first_property, time_horizon)
+    return lines_to_yearly_cashflow_df(lines, int(detention_period))
 
 
-def query_real_estate_df():
-    real_estate_df = download_dataframe("02data.csv")
-    real_estate_id = st.selectbox("Select a real estate", real_estate_df['real_estate_id'].unique())
-    return real_estate_df[real_estate_df['real_estate_id'] == real_estate_id].sort_values('timestamp', ascending=False).iloc[:1].reset_index(drop=True)
+def lines_to_yearly_cashflow_df(lines: dict, detention_period: int, row: int = 0) -> pd.DataFrame:
+    """
+    Build the yearly cashflow dataframe of build_yearly_cashflow_df from projected lines (build_cashflow_arrays, or
+    {line: state[f'cashflow:{line}']} of a cashflow_state), keeping one row of the arrays up to the detention period.
+    """
+    yearly_cashflow_df = (
+        pd.DataFrame({name: values[row, :detention_period + 1] for name, values in lines.items()})
+        # Map the year to 'year_{i}' format and set it as the index
+        .rename(index=lambda i: f'year_{i}')
+        .rename_axis('year')
+    )
+    return yearly_cashflow_df
\ No newline at end of file
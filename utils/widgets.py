@@ -0,0 +1,68 @@
+import datetime
+import os
+from contextlib import contextmanager
+
+import streamlit as st
+import pandas as pd
+
+from utils.database import get_latest_index_version, load_latest_index
+from utils.search import QUERY_HELP, search_properties
+from utils.tracing import export_jsonl, spans_to_jsonl, trace
+
+
+# When set, the spans of every traced rerun are appended to this JSON lines file
+TRACE_FILE_ENV = "BP_INVEST_TRACE_FILE"
+
+
+def query_real_estate_df() -> pd.DataFrame:
+    """
+    Select a real estate in a selectbox and return its latest version as a single-row dataframe.
+    A search box (see search.parse_query) narrows the selectbox to the matching real estates, in the order of the query.
+    """
+    query = st.text_input("Search", placeholder="Dreux prix<120k irr>5% sort:irr top:10", help=QUERY_HELP)
+    # The latest index is loaded once per rerun for the selectbox, the search and the selected version. Its generation
+    # is read first, so the loaded table is at least as recent as the version the search index is stamped with.
+    version = get_latest_index_version()
+    latest_df = load_latest_index()
+    real_estate_ids = latest_df.index.tolist()
+    if query.strip():
+        try:
+            results = search_properties(query, latest_df, version)
+        except ValueError as e:
+            st.warning(str(e))
+        else:
+            if results.empty:
+                st.info("No real estate matches the search")
+                st.stop()
+            st.caption(f"{len(results)} matching real estate(s)")
+            real_estate_ids = results['real_estate_id'].tolist()
+    real_estate_id = st.selectbox("Select a real estate", real_estate_ids)
+    return latest_df.loc[[real_estate_id]].reset_index(drop=True)
+
+
+@contextmanager
+def performance_panel(page: str):
+    """
+    Trace the stages run inside the block (downloads, parsing, transformations, IRR, rendering) and show them in the sidebar.
+    Tracing only happens when the sidebar "Performance" checkbox is ticked, otherwise the block runs untouched.
+    """
+    if not st.sidebar.checkbox("Performance", key="performance_panel"):
+        yield
+        return
+    rerun = datetime.datetime.now().isoformat(timespec='milliseconds')
+    with trace() as spans:
+        yield
+    if os.environ.get(TRACE_FILE_ENV):
+        export_jsonl(spans, os.environ[TRACE_FILE_ENV], page=page, rerun=rerun)
+    with st.sidebar:
+        st.markdown("### Performance")
+        if not spans:
+            st.caption("No traced stage in this rerun")
+            return
+        spans_df = pd.DataFrame([span.to_dict() for span in spans])
+        total = sum(span.seconds for span in spans if span.depth == 0)
+        st.metric("Traced time", f"{1000 * total:,.0f} ms")
+        spans_df['name'] = ["  " * depth + name for depth, name in zip(spans_df['depth'], spans_df['name'])]
+        spans_df['ms'] = 1000 * spans_df['seconds']
+        st.dataframe(spans_df.drop(columns=['depth', 'start', 'seconds']).set_index('name'), use_container_width=True)
+        st.download_button("Export (JSON lines)", spans_to_jsonl(spans, page=page, rerun=rerun), file_name=f"trace_{page}.jsonl")